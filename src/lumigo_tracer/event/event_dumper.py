@@ -1,4 +1,3 @@
-import copy
 import os
 from abc import ABC, abstractmethod
 from collections import OrderedDict
@@ -176,21 +175,27 @@ class ApiGWHandler(EventParseHandler):
         # Add order keys
         for order_key in API_GW_KEYS_ORDER:
             if event.get(order_key):
-                new_event[order_key] = copy.deepcopy(event[order_key])
-        # Remove requestContext keys
+                new_event[order_key] = event[order_key]
+        # Remove requestContext keys (into a new dict, the event itself is not changed)
         if new_event.get("requestContext"):
-            for rc_key in new_event["requestContext"].copy():
-                if rc_key.lower() not in API_GW_REQUEST_CONTEXT_FILTER_KEYS:
-                    new_event["requestContext"].pop(rc_key, None)
+            new_event["requestContext"] = {
+                rc_key: value
+                for rc_key, value in new_event["requestContext"].items()
+                if rc_key.lower() in API_GW_REQUEST_CONTEXT_FILTER_KEYS
+            }
         # Remove headers keys
         if new_event.get("headers"):
-            for h_key in new_event["headers"].copy():
-                if any(h_key.lower().startswith(s) for s in API_GW_PREFIX_KEYS_HEADERS_DELETE_KEYS):
-                    new_event["headers"].pop(h_key, None)
+            new_event["headers"] = {
+                h_key: value
+                for h_key, value in new_event["headers"].items()
+                if not any(
+                    h_key.lower().startswith(s) for s in API_GW_PREFIX_KEYS_HEADERS_DELETE_KEYS
+                )
+            }
         # Add all other keys
         for key in event.keys():
             if (key not in API_GW_KEYS_ORDER) and (key not in API_GW_KEYS_DELETE_KEYS):
-                new_event[key] = copy.deepcopy(event[key])
+                new_event[key] = event[key]
         return new_event
 
 
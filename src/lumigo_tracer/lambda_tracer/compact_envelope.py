@@ -0,0 +1,60 @@
+"""
+An opt-in request format that sends the fields which are shared by all the spans only once.
+
+Every span is joined with the `base_msg` of the invocation (container id, transaction id, account,
+region, parent id, token and the tracer version), so the same fields are repeated in every span.
+Instead of a json list of the spans, the request is:
+    {"envelopeVersion": 1, "shared": {<shared fields>}, "spans": [<span without the shared fields>]}
+The edge expands every span by joining it (recursively) with the shared fields.
+
+When the envelope is enabled, a span is serialized field by field, so the envelope is built
+from the dumps of the fields instead of dumping the spans again.
+"""
+import os
+from typing import Any, Dict, Iterable, List
+
+from lumigo_tracer.lumigo_utils import aws_dump
+
+COMPACT_ENVELOPE_VERSION = 1
+
+
+def should_use_compact_envelope() -> bool:
+    return os.environ.get("LUMIGO_COMPACT_ENVELOPE", "").lower() == "true"
+
+
+def dump_span_fields(span: Dict[str, Any]) -> Dict[str, str]:
+    """
+    :return: The dump of every top-level field of the span (as `"key": value`), by its key.
+    """
+    return {key: f"{aws_dump(key)}: {aws_dump(value)}" for key, value in span.items()}
+
+
+def join_span_fields(field_dumps: Iterable[str]) -> str:
+    """
+    :return: The dump of the span with these fields, identical to `aws_dump` of the span.
+    """
+    return "{" + ", ".join(field_dumps) + "}"
+
+
+def dump_compact_envelope(spans_fields: List[Dict[str, str]]) -> str:
+    """
+    Build the envelope from the field dumps of the spans (see `dump_span_fields`), without dumping again.
+    The shared fields are the top-level fields that have the same dump in all the spans.
+    """
+    shared: Dict[str, str] = {}
+    if len(spans_fields) > 1:
+        first, rest = spans_fields[0], spans_fields[1:]
+        shared = {
+            key: dumped
+            for key, dumped in first.items()
+            if all(fields.get(key) == dumped for fields in rest)
+        }
+    spans = [
+        join_span_fields(dumped for key, dumped in fields.items() if key not in shared)
+        for fields in spans_fields
+    ]
+    return (
+        f'{{"envelopeVersion": {COMPACT_ENVELOPE_VERSION}, '
+        f'"shared": {join_span_fields(shared.values())}, '
+        f'"spans": [{", ".join(spans)}]}}'
+    )
@@ -0,0 +1,65 @@
+"""
+A preset zlib dictionary for compressing the spans that we send to the edge.
+
+The edge decompresses a request with the dictionary that matches the id in its header,
+so a published version must never change - add a new version and bump the id instead.
+Zlib finds the strings at the end of the dictionary most cheaply, so the most common come last.
+"""
+
+COMPRESSION_DICTIONARY_ID = "1"
+
+_DICTIONARY_V1 = (
+    # Environment variables of the lambda runtime (inside the function span's "envs")
+    '\\"AWS_LAMBDA_FUNCTION_VERSION\\": \\"$LATEST\\", \\"AWS_LAMBDA_INITIALIZATION_TYPE\\": '
+    '\\"on-demand\\", \\"AWS_LAMBDA_RUNTIME_API\\": \\"127.0.0.1:9001\\", '
+    '\\"AWS_XRAY_CONTEXT_MISSING\\": \\"LOG_ERROR\\", \\"AWS_XRAY_DAEMON_ADDRESS\\": '
+    '\\"169.254.79.129:2000\\", \\"LAMBDA_RUNTIME_DIR\\": \\"/var/runtime\\", '
+    '\\"LAMBDA_TASK_ROOT\\": \\"/var/task\\", \\"LANG\\": \\"en_US.UTF-8\\", \\"LD_LIBRARY_PATH\\": '
+    '\\"/var/lang/lib:/lib64:/usr/lib64:/var/runtime:/var/runtime/lib:/var/task:/var/task/lib:'
+    '/opt/lib\\", \\"PATH\\": \\"/var/lang/bin:/usr/local/bin:/usr/bin/:/bin:/opt/bin\\", '
+    '\\"PYTHONPATH\\": \\"/var/runtime\\", \\"TZ\\": \\":UTC\\", \\"_HANDLER\\": '
+    '\\"lumigo_tracer._handler\\", \\"AWS_ACCESS_KEY_ID\\": \\"****\\", \\"AWS_SECRET_ACCESS_KEY\\": '
+    '\\"****\\", \\"AWS_SESSION_TOKEN\\": \\"****\\", \\"AWS_DEFAULT_REGION\\": \\"us-east-1\\", '
+    '\\"AWS_EXECUTION_ENV\\": \\"AWS_Lambda_python3.9\\", \\"AWS_LAMBDA_FUNCTION_MEMORY_SIZE\\": '
+    '\\"AWS_LAMBDA_LOG_GROUP_NAME\\": \\"/aws/lambda/\\", \\"AWS_LAMBDA_LOG_STREAM_NAME\\": '
+    '\\"AWS_LAMBDA_FUNCTION_NAME\\": \\"LUMIGO_TRACER_TOKEN\\": \\"_X_AMZN_TRACE_ID\\": '
+    '\\"Root=1-; Parent=; Sampled=0;Lineage=\\", \\"AWS_REGION\\": \\"us-east-1\\", '
+    # Events and triggers
+    '"triggeredBy": "apigw", "extra": {"httpMethod": "GET", "resource": "", "api": "", "stage": '
+    '"triggeredBy": "sqs", "arn": "arn:aws:sqs:us-east-1:", "triggeredBy": "dynamodb", '
+    '"triggeredBy": "sns", "triggeredBy": "s3", "triggeredBy": "eventBridge", '
+    '"fromMessageIds": [], "targetId": null, "approxEventCreationTime": '
+    '"{\\"Records\\": [{\\"messageId\\": \\"\\", \\"receiptHandle\\": \\"\\", \\"body\\": \\"\\", '
+    '\\"eventSource\\": \\"aws:sqs\\", \\"eventSourceARN\\": \\"arn:aws:sqs:us-east-1:\\", '
+    '\\"awsRegion\\": \\"us-east-1\\"}]}", '
+    '"{\\"resource\\": \\"\\", \\"path\\": \\"/\\", \\"httpMethod\\": \\"GET\\", '
+    '\\"requestContext\\": {\\"requestId\\": \\"\\", \\"stage\\": \\"\\"}, '
+    '\\"queryStringParameters\\": null, \\"pathParameters\\": null, \\"body\\": null}", '
+    # AWS services called through http
+    '"dynamodb.us-east-1.amazonaws.com", "sqs.us-east-1.amazonaws.com", "s3.amazonaws.com", '
+    '"sns.us-east-1.amazonaws.com", "lambda.us-east-1.amazonaws.com", "events.us-east-1.amazonaws.com", '
+    '"resourceName": "", "resourceNames": [], "dynamodbMethod": "PutItem", "awsServiceData": {}, '
+    '\\"x-amz-target\\": \\"DynamoDB_20120810.\\", \\"x-amz-date\\": \\"\\", \\"x-amzn-requestid\\": '
+    '\\"x-amz-security-token\\": \\"****\\", \\"authorization\\": \\"****\\", '
+    '\\"x-amz-crc32\\": \\"\\", \\"x-amzn-trace-id\\": \\"Root=1-\\", \\"date\\": \\"\\", '
+    '\\"server\\": \\"Server\\", \\"connection\\": \\"keep-alive\\", \\"user-agent\\": '
+    '\\"Boto3/ Python/3.9 Linux/ exec-env/AWS_Lambda_python3.9 Botocore/\\", '
+    '\\"content-type\\": \\"application/x-amz-json-1.0\\", \\"content-length\\": \\"\\", '
+    '\\"content-type\\": \\"application/json\\", \\"accept-encoding\\": \\"identity\\", '
+    # The spans that SpansContainer creates
+    '"error": {"type": "Exception", "message": "", "stacktrace": "", "frames": []}, '
+    '"lumigo_execution_tags_no_scrub": [], "sending_time": , "totalSpans": , '
+    '"type": "enrichment", "invocation_id": "", "transaction_id": "", '
+    '"return_value": "null", "reporter_rtt": , "maxFinishTime": , "ended": , '
+    '"runtime": "AWS_Lambda_python3.9", "name": "", "memoryAllocated": "1024", "envs": "{", '
+    '"readiness": "cold", "readiness": "warm", "isMalformedTransactionId": false, '
+    '"manualTraces": [], "event": "{", "trigger": [{"id": "", "info": {"tracer": {"version": "1.1.'
+    '"logGroupName": "/aws/lambda/", "logStreamName": "2023/01/01/[$LATEST]", '
+    '"info": {"httpInfo": {"host": "", "request": {"headers": "{\\"host\\": \\"\\", '
+    '"body": "", "method": "POST", "uri": "", "instance_id": null}, "response": {"headers": "{'
+    '"body": "", "statusCode": 200}}, "messageId": "", "type": "http", "type": "function", '
+    '"traceId": {"Root": "1-"}, "region": "us-east-1", "parentId": "", "account": "", '
+    '{"lambda_container_id": "", "token": "t_", "transactionId": "", "started": 1, "id": "'
+)
+
+COMPRESSION_DICTIONARY: bytes = _DICTIONARY_V1.encode()
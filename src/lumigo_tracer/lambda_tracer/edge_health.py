@@ -0,0 +1,236 @@
+"""
+The health of the edge, as seen by this container across its warm invocations.
+
+We measure the round-trip time of every request to derive the timeout of the next requests,
+and stop reporting with a circuit breaker when the edge times out.
+A timeout is recorded as a round-trip time of (at least) the timeout, so the timeouts of a slow region grow.
+"""
+import enum
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+SECONDS_TO_TIMEOUT = 0.5
+EDGE_TIMEOUT = float(os.environ.get("LUMIGO_EDGE_TIMEOUT", SECONDS_TO_TIMEOUT))
+# The adaptive timeout is a multiple of the p95 round-trip time (plus the upload time of the request),
+# between these limits. EDGE_TIMEOUT is used until we have enough samples.
+MIN_EDGE_TIMEOUT = float(os.environ.get("LUMIGO_EDGE_MIN_TIMEOUT", 0.2))
+MAX_EDGE_TIMEOUT = float(os.environ.get("LUMIGO_EDGE_MAX_TIMEOUT", 2))
+EDGE_TIMEOUT_RTT_FACTOR = 2
+MIN_RTT_SAMPLES_FOR_TIMEOUT = 5
+RTT_WINDOW_SIZE = 50
+RTT_EWMA_ALPHA = 0.2
+# The upload throughput we assume when budgeting a request by the remaining time, in bytes/second
+EDGE_THROUGHPUT = float(os.environ.get("LUMIGO_EDGE_THROUGHPUT", 4 * 1024 * 1024))
+COOLDOWN_AFTER_TIMEOUT_SECONDS = 10
+MAX_COOLDOWN_AFTER_TIMEOUT_SECONDS = 300
+EDGE_HEALTH_KEY = "edgeHealth"
+
+
+class CircuitState(enum.Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class RttStats:
+    """
+    The EWMA and percentiles of the recent round-trip times to the edge, in seconds.
+    The upload time of the request is taken out of every sample, so requests of any size are comparable.
+    """
+
+    def __init__(self, window_size: int = RTT_WINDOW_SIZE, alpha: float = RTT_EWMA_ALPHA):
+        self.alpha = alpha
+        self.ewma: Optional[float] = None
+        self._samples: Deque[float] = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def record(self, rtt: float, request_size: int = 0) -> None:
+        rtt = max(rtt - request_size / EDGE_THROUGHPUT, 0)
+        with self._lock:
+            self._samples.append(rtt)
+            if self.ewma is None:
+                self.ewma = rtt
+            else:
+                self.ewma = self.alpha * rtt + (1 - self.alpha) * self.ewma
+
+    @property
+    def samples_count(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, math.ceil(percent / 100 * len(samples)) - 1)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "rttSamples": self.samples_count,
+            "rttEwmaMs": _to_ms(self.ewma),
+            "rttP50Ms": _to_ms(p50),
+            "rttP95Ms": _to_ms(p95),
+        }
+
+
+class CircuitBreaker:
+    """
+    Stops the reporting after an edge timeout.
+
+    * closed: we report as usual.
+    * open: we don't report until the cooldown ends.
+    * half-open: the cooldown ended, a single probe request is allowed.
+        If it succeeds the breaker closes, otherwise it opens again with a doubled cooldown.
+
+    `allow_request` only checks the state, the probe is taken by `start_request`
+    when the request is actually sent.
+    """
+
+    def __init__(
+        self,
+        cooldown: float = COOLDOWN_AFTER_TIMEOUT_SECONDS,
+        max_cooldown: float = MAX_COOLDOWN_AFTER_TIMEOUT_SECONDS,
+        probe_timeout: float = MAX_EDGE_TIMEOUT,
+    ):
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_started_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> CircuitState:
+        if self.opened_at is None:
+            return CircuitState.CLOSED
+        if time.time() - self.opened_at < self.cooldown:
+            return CircuitState.OPEN
+        return CircuitState.HALF_OPEN
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            return self._allow_request(time.time())
+
+    def start_request(self) -> bool:
+        """
+        :return: Whether we can send a request now. In the half-open state, it takes the probe.
+        """
+        with self._lock:
+            now = time.time()
+            if not self._allow_request(now):
+                return False
+            if self.state == CircuitState.HALF_OPEN:
+                self._probe_started_at = now
+            return True
+
+    def _allow_request(self, now: float) -> bool:
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return True
+        if state == CircuitState.OPEN:
+            return False
+        # Half-open: allow a single probe, unless the previous probe never finished
+        return not (self._probe_started_at and now - self._probe_started_at < self.probe_timeout)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._probe_started_at = None
+            self.cooldown = self.base_cooldown
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self.state == CircuitState.HALF_OPEN:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            self.consecutive_failures += 1
+            self.opened_at = time.time()
+            self._probe_started_at = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "circuitState": self.state.value,
+            "consecutiveTimeouts": self.consecutive_failures,
+            "cooldownSeconds": self.cooldown,
+        }
+
+
+edge_rtt_stats = RttStats()
+edge_circuit_breaker = CircuitBreaker()
+
+
+def get_edge_timeout(request_size: int = 0) -> float:
+    """
+    :param request_size: The size of the request, in bytes.
+    :return: The timeout of the next request to the edge, in seconds.
+        Unless LUMIGO_EDGE_TIMEOUT is configured, it is derived from the measured round-trip times.
+    """
+    if "LUMIGO_EDGE_TIMEOUT" in os.environ:
+        return EDGE_TIMEOUT
+    p95 = edge_rtt_stats.percentile(95)
+    if p95 is None or edge_rtt_stats.samples_count < MIN_RTT_SAMPLES_FOR_TIMEOUT:
+        return EDGE_TIMEOUT
+    timeout = max(p95 * EDGE_TIMEOUT_RTT_FACTOR, MIN_EDGE_TIMEOUT) + request_size / EDGE_THROUGHPUT
+    return min(timeout, MAX_EDGE_TIMEOUT)
+
+
+def get_affordable_request_size(remaining_time: float) -> int:
+    """
+    :param remaining_time: The time that we can spend on a single request, in seconds.
+    :return: The size of the biggest request that we expect to finish in time, in bytes.
+    """
+    latency = edge_rtt_stats.ewma if edge_rtt_stats.ewma is not None else MIN_EDGE_TIMEOUT
+    return max(int((remaining_time - latency) * EDGE_THROUGHPUT), 0)
+
+
+def record_edge_success(rtt: float, request_size: int = 0) -> None:
+    edge_rtt_stats.record(rtt, request_size)
+    edge_circuit_breaker.record_success()
+
+
+def record_edge_failure() -> None:
+    """
+    The edge responded with a server error, it is as unhealthy as when it times out.
+    """
+    edge_circuit_breaker.record_failure()
+
+
+def record_edge_timeout(timeout: Optional[float] = None, request_size: int = 0) -> None:
+    """
+    :param timeout: The timeout of the request. The round-trip time was at least the timeout,
+        so we record it as a sample, and the next timeouts grow (up to MAX_EDGE_TIMEOUT).
+    :param request_size: The size of the request, in bytes.
+    """
+    if timeout is not None:
+        edge_rtt_stats.record(timeout, request_size)
+    edge_circuit_breaker.record_failure()
+
+
+def get_edge_health() -> Optional[Dict[str, Any]]:
+    """
+    :return: The edge statistics to add to the enrichment span, or None if there is nothing to report.
+    """
+    if not edge_rtt_stats.samples_count and edge_circuit_breaker.state == CircuitState.CLOSED:
+        return None
+    return {
+        **edge_circuit_breaker.to_dict(),
+        **edge_rtt_stats.to_dict(),
+        "timeoutMs": _to_ms(get_edge_timeout()),
+    }
+
+
+def reset() -> None:
+    global edge_rtt_stats, edge_circuit_breaker
+    edge_rtt_stats = RttStats()
+    edge_circuit_breaker = CircuitBreaker()
+
+
+def _to_ms(seconds: Optional[float]) -> Optional[int]:
+    return None if seconds is None else int(seconds * 1000)
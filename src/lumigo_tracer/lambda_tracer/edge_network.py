@@ -0,0 +1,115 @@
+"""
+The network plumbing of the connections to the edge, which makes reconnecting cheap:
+* A shared TLS context, which resumes the TLS session of the previous connection to the host.
+* The edge address is resolved in advance and cached, so reconnecting doesn't wait for DNS.
+* Idle connections are checked before they are used, so a stale socket doesn't fail a report.
+"""
+import os
+import select
+import socket
+import ssl
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from lumigo_tracer.lumigo_utils import get_logger
+
+HTTPS_PORT = 443
+DNS_CACHE_TTL_SECONDS: float = float(os.environ.get("LUMIGO_EDGE_DNS_TTL", 60))
+
+
+class EdgeSSLContext(ssl.SSLContext):
+    """
+    A TLS context that resumes the last session of every host, saving a round-trip of the handshake.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__()
+        self.sessions: Dict[str, ssl.SSLSession] = {}
+
+    def wrap_socket(  # type: ignore[override]
+        self, sock: socket.socket, server_hostname: Optional[str] = None, **kwargs: Any
+    ) -> ssl.SSLSocket:
+        session = self.sessions.get(server_hostname or "")
+        ssl_sock = super().wrap_socket(
+            sock, server_hostname=server_hostname, session=session, **kwargs
+        )
+        self.remember_session(ssl_sock)
+        return ssl_sock
+
+    def remember_session(self, sock: Optional[socket.socket]) -> None:
+        """
+        With TLS 1.3 the session ticket is received after the handshake,
+        so we remember the session again after reading a response.
+        """
+        if isinstance(sock, ssl.SSLSocket) and sock.server_hostname and sock.session:
+            self.sessions[sock.server_hostname] = sock.session
+
+
+edge_ssl_context: Optional[EdgeSSLContext] = None
+_edge_ssl_context_lock = threading.Lock()
+# host and port -> resolved address and the resolving time
+_resolved_addresses: Dict[Tuple[str, int], Tuple[Tuple[str, int], float]] = {}
+
+
+def get_edge_ssl_context() -> EdgeSSLContext:
+    global edge_ssl_context
+    with _edge_ssl_context_lock:
+        if edge_ssl_context is None:
+            context = EdgeSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.load_default_certs()
+            edge_ssl_context = context
+        return edge_ssl_context
+
+
+def resolve_edge_address(host: str, port: int = HTTPS_PORT) -> Tuple[str, int]:
+    """
+    :return: The address to connect to, from the cache if it was resolved in the last TTL.
+    """
+    cached = _resolved_addresses.get((host, port))
+    if cached and time.time() - cached[1] < DNS_CACHE_TTL_SECONDS:
+        return cached[0]
+    *_, sockaddr = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+    address = (str(sockaddr[0]), int(sockaddr[1]))
+    _resolved_addresses[(host, port)] = (address, time.time())
+    return address
+
+
+def create_edge_socket(
+    address: Tuple[str, int],
+    timeout: Optional[float] = None,
+    source_address: Optional[Tuple[str, int]] = None,
+) -> socket.socket:
+    """
+    A replacement of `socket.create_connection` for the edge connections, that uses the cached address.
+    If the cached address doesn't work (e.g. the edge moved), we resolve the host again.
+    """
+    host, port = address
+    try:
+        return socket.create_connection(resolve_edge_address(host, port), timeout, source_address)
+    except OSError as e:
+        get_logger().info(f"Could not connect to the cached address of {host}: {e}")
+        _resolved_addresses.pop((host, port), None)
+        return socket.create_connection(address, timeout, source_address)
+
+
+def is_connection_alive(sock: Optional[socket.socket]) -> bool:
+    """
+    An idle keep-alive connection has nothing to read, unless the edge has closed it.
+    A connection that is not open yet (no socket) is fine, as it will be opened on the next request.
+    """
+    if not isinstance(sock, socket.socket):
+        return True
+    if isinstance(sock, ssl.SSLSocket) and sock.pending():
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+def clear() -> None:
+    global edge_ssl_context
+    edge_ssl_context = None
+    _resolved_addresses.clear()
@@ -0,0 +1,103 @@
+"""
+A bounded spool in /tmp for the requests that could not be delivered to the edge.
+
+The requests are kept as files named by their spooling time, so the oldest are evicted first
+when the spool is full, and requests that are older than the age limit are never replayed.
+"""
+import itertools
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import List, Union
+
+from lumigo_tracer.lumigo_utils import get_logger, lumigo_safe_execute
+
+SPOOL_DIR = "/tmp/lumigo-edge-spool"
+SPOOL_MAX_SIZE: int = int(os.environ.get("LUMIGO_EDGE_SPOOL_MAX_SIZE", 5 * 1024 * 1024))
+SPOOL_MAX_AGE_SECONDS: int = int(os.environ.get("LUMIGO_EDGE_SPOOL_MAX_AGE", 15 * 60))
+JSON_SUFFIX = ".json"
+COMPRESSED_SUFFIX = ".bin"
+# Keeps the order of the requests that are spooled in the same millisecond
+_spool_sequence = itertools.count()
+
+
+def is_spool_enabled() -> bool:
+    return os.environ.get("LUMIGO_EDGE_SPOOL", "").lower() == "true"
+
+
+def spool_requests(requests: List[Union[str, bytes]]) -> None:
+    """
+    Store the requests in the spool, evicting the oldest spooled requests to stay within the size limit.
+    """
+    with lumigo_safe_execute("edge spool: spool requests"):
+        Path(SPOOL_DIR).mkdir(parents=True, exist_ok=True)
+        for request in requests:
+            data = request.encode() if isinstance(request, str) else request
+            if len(data) > SPOOL_MAX_SIZE:
+                get_logger().warning("A request is bigger than the spool, it was lost.")
+                continue
+            _make_room(len(data))
+            suffix = JSON_SUFFIX if isinstance(request, str) else COMPRESSED_SUFFIX
+            spooled_time = int(time.time() * 1000)
+            file_name = f"{spooled_time:013d}-{next(_spool_sequence):010d}-{uuid.uuid4().hex}"
+            file_path = Path(SPOOL_DIR, file_name)
+            # Write and then rename, so a partially written request is never replayed
+            file_path.write_bytes(data)
+            file_path.rename(file_path.with_suffix(suffix))
+        get_logger().info(f"Spooled {len(requests)} requests to {SPOOL_DIR}")
+
+
+def has_spooled_requests() -> bool:
+    return bool(_get_spooled_files())
+
+
+def take_spooled_requests() -> List[Union[str, bytes]]:
+    """
+    Remove all the requests from the spool.
+
+    :return: The requests that are not older than the age limit, oldest first.
+    """
+    requests: List[Union[str, bytes]] = []
+    expired_requests = 0
+    now = time.time()
+    for file_path in _get_spooled_files():
+        try:
+            spooled_time = int(file_path.name.split("-")[0]) / 1000
+            data = file_path.read_bytes()
+            file_path.unlink()
+        except (OSError, ValueError) as e:
+            get_logger().debug(f"Could not read spooled request {file_path}: {e}")
+            continue
+        if now - spooled_time > SPOOL_MAX_AGE_SECONDS:
+            expired_requests += 1
+            continue
+        requests.append(data.decode() if file_path.suffix == JSON_SUFFIX else data)
+    if expired_requests:
+        get_logger().info(f"Dropped {expired_requests} spooled requests that are too old")
+    return requests
+
+
+def _get_spooled_files() -> List[Path]:
+    """
+    :return: The spooled requests files, oldest first.
+    """
+    try:
+        files = Path(SPOOL_DIR).iterdir()
+        return sorted(f for f in files if f.suffix in (JSON_SUFFIX, COMPRESSED_SUFFIX))
+    except OSError:
+        return []
+
+
+def _make_room(size: int) -> None:
+    spooled_files = [(f, f.stat().st_size) for f in _get_spooled_files()]
+    total_size = sum(file_size for _, file_size in spooled_files)
+    evicted_requests = 0
+    for file_path, file_size in spooled_files:
+        if total_size + size <= SPOOL_MAX_SIZE:
+            break
+        file_path.unlink()
+        total_size -= file_size
+        evicted_requests += 1
+    if evicted_requests:
+        get_logger().warning(f"The spool is full, {evicted_requests} old requests were lost.")
@@ -0,0 +1,142 @@
+"""
+Append-only segment files for handing the spans to the tracer extension.
+
+Instead of a new file for every span, the spans are appended as records to a segment file
+of the container. The segment is preallocated and memory-mapped, so appending a record is
+a memory copy. A segment is rotated (closed and renamed) when it is full or the invocation ends,
+so the extension can tell completed segments by their name.
+
+Segment format: SEGMENT_MAGIC, followed by records of
+    [record type: 1 byte][payload length: 4 bytes, big endian][payload]
+The rest of an active segment is zeros. The header of a record is written after its payload,
+so a reader that meets a zero record type knows that there are no more committed records.
+"""
+import itertools
+import mmap
+import os
+import struct
+import threading
+import uuid
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from lumigo_tracer.lumigo_utils import get_logger
+
+SEGMENT_MAGIC = b"LUMIGO-SEGMENT-1\n"
+RECORD_HEADER = struct.Struct(">BI")
+RECORD_TYPES = {"span": 1, "end": 2, "stop": 3}
+RECORD_TYPE_NAMES = {code: name for name, code in RECORD_TYPES.items()}
+# Records that end the invocation, so the segment is rotated after them
+LAST_RECORD_TYPES = ("end", "stop")
+SEGMENT_MAX_SIZE: int = int(os.environ.get("LUMIGO_EXTENSION_SEGMENT_MAX_SIZE", 4 * 1024 * 1024))
+SEGMENT_SUFFIX = "_segment"
+ACTIVE_SEGMENT_SUFFIX = ".active"
+
+
+def should_use_extension_segments() -> bool:
+    return os.environ.get("LUMIGO_EXTENSION_SEGMENTS", "").lower() == "true"
+
+
+class SegmentWriter:
+    """
+    Appends records to the active segment of this container, in the given directory.
+    """
+
+    def __init__(self, directory: str, max_size: int = SEGMENT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.container_id = str(uuid.uuid4())
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._buffer: Optional[mmap.mmap] = None
+        self._offset = 0
+        self._path: Optional[str] = None
+
+    @property
+    def active_path(self) -> Optional[str]:
+        return self._path
+
+    def append(self, record_type: str, payload: bytes) -> None:
+        record_size = RECORD_HEADER.size + len(payload)
+        with self._lock:
+            if self._buffer is not None and self._offset + record_size > len(self._buffer):
+                self._rotate()
+            if self._buffer is None:
+                self._open(max(self.max_size, len(SEGMENT_MAGIC) + record_size))
+            buffer: mmap.mmap = self._buffer  # type: ignore[assignment]
+            payload_offset = self._offset + RECORD_HEADER.size
+            buffer[payload_offset : payload_offset + len(payload)] = payload  # noqa: E203
+            RECORD_HEADER.pack_into(buffer, self._offset, RECORD_TYPES[record_type], len(payload))
+            self._offset += record_size
+            if record_type in LAST_RECORD_TYPES:
+                self._rotate()
+
+    def rotate(self) -> None:
+        with self._lock:
+            self._rotate()
+
+    def _open(self, size: int) -> None:
+        Path(self.directory).mkdir(parents=True, exist_ok=True)
+        name = f"{self.container_id}-{next(self._sequence):06d}{SEGMENT_SUFFIX}"
+        self._path = os.path.join(self.directory, name + ACTIVE_SEGMENT_SUFFIX)
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(self._fd, size)
+        self._buffer = mmap.mmap(self._fd, size)
+        self._buffer[: len(SEGMENT_MAGIC)] = SEGMENT_MAGIC
+        self._offset = len(SEGMENT_MAGIC)
+
+    def _rotate(self) -> None:
+        """
+        Close the active segment, and rename it so the extension knows that it's complete.
+        """
+        if self._buffer is None or self._fd is None or self._path is None:
+            return
+        self._buffer.flush()
+        self._buffer.close()
+        os.ftruncate(self._fd, self._offset)
+        os.close(self._fd)
+        completed_path = self._path[: -len(ACTIVE_SEGMENT_SUFFIX)]
+        os.rename(self._path, completed_path)
+        get_logger().info(f"Rotated extension segment [{completed_path}][{self._offset}]")
+        self._buffer, self._fd, self._path, self._offset = None, None, None, 0
+
+
+segment_writer: Optional[SegmentWriter] = None
+
+
+def get_segment_writer(directory: str) -> SegmentWriter:
+    global segment_writer
+    if segment_writer is None or segment_writer.directory != directory:
+        if segment_writer is not None:
+            segment_writer.rotate()
+        segment_writer = SegmentWriter(directory)
+    return segment_writer
+
+
+def read_segment_records(path: str, offset: int = 0) -> Tuple[List[Tuple[str, bytes]], int]:
+    """
+    Read the committed records of a segment (active or completed), starting at the given offset.
+
+    :return: The records (type and payload), and the offset to continue reading from later.
+    """
+    records: List[Tuple[str, bytes]] = []
+    with open(path, "rb") as segment:
+        if offset == 0:
+            if segment.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                raise ValueError(f"{path} is not an extension segment")
+            offset = len(SEGMENT_MAGIC)
+        segment.seek(offset)
+        while True:
+            header = segment.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            record_type, length = RECORD_HEADER.unpack(header)
+            if not record_type:
+                break
+            payload = segment.read(length)
+            if len(payload) < length:
+                break
+            records.append((RECORD_TYPE_NAMES[record_type], payload))
+            offset += RECORD_HEADER.size + length
+    return records, offset
@@ -0,0 +1,83 @@
+"""
+The parts of an invocation that are the same in all the invocations of the container.
+
+The template is built in the cold start, and the warm invocations reuse it as long as the
+environment variables (except for the ones that Lambda sets per invocation) didn't change.
+The environment dump is scrubbed once, and only the per invocation variables are dumped again.
+"""
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from lumigo_core.configuration import CoreConfiguration
+from lumigo_core.scrubbing import TRUNCATE_SUFFIX
+
+from lumigo_tracer.lumigo_utils import lumigo_dumps_with_context
+
+_VERSION_PATH = os.path.join(os.path.dirname(__file__), "../VERSION")
+# Lambda sets these variables in every invocation
+PER_INVOCATION_ENVS = ("_X_AMZN_TRACE_ID",)
+
+_version: Optional[str] = None
+_template: Optional["InvocationTemplate"] = None
+
+
+def get_tracer_version() -> str:
+    global _version
+    if _version is None:
+        version = open(_VERSION_PATH, "r").read() if os.path.exists(_VERSION_PATH) else "unknown"
+        _version = version.strip()
+    return _version
+
+
+class InvocationTemplate:
+    def __init__(self, static_envs: Dict[str, str]):
+        self.static_envs = static_envs
+        self.name = static_envs.get("AWS_LAMBDA_FUNCTION_NAME")
+        self.runtime = static_envs.get("AWS_EXECUTION_ENV")
+        self.region = static_envs.get("AWS_REGION") or "UNKNOWN"
+        self.memory_allocated = static_envs.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE")
+        self.log_stream_name = static_envs.get("AWS_LAMBDA_LOG_STREAM_NAME")
+        self.log_group_name = static_envs.get("AWS_LAMBDA_LOG_GROUP_NAME")
+        self._static_envs_dumps: Dict[Tuple[int, Any], str] = {}
+
+    def get_envs_dump(self, has_error: bool = False) -> str:
+        """
+        :return: The scrubbed dump of the environment, like dumping `os.environ` (up to key order).
+        """
+        max_size = CoreConfiguration.get_max_entry_size(has_error)
+        static_dump = self._get_static_envs_dump(max_size)
+        invocation_envs = {key: os.environ[key] for key in PER_INVOCATION_ENVS if key in os.environ}
+        if not invocation_envs or not static_dump.startswith("{"):
+            # Nothing to add, or the whole environment is masked
+            return static_dump
+        invocation_dump = lumigo_dumps_with_context("environment", invocation_envs, max_size)
+        if static_dump == "{}" or not invocation_dump.endswith("}"):
+            return invocation_dump
+        is_truncated = static_dump.endswith(TRUNCATE_SUFFIX)
+        if is_truncated:
+            static_dump = static_dump[: -len(TRUNCATE_SUFFIX)]
+        dump = f"{invocation_dump[:-1]}, {static_dump[1:]}"
+        if is_truncated or len(dump) >= max_size:
+            return dump[:max_size] + TRUNCATE_SUFFIX
+        return dump
+
+    def _get_static_envs_dump(self, max_size: int) -> str:
+        key = (max_size, CoreConfiguration.secret_masking_regex_environment)
+        if key not in self._static_envs_dumps:
+            self._static_envs_dumps[key] = lumigo_dumps_with_context(
+                "environment", self.static_envs, max_size
+            )
+        return self._static_envs_dumps[key]
+
+
+def get_invocation_template() -> InvocationTemplate:
+    """
+    :return: The template of the container, built again only if the environment changed.
+    """
+    global _template
+    static_envs = dict(os.environ)
+    for key in PER_INVOCATION_ENVS:
+        static_envs.pop(key, None)
+    if _template is None or _template.static_envs != static_envs:
+        _template = InvocationTemplate(static_envs)
+    return _template
@@ -1,26 +1,58 @@
-import copy
-import datetime
+import concurrent.futures
 import enum
+import heapq
 import http.client
+import json
 import os
 import random
 import socket
+import threading
 import time
 import uuid
+import zlib
 from base64 import b64encode
+from collections import Counter
 from functools import lru_cache
-from gzip import compress as gzip_compress
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 
 from lumigo_core.configuration import CoreConfiguration
 from lumigo_core.scrubbing import EXECUTION_TAGS_KEY
 
+from lumigo_tracer.lambda_tracer import edge_health, edge_network, report_stats
+from lumigo_tracer.lambda_tracer.compact_envelope import (
+    dump_compact_envelope,
+    dump_span_fields,
+    join_span_fields,
+    should_use_compact_envelope,
+)
+from lumigo_tracer.lambda_tracer.compression_dictionary import (
+    COMPRESSION_DICTIONARY,
+    COMPRESSION_DICTIONARY_ID,
+)
+from lumigo_tracer.lambda_tracer.edge_health import SECONDS_TO_TIMEOUT
+from lumigo_tracer.lambda_tracer.edge_spool import (
+    has_spooled_requests,
+    is_spool_enabled,
+    spool_requests,
+    take_spooled_requests,
+)
+from lumigo_tracer.lambda_tracer.extension_segment import (
+    get_segment_writer,
+    should_use_extension_segments,
+)
+from lumigo_tracer.lambda_tracer.local_collector import (
+    connect_to_collector,
+    get_collector_socket_path,
+    send_to_collector,
+)
+from lumigo_tracer.lambda_tracer.report_stats import ReportStats, measure
 from lumigo_tracer.lumigo_utils import (
     EDGE_HOST,
     Configuration,
     InternalState,
     aws_dump,
+    get_current_ms_time,
     get_logger,
     get_region,
     internal_analytics_message,
@@ -39,8 +71,6 @@ except Exception:
 
 EDGE_PATH = os.environ.get("LUMIGO_EDGE_PATH", "/api/spans")
 HTTPS_PREFIX = "https://"
-SECONDS_TO_TIMEOUT = 0.5
-EDGE_TIMEOUT = float(os.environ.get("LUMIGO_EDGE_TIMEOUT", SECONDS_TO_TIMEOUT))
 REQUEST_MAX_SIZE = 1024 * 990
 MAX_SIZE_FOR_REQUEST: int = min(
     int(os.environ.get("LUMIGO_MAX_SIZE_FOR_REQUEST", 1024 * 500)), REQUEST_MAX_SIZE
@@ -53,9 +83,7 @@ MAX_NUMBER_OF_SPANS: int = int(os.environ.get("LUMIGO_MAX_NUMBER_OF_SPANS", 2000
 # Size of spans sent that is kept for the enrichment span additional info added during sending.
 # Static value is enough for the amount of data we add.
 SPANS_SEND_SIZE_ENRICHMENT_SPAN_BUFFER = 200
-TOO_BIG_SPANS_THRESHOLD = 5
 NUMBER_OF_SPANS_IN_REPORT_OPTIMIZATION = 200
-COOLDOWN_AFTER_TIMEOUT_DURATION = datetime.timedelta(seconds=10)
 CHINA_REGION = "cn-northwest-1"
 LUMIGO_SPANS_DIR = "/tmp/lumigo-spans"
 FUNCTION_TYPE = "function"
@@ -67,45 +95,266 @@ SQL_SPAN = "mySql"
 VERTEXAI_SPAN = "vertexai"
 DROPPED_SPANS_REASONS_KEY = "droppedSpansReasons"
 
-MAX_SPANS_BULK_SIZE = 200
+# gzip format (see zlib.compressobj's wbits documentation)
+GZIP_WBITS = 31
+COMPRESSION_LEVEL: int = int(os.environ.get("LUMIGO_COMPRESSION_LEVEL", 9))
+# The values of the HTTP Content-Encoding header that we can send to the edge, and their zlib format
+CONTENT_ENCODING_WBITS = {"gzip": GZIP_WBITS, "deflate": zlib.MAX_WBITS}
+GZIP_MAGIC = b"\x1f\x8b"
+# The FDICT bit of the zlib header, set when the data was compressed with a preset dictionary
+ZLIB_FDICT_FLAG = 0x20
+COMPRESSION_DICTIONARY_HEADER = "X-Lumigo-Compression-Dictionary"
+# Upper bound of the gzip header and trailer, deflate block headers and the list closing bracket.
+ZIPPED_BULK_OVERHEAD = 64
+EDGE_CONNECTION_POOL_SIZE: int = int(os.environ.get("LUMIGO_EDGE_CONNECTION_POOL_SIZE", 4))
+# The time we allow for sending all the bulks in parallel, including the per-bulk retry.
+PARALLEL_SEND_DEADLINE: float = float(
+    os.environ.get("LUMIGO_EDGE_PARALLEL_SEND_DEADLINE", 4 * SECONDS_TO_TIMEOUT)
+)
+# We finish reporting this long (in seconds) before the lambda's deadline, so the handler can return
+REPORT_DEADLINE_MARGIN: float = float(os.environ.get("LUMIGO_REPORT_DEADLINE_MARGIN", 0.1))
+MIN_REQUEST_TIMEOUT = 0.01
+# Kinesis limits: a record's data and partition key, and the records of a single put_records
+KINESIS_MAX_RECORD_SIZE = 1024 * 1024
+KINESIS_MAX_PARTITION_KEY_SIZE = 256
+KINESIS_MAX_RECORDS_PER_REQUEST = 500
+KINESIS_MAX_REQUEST_SIZE = 5 * 1024 * 1024
+# The spans of a single report are sent in up to this size of records (China region),
+# which can be raised up to KINESIS_MAX_REQUEST_SIZE
+EDGE_KINESIS_MAX_SIZE: int = int(
+    os.environ.get("LUMIGO_EDGE_KINESIS_MAX_SIZE", MAX_SIZE_FOR_REQUEST)
+)
+KINESIS_MAX_ATTEMPTS = 3
+KINESIS_RETRY_BACKOFF = 0.05
 
 edge_kinesis_boto_client = None
+# The region and credentials that the cached kinesis client was built with
+edge_kinesis_boto_client_key: Optional[Tuple[str, str, str]] = None
 edge_connection = None
+# The edge connection is shared with the background reporter, so only one thread may use it at a time.
+# A report that finds it busy doesn't wait, and sends over a connection of the pool instead.
+# This is an RLock because the timeout signal handler may interrupt the main thread in the middle of a report.
+edge_connection_lock = threading.RLock()
+spool_replayer: Optional[threading.Thread] = None
+
+
+# A request to the edge: a json string, or bytes that are compressed with the edge content encoding
+RequestBody = Union[str, bytes]
+
+
+class EdgeResponseTimeout(socket.timeout):
+    """
+    The request was sent, but its response didn't arrive in time. The edge may have accepted it,
+    so the request is not spooled (replaying it could send the same spans twice).
+    """
 
 
 class DroppedSpansReasons(enum.Enum):
     SPANS_SENT_SIZE_LIMIT = "SPANS_SENT_SIZE_LIMIT"
+    SPANS_SENT_AS_METADATA = "SPANS_SENT_AS_METADATA"
+    SPANS_STORE_SIZE_LIMIT = "SPANS_STORE_SIZE_LIMIT"
+
+
+class SerializedSpan:
+    """
+    A span together with its json dump, so that every span is serialized only once per report.
+    The dump is ascii-only (see `aws_dump`), so its length is the exact number of bytes on the wire.
+    """
+
+    __slots__ = ("span", "dumped", "_field_dumps", "_metadata", "_has_error")
+
+    def __init__(self, span: Dict[Any, Any], has_error: Optional[bool] = None):
+        """
+        :param has_error: Whether the span has an error, if already known (e.g. by the spans container).
+        """
+        self.span = span
+        # The compact envelope is built from the dumps of the fields (see `compact_envelope`)
+        self._field_dumps: Optional[Dict[str, str]] = None
+        if should_use_compact_envelope():
+            self._field_dumps = dump_span_fields(span)
+            self.dumped: str = join_span_fields(self._field_dumps.values())
+        else:
+            self.dumped = aws_dump(span)
+        self._metadata: Optional[SerializedSpan] = None
+        self._has_error = has_error
+
+    @classmethod
+    def from_dump(cls, dumped: str, has_error: Optional[bool] = None) -> "SerializedSpan":
+        """
+        Restore a serialized span from its dump, without dumping it again.
+        """
+        serialized_span = cls.__new__(cls)
+        serialized_span.span = json.loads(dumped)
+        serialized_span.dumped = dumped
+        serialized_span._field_dumps = None
+        serialized_span._metadata = None
+        serialized_span._has_error = has_error
+        return serialized_span
+
+    @property
+    def size(self) -> int:
+        return len(self.dumped)
+
+    @property
+    def base64_size(self) -> int:
+        return get_base64_size(self.size)
+
+    @property
+    def field_dumps(self) -> Dict[str, str]:
+        if self._field_dumps is None:
+            self._field_dumps = dump_span_fields(self.span)
+        return self._field_dumps
+
+    @property
+    def has_error(self) -> bool:
+        if self._has_error is None:
+            self._has_error = is_span_has_error(self.span)
+        return self._has_error
+
+    @property
+    def priority(self) -> int:
+        return get_span_priority(self.span, self.has_error)
+
+    @property
+    def metadata(self) -> Optional["SerializedSpan"]:
+        """
+        The serialized metadata of this span, or None if the span type is not supported.
+        """
+        if self._metadata is None:
+            span_metadata = get_span_metadata(self.span)
+            if span_metadata:
+                self._metadata = SerializedSpan(span_metadata)
+        return self._metadata
+
+
+class EdgeConnectionPool:
+    """
+    A bounded pool of keep-alive connections to the edge, used to send several requests concurrently.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle_connections: List[http.client.HTTPSConnection] = []
+        self._lock = threading.Lock()
+
+    def acquire(self, host: str) -> Optional[http.client.HTTPSConnection]:
+        with self._lock:
+            while self._idle_connections:
+                connection = self._idle_connections.pop()
+                if connection.host == host:
+                    return connection
+                connection.close()
+        return establish_connection(host)
+
+    def release(self, connection: http.client.HTTPSConnection) -> None:
+        with self._lock:
+            if len(self._idle_connections) < self.size:
+                self._idle_connections.append(connection)
+                return
+        connection.close()
+
+    def warm(self, host: str) -> List["concurrent.futures.Future[None]"]:
+        """
+        Open the pool's connections in advance, so the TLS handshakes are not paid on the user's time.
+        The connections are opened concurrently in the background, we don't wait for them.
+        """
+        executor = _get_edge_executor()
+        return [
+            executor.submit(self._open_connection, host)
+            for _ in range(self.size - len(self._idle_connections))
+        ]
+
+    def _open_connection(self, host: str) -> None:
+        with lumigo_safe_execute("edge connection pool: warm"):
+            connection = establish_connection(host)
+            if connection:
+                connection.connect()
+                self.release(connection)
+
+    def clear(self) -> None:
+        with self._lock:
+            for connection in self._idle_connections:
+                connection.close()
+            self._idle_connections.clear()
+
+
+class ParallelSend:
+    """
+    The connections of the bulks that are being sent in parallel, to abort them after the deadline.
+    """
+
+    def __init__(self) -> None:
+        self.connections: Set[http.client.HTTPSConnection] = set()
+        self.aborted = False
+
+    def abort(self) -> None:
+        """
+        Shut down the connections that are still sending, so their requests fail right away
+            instead of running on the worker threads after we returned.
+        """
+        self.aborted = True
+        for connection in list(self.connections):
+            with lumigo_safe_execute("parallel send: abort connection"):
+                if connection.sock:
+                    connection.sock.shutdown(socket.SHUT_RDWR)
+
+
+edge_connection_pool = EdgeConnectionPool(EDGE_CONNECTION_POOL_SIZE)
+edge_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def _get_edge_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    The threads that send the bulks and warm the pool, created once and shared by all the reports.
+    """
+    global edge_executor
+    if edge_executor is None:
+        edge_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=EDGE_CONNECTION_POOL_SIZE, thread_name_prefix="lumigo-edge"
+        )
+    return edge_executor
 
 
 def establish_connection_global() -> None:
     global edge_connection
     try:
+        if get_collector_socket_path() and connect_to_collector():
+            return
         # Try to establish the connection in initialization
         if (
             os.environ.get("LUMIGO_INITIALIZATION_CONNECTION", "").lower() != "false"
             and get_region() != CHINA_REGION  # noqa
         ):
+            # Connecting also resolves the edge address, which is cached for the reconnects
             edge_connection = establish_connection()
             if edge_connection:
                 edge_connection.connect()
+            if _should_try_zip() and EDGE_CONNECTION_POOL_SIZE > 1:
+                # Large invocations may be sent in several bulks, using the connection pool
+                edge_connection_pool.warm(get_edge_host(os.environ.get("AWS_REGION")))
+        elif get_region() == CHINA_REGION:
+            warm_edge_kinesis_client()
     except socket.timeout:
-        InternalState.mark_timeout_to_edge()
+        edge_health.record_edge_timeout()
     except Exception:
         pass
 
 
 def should_report_to_edge() -> bool:
-    if not InternalState.timeout_on_connection:
-        return True
-    time_diff = datetime.datetime.now() - InternalState.timeout_on_connection
-    return time_diff > COOLDOWN_AFTER_TIMEOUT_DURATION
+    return edge_health.edge_circuit_breaker.allow_request()
 
 
 def establish_connection(host: Optional[str] = None) -> Optional[http.client.HTTPSConnection]:
     try:
         if not host:
             host = get_edge_host(os.environ.get("AWS_REGION"))
-        return http.client.HTTPSConnection(host, timeout=EDGE_TIMEOUT)
+        connection = http.client.HTTPSConnection(
+            host,
+            timeout=edge_health.get_edge_timeout(),
+            context=edge_network.get_edge_ssl_context(),
+        )
+        connection._create_connection = edge_network.create_edge_socket  # type: ignore[attr-defined]
+        return connection
     except Exception as e:
         get_logger().exception(f"Could not establish connection to {host}", exc_info=e)
     return None
@@ -122,7 +371,13 @@ def get_edge_host(region: Optional[str] = None) -> str:
 
 
 def report_json(
-    region: Optional[str], msgs: List[Dict[Any, Any]], is_start_span: bool = False,
+    region: Optional[str],
+    msgs: List[Dict[Any, Any]],
+    is_start_span: bool = False,
+    deadline: Optional[int] = None,
+    cached_spans: Optional[Dict[str, SerializedSpan]] = None,
+    has_error: Optional[bool] = None,
+    streamed_spans: Optional[Iterable[SerializedSpan]] = None,
 ) -> int:
     """
     This function sends the information back to the edge.
@@ -131,37 +386,160 @@ def report_json(
     :param msgs: the message to send.
     :param is_start_span: a flag to indicate if this is the start_span
      of spans that will be written
+    :param deadline: The time (epoch milliseconds) that the reporting must finish by.
+        We send only what we can afford in the remaining time, and retry only if there is time.
+    :param cached_spans: The spans that were already serialized (by span id), to avoid dumping them again.
+    :param has_error: Whether any of the spans has an error, if already known (e.g. by the spans container).
+    :param streamed_spans: More spans, that are read one by one (e.g. from the disk) into zipped bulks
+        after the spans of msgs. Only given when `can_stream_spans`.
     :return: The duration of reporting (in milliseconds),
                 or 0 if we didn't send (due to configuration or fail).
     """
-    if not should_report_to_edge():
+    if CoreConfiguration.should_report and get_collector_socket_path():
+        collector_duration = _report_to_collector(msgs, is_start_span)
+        if collector_duration is not None:
+            return collector_duration
+        get_logger().info("The local collector is not available, falling back")
+    can_report_to_edge = should_report_to_edge()
+    if not can_report_to_edge and not _should_spool(region):
         get_logger().info("Skip sending messages due to previous timeout")
         return 0
     if not CoreConfiguration.should_report:
         return 0
     get_logger().info(f"reporting the messages: {msgs[:10]}")
+    max_size, max_error_size, max_bulks = MAX_SIZE_FOR_REQUEST, MAX_SIZE_FOR_REQUEST_ON_ERROR, None
+    spool_reason = "previous timeout"
+    affordable_size = _get_affordable_request_size(region, deadline) if can_report_to_edge else None
+    if affordable_size == 0:
+        if not _should_spool(region):
+            get_logger().info("Skip sending messages, there is no time left before the deadline")
+            return 0
+        can_report_to_edge, spool_reason = False, "the deadline"
+    elif affordable_size is not None and affordable_size < max_size:
+        get_logger().info(f"Limiting the request to {affordable_size} bytes due to the deadline")
+        max_size, max_error_size = affordable_size, min(max_error_size, affordable_size)
+        # There is no time to send several bulks
+        max_bulks = 1
+    prune_trace: bool = not os.environ.get("LUMIGO_PRUNE_TRACE_OFF", "").lower() == "true"
+    if region == CHINA_REGION and not should_use_tracer_extension():
+        return _publish_spans_to_kinesis(msgs, prune_trace, CHINA_REGION, deadline)
+    stats = ReportStats()
     try:
-        prune_trace: bool = not os.environ.get("LUMIGO_PRUNE_TRACE_OFF", "").lower() == "true"
         should_try_zip: bool = _should_try_zip()
-        to_send: Union[str, List[str]] = _create_request_body(
-            region, msgs, prune_trace, should_try_zip
+        to_send: Union[str, List[RequestBody]] = _create_request_body(
+            region,
+            msgs,
+            prune_trace,
+            should_try_zip,
+            max_size,
+            max_error_size,
+            max_bulks,
+            stats,
+            cached_spans,
+            has_error,
         )
     except Exception as e:
         get_logger().exception("Failed to create request: A span was lost.", exc_info=e)
         return 0
+    if streamed_spans is not None:
+        with lumigo_safe_execute("report json: zip streamed spans"):
+            to_send = _add_streamed_spans_bulks(to_send, streamed_spans, max_size, max_bulks, stats)
+    if not can_report_to_edge:
+        get_logger().info(f"Spooling the messages due to {spool_reason}")
+        spool_requests(to_send if isinstance(to_send, list) else [to_send])
+        return 0
     if should_use_tracer_extension():
         with lumigo_safe_execute("report json file: writing spans to file"):
             write_spans_to_files(spans=msgs, is_start_span=is_start_span)
         return 0
-    if region == CHINA_REGION and isinstance(to_send, str):
-        return _publish_spans_to_kinesis(to_send.encode(), CHINA_REGION)
 
+    with lumigo_safe_execute("report json: replay spooled requests"):
+        _replay_spool_in_background(region)
+    return _send_to_edge_without_waiting(region, to_send, deadline, stats)
+
+
+def report_prepared_request(
+    region: Optional[str], request_body: str, deadline: Optional[int] = None
+) -> Optional[int]:
+    """
+    Send a request body that is ready as is (see `timeout_payload`) to the edge connection.
+
+    The health of the edge is checked only when sending, so if the edge can't be reported to,
+    the request is spooled (or skipped) here rather than falling back to `report_json`.
+
+    :return: The duration of reporting (in milliseconds),
+                or None if the request should be reported with `report_json` instead
+                (e.g. it should go to the collector or the extension, or it doesn't fit in time).
+    """
+    if (
+        not CoreConfiguration.should_report
+        or get_collector_socket_path()
+        or should_use_tracer_extension()
+        or region == CHINA_REGION
+    ):
+        return None
+    affordable_size = _get_affordable_request_size(region, deadline)
+    if affordable_size is not None and get_base64_size(len(request_body)) > affordable_size:
+        return None
+    return _send_to_edge_without_waiting(region, request_body, deadline, ReportStats())
+
+
+def _report_to_collector(msgs: List[Dict[Any, Any]], is_start_span: bool) -> Optional[int]:
+    """
+    :return: The duration of reporting (in milliseconds), or None if the collector is not available.
+    """
+    start_time = time.time()
+    with lumigo_safe_execute("report json: send to collector"):
+        payload = aws_dump(msgs[:MAX_NUMBER_OF_SPANS]).encode()
+        if send_to_collector("span" if is_start_span else "end", payload):
+            get_logger().info(f"Sent {len(msgs)} spans to the local collector")
+            return int((time.time() - start_time) * 1000)
+    return None
+
+
+def _send_to_edge_without_waiting(
+    region: Optional[str],
+    to_send: Union[str, List[RequestBody]],
+    deadline: Optional[int] = None,
+    stats: Optional[ReportStats] = None,
+) -> int:
+    """
+    Send over the shared edge connection, or over a connection of the pool if another thread uses it.
+    We never wait for the other thread, e.g. the timeout signal handler can't wait for
+        the background reporter of the start span.
+    """
+    if edge_connection_lock.acquire(blocking=False):
+        try:
+            return _send_to_edge(region, to_send, deadline, stats)
+        finally:
+            edge_connection_lock.release()
+    get_logger().info("The edge connection is in use, sending over a separate connection")
+    return _send_to_edge(region, to_send, deadline, stats, use_pool=True)
+
+
+def _send_to_edge(
+    region: Optional[str],
+    to_send: Union[str, List[RequestBody]],
+    deadline: Optional[int] = None,
+    stats: Optional[ReportStats] = None,
+    use_pool: bool = False,
+) -> int:
+    """
+    :param use_pool: Send over the connections of the pool, instead of the shared edge connection
+        (which requires holding `edge_connection_lock`).
+    """
     global edge_connection
+    if not edge_health.edge_circuit_breaker.start_request():
+        # The circuit breaker is open, or another request took its probe
+        get_logger().info("Skip sending messages due to previous timeout")
+        _spool_undelivered_requests(to_send if isinstance(to_send, list) else [to_send])
+        return 0
     with lumigo_safe_execute("report json: establish connection"):
         host = get_edge_host(region)
         duration = 0
-        if not edge_connection or edge_connection.host != host:
-            edge_connection = establish_connection(host)
+        if not use_pool and (not edge_connection or edge_connection.host != host):
+            with measure(stats, "connection"):
+                edge_connection = establish_connection(host)
             if not edge_connection:
                 get_logger().warning("Cannot establish connection. Skip sending span.")
                 return duration
@@ -170,231 +548,541 @@ def report_json(
         start_time = time.time()
 
         to_send = to_send if isinstance(to_send, list) else [to_send]
+        content_encoding = _get_edge_content_encoding()
+        if content_encoding:
+            with measure(stats, "compression"):
+                to_send = [
+                    _compress(data.encode(), content_encoding) if isinstance(data, str) else data
+                    for data in to_send
+                ]
+        if stats:
+            stats.sent_bytes = sum(len(data) for data in to_send)
+            stats.requests = len(to_send)
         get_logger().debug(f"Going to send a list of {len(to_send)} spans...")
         # When not zipping the to_send contains one request with all the spans to send,
         # and when zipping it can be a list of requests to send.
-        for span_data in to_send:
-            send_single_request(host, span_data)
+        if len(to_send) > 1 and EDGE_CONNECTION_POOL_SIZE > 1:
+            _send_bulks_in_parallel(host, to_send, deadline, stats)
+        elif use_pool:
+            for span_data in to_send:
+                _send_bulk_with_pool(host, span_data, deadline, stats)
+        else:
+            for span_data in to_send:
+                send_single_request(host, span_data, deadline=deadline, stats=stats)
 
         duration = int((time.time() - start_time) * 1000)
+        recorded_stats = report_stats.record_report(stats) if stats else None
         # Log the execution time
-        get_logger().debug(f"sending all spans took {duration:.4f} seconds to execute")
+        get_logger().debug(
+            f"sending all spans took {duration:.4f} seconds to execute, stats: {recorded_stats}"
+        )
     except Exception as e:
         get_logger().exception("Unexpected failure during span reporting", exc_info=e)
 
     return duration
 
 
-def send_single_request(host: str, data: str, retry: bool = True) -> None:
+class BackgroundReporter(threading.Thread):
+    """
+    Reports the given spans on a daemon thread, so the user's handler doesn't wait for the edge.
+    """
+
+    def __init__(
+        self,
+        region: Optional[str],
+        msgs: List[Dict[Any, Any]],
+        is_start_span: bool = False,
+        deadline: Optional[int] = None,
+    ):
+        super().__init__(name="lumigo-background-reporter", daemon=True)
+        self.region = region
+        self.msgs = msgs
+        self.is_start_span = is_start_span
+        self.deadline = deadline
+        self.duration: Optional[int] = None
+
+    def run(self) -> None:
+        with lumigo_safe_execute("background reporter"):
+            self.duration = report_json(
+                region=self.region,
+                msgs=self.msgs,
+                is_start_span=self.is_start_span,
+                deadline=self.deadline,
+            )
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Wait for the report to finish.
+
+        :return: The duration of reporting (in milliseconds), or None if it didn't finish yet.
+        """
+        self.join(timeout)
+        return self.duration
+
+
+def send_single_request(
+    host: str,
+    data: RequestBody,
+    retry: bool = True,
+    deadline: Optional[int] = None,
+    stats: Optional[ReportStats] = None,
+) -> None:
     """
     Helper function to send a single request and handle retries,
     including re-establishing connection if necessary.
+    We retry only if there is enough time for another request before the deadline.
     """
     global edge_connection
     if edge_connection is None:
         raise ValueError("Connection is not established")
 
     try:
-        edge_connection.request(
-            "POST",
-            EDGE_PATH,
-            data,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": Configuration.token or "",
-            },
-        )
-        response = edge_connection.getresponse()
-        response.read()  # We must read the response to keep the connection available
-        get_logger().info(f"Successful reporting, code: {getattr(response, 'code', 'unknown')}")
-    except socket.timeout:
-        get_logger().exception(f"Timeout while connecting to {host}")
-        InternalState.mark_timeout_to_edge()
-        internal_analytics_message("report: socket.timeout")
+        _post_to_edge(edge_connection, data, deadline, stats)
+    except socket.timeout as e:
+        _handle_edge_timeout(host, edge_connection, data, deadline)
+        if not isinstance(e, EdgeResponseTimeout):
+            _spool_undelivered_requests([data])
     except Exception as e:
-        if retry:
+        if retry and _has_time_for_request(deadline, len(data)):
             get_logger().info(f"Could not report to {host}: ({str(e)}). Retrying.")
-            edge_connection = establish_connection(host)  # Re-establish connection safely
-            send_single_request(host, data, retry=False)
+            with measure(stats, "connection"):
+                edge_connection = establish_connection(host)  # Re-establish connection safely
+            send_single_request(host, data, retry=False, deadline=deadline, stats=stats)
         else:
             get_logger().exception("Could not report: A span was lost.", exc_info=e)
             internal_analytics_message(f"report: {type(e)}")
+            _spool_undelivered_requests([data])
+
+
+def _post_to_edge(
+    connection: http.client.HTTPSConnection,
+    data: RequestBody,
+    deadline: Optional[int] = None,
+    stats: Optional[ReportStats] = None,
+) -> None:
+    headers = {"Content-Type": "application/json", "Authorization": Configuration.token or ""}
+    if isinstance(data, bytes):
+        headers["Content-Encoding"] = "gzip" if data.startswith(GZIP_MAGIC) else "deflate"
+        if _is_compressed_with_dictionary(data):
+            headers[COMPRESSION_DICTIONARY_HEADER] = COMPRESSION_DICTIONARY_ID
+    if not edge_network.is_connection_alive(connection.sock):
+        get_logger().info("The edge connection is stale, reconnecting")
+        connection.close()
+    timeout = _get_request_timeout(deadline, len(data))
+    connection.timeout = timeout
+    if connection.sock:
+        connection.sock.settimeout(timeout)
+    else:
+        with measure(stats, "connection"):
+            connection.connect()
+    start_time = time.time()
+    with measure(stats, "send"):
+        connection.request("POST", EDGE_PATH, data, headers=headers)
+    with measure(stats, "response"):
+        try:
+            response = connection.getresponse()
+            response.read()  # We must read the response to keep the connection available
+        except socket.timeout as e:
+            raise EdgeResponseTimeout(*e.args) from None
+    if edge_network.edge_ssl_context:
+        edge_network.edge_ssl_context.remember_session(connection.sock)
+    if isinstance(data, bytes) and response.status == http.client.UNSUPPORTED_MEDIA_TYPE:
+        get_logger().info("The edge doesn't support compressed requests, sending plain json")
+        InternalState.edge_rejected_content_encoding = True
+        _post_to_edge(connection, _decompress(data).decode(), deadline, stats)
+        return
+    if response.status >= http.client.INTERNAL_SERVER_ERROR:
+        get_logger().warning(f"The edge failed to handle the request, code: {response.status}")
+        edge_health.record_edge_failure()
+        return
+    if response.status < http.client.OK or response.status >= http.client.MULTIPLE_CHOICES:
+        get_logger().warning(f"The edge rejected the request, code: {response.status}")
+        return
+    edge_health.record_edge_success(time.time() - start_time, len(data))
+    get_logger().info(f"Successful reporting, code: {getattr(response, 'code', 'unknown')}")
+
+
+def _handle_edge_timeout(
+    host: str,
+    connection: http.client.HTTPSConnection,
+    data: RequestBody,
+    deadline: Optional[int] = None,
+) -> None:
+    if _is_past_deadline(deadline):
+        # We cut the request short ourselves, it doesn't mean that the edge is unhealthy
+        get_logger().info(f"The request to {host} was not finished before the deadline")
+        return
+    get_logger().exception(f"Timeout while connecting to {host}")
+    edge_health.record_edge_timeout(connection.timeout, len(data))
+    internal_analytics_message("report: socket.timeout")
+
+
+def _get_remaining_time(deadline: Optional[int]) -> Optional[float]:
+    """
+    :param deadline: The time (epoch milliseconds) that the reporting must finish by.
+    :return: The time (in seconds) that is left for reporting, or None if there is no deadline.
+    """
+    if deadline is None:
+        return None
+    return (deadline - get_current_ms_time()) / 1000 - REPORT_DEADLINE_MARGIN
+
+
+def _get_affordable_request_size(region: Optional[str], deadline: Optional[int]) -> Optional[int]:
+    """
+    :return: The size of the biggest request that we can send to the edge before the deadline,
+        or None if the reporting is not limited by time.
+    """
+    remaining_time = _get_remaining_time(deadline)
+    if remaining_time is None or should_use_tracer_extension() or region == CHINA_REGION:
+        return None
+    return edge_health.get_affordable_request_size(remaining_time)
+
+
+def _has_time_for_request(deadline: Optional[int], request_size: int = 0) -> bool:
+    remaining_time = _get_remaining_time(deadline)
+    return remaining_time is None or remaining_time >= edge_health.get_edge_timeout(request_size)
 
 
-def get_span_priority(span: Dict[Any, Any]) -> int:
+def _is_past_deadline(deadline: Optional[int]) -> bool:
+    remaining_time = _get_remaining_time(deadline)
+    return remaining_time is not None and remaining_time <= 0
+
+
+def _get_request_timeout(deadline: Optional[int], request_size: int = 0) -> float:
+    """
+    :return: The edge timeout, shortened so the request doesn't last beyond the deadline.
+    """
+    timeout = edge_health.get_edge_timeout(request_size)
+    remaining_time = _get_remaining_time(deadline)
+    if remaining_time is not None:
+        timeout = max(min(timeout, remaining_time), MIN_REQUEST_TIMEOUT)
+    return timeout
+
+
+def _should_spool(region: Optional[str]) -> bool:
+    """
+    Only the requests to the edge are spooled, and not the extension files or kinesis records.
+    """
+    return is_spool_enabled() and not should_use_tracer_extension() and region != CHINA_REGION
+
+
+def _spool_undelivered_requests(requests: List[RequestBody]) -> None:
+    if is_spool_enabled():
+        spool_requests(requests)
+
+
+def _replay_spool_in_background(region: Optional[str]) -> None:
+    """
+    Replay the requests that previous invocations could not deliver, without delaying this one.
+    """
+    global spool_replayer
+    if not is_spool_enabled() or not has_spooled_requests():
+        return
+    if edge_health.edge_circuit_breaker.state != edge_health.CircuitState.CLOSED:
+        # The edge is not healthy yet, a probe must succeed first
+        return
+    if spool_replayer and spool_replayer.is_alive():
+        return
+    spool_replayer = threading.Thread(
+        target=_replay_spooled_requests,
+        args=(get_edge_host(region),),
+        name="lumigo-spool-replayer",
+        daemon=True,
+    )
+    spool_replayer.start()
+
+
+def _replay_spooled_requests(host: str) -> None:
+    """
+    Send the spooled requests over a dedicated connection, and spool back what was not sent.
+    """
+    requests = take_spooled_requests()
+    get_logger().info(f"Replaying {len(requests)} spooled requests")
+    connection = establish_connection(host)
+    for index, request in enumerate(requests):
+        try:
+            if not connection:
+                raise ConnectionError("Cannot establish connection")
+            _post_to_edge(connection, request)
+        except Exception as e:
+            get_logger().info(f"Could not replay spooled requests to {host}: ({str(e)})")
+            if isinstance(e, socket.timeout) and connection:
+                edge_health.record_edge_timeout(connection.timeout, len(request))
+            # A request whose response timed out may have been accepted, we don't replay it again
+            first_unsent = index + 1 if isinstance(e, EdgeResponseTimeout) else index
+            spool_requests(requests[first_unsent:])
+            break
+    if connection:
+        connection.close()
+
+
+def _send_bulks_in_parallel(
+    host: str,
+    bulks: List[RequestBody],
+    deadline: Optional[int] = None,
+    stats: Optional[ReportStats] = None,
+) -> None:
+    """
+    Send the bulks concurrently over the connection pool.
+    We wait for all the bulks together up to PARALLEL_SEND_DEADLINE (or the given deadline,
+        if it is sooner). The bulks that were not started are cancelled,
+        and the connections of the bulks that are still being sent are aborted.
+    """
+    executor = _get_edge_executor()
+    remaining_time = _get_remaining_time(deadline)
+    wait_timeout = PARALLEL_SEND_DEADLINE
+    if remaining_time is not None:
+        wait_timeout = max(min(wait_timeout, remaining_time), 0)
+    parallel_send = ParallelSend()
+    futures = [
+        executor.submit(_send_bulk_with_pool, host, bulk, deadline, stats, parallel_send)
+        for bulk in bulks
+    ]
+    _, not_done = concurrent.futures.wait(futures, timeout=wait_timeout)
+    # Bulks that are still being sent will be spooled by their own thread when they are aborted
+    _spool_undelivered_requests(
+        [bulk for future, bulk in zip(futures, bulks) if future in not_done and future.cancel()]
+    )
+    parallel_send.abort()
+    if not_done:
+        get_logger().warning(f"{len(not_done)} bulks were not sent before the deadline")
+        internal_analytics_message("report: parallel send deadline")
+
+
+def _send_bulk_with_pool(
+    host: str,
+    data: RequestBody,
+    deadline: Optional[int] = None,
+    stats: Optional[ReportStats] = None,
+    parallel_send: Optional[ParallelSend] = None,
+) -> None:
+    for attempt in range(2):
+        with measure(stats, "connection"):
+            connection = edge_connection_pool.acquire(host)
+        if not connection:
+            get_logger().warning("Cannot establish connection. Skip sending bulk.")
+            return
+        if parallel_send:
+            parallel_send.connections.add(connection)
+        try:
+            _post_to_edge(connection, data, deadline, stats)
+            edge_connection_pool.release(connection)
+            return
+        except Exception as e:
+            connection.close()
+            if parallel_send and parallel_send.aborted:
+                get_logger().info(f"The bulk was aborted after the deadline: ({str(e)})")
+                _spool_undelivered_requests([data])
+                return
+            if isinstance(e, socket.timeout):
+                _handle_edge_timeout(host, connection, data, deadline)
+                if not isinstance(e, EdgeResponseTimeout):
+                    _spool_undelivered_requests([data])
+                return
+            if attempt == 0 and _has_time_for_request(deadline, len(data)):
+                get_logger().info(f"Could not report bulk to {host}: ({str(e)}). Retrying.")
+            else:
+                get_logger().exception("Could not report: A bulk of spans was lost.", exc_info=e)
+                internal_analytics_message(f"report: {type(e)}")
+                _spool_undelivered_requests([data])
+                return
+        finally:
+            if parallel_send:
+                parallel_send.connections.discard(connection)
+
+
+def get_span_priority(span: Dict[Any, Any], has_error: Optional[bool] = None) -> int:
     if span.get("type") == FUNCTION_TYPE:
         return 0
     if span.get("type") == ENRICHMENT_TYPE:
         return 1
-    if is_span_has_error(span):
+    if is_span_has_error(span) if has_error is None else has_error:
         return 2
     return 3
 
 
+def span_metadata_without(
+    *omitted_fields: Tuple[str, ...]
+) -> Callable[[Dict[Any, Any]], Dict[Any, Any]]:
+    """
+    Creates a projector of the span metadata: the span without its payload fields.
+    Only the dicts along the paths of the omitted fields are copied (shallowly),
+    the rest of the span is shared with the metadata, so big payloads are never copied.
+
+    :param omitted_fields: The paths of keys to the fields to omit.
+    """
+
+    def project(span: Dict[Any, Any]) -> Dict[Any, Any]:
+        span_metadata = dict(span)
+        for path in omitted_fields:
+            parent = span_metadata
+            for key in path[:-1]:
+                child = parent.get(key)
+                if not isinstance(child, dict):
+                    break
+                child = dict(child)
+                parent[key] = child
+                parent = child
+            else:
+                parent.pop(path[-1], None)
+        span_metadata["isMetadata"] = True
+        return span_metadata
+
+    return project
+
+
+# The metadata projector of every supported span type, new span types should be added here
+SPAN_METADATA_PROJECTORS: Dict[str, Callable[[Dict[Any, Any]], Dict[Any, Any]]] = {
+    FUNCTION_TYPE: span_metadata_without(("envs",)),
+    ENRICHMENT_TYPE: span_metadata_without((EXECUTION_TAGS_KEY,)),
+    HTTP_TYPE: span_metadata_without(
+        ("info", "httpInfo", "request", "headers"),
+        ("info", "httpInfo", "request", "body"),
+        ("info", "httpInfo", "response", "headers"),
+        ("info", "httpInfo", "response", "body"),
+    ),
+    MONGO_SPAN: span_metadata_without(("request",), ("response",)),
+    REDIS_SPAN: span_metadata_without(("requestArgs",), ("response",)),
+    SQL_SPAN: span_metadata_without(("query",), ("values",), ("response",)),
+    VERTEXAI_SPAN: span_metadata_without(),
+}
+
+
 def get_span_metadata(span: Dict[Any, Any]) -> Dict[Any, Any]:
     with lumigo_safe_execute("get_span_metadata"):
         span_type = span.get("type")
-        span_copy = copy.deepcopy(span)
-        span_copy["isMetadata"] = True
-
-        if span_type == FUNCTION_TYPE:
-            span_copy.pop("envs", None)
-            return span_copy
-        if span_type == ENRICHMENT_TYPE:
-            span_copy.pop(EXECUTION_TAGS_KEY, None)
-            return span_copy
-        if span_type == HTTP_TYPE:
-            span_copy.get("info", {}).get("httpInfo", {}).get("request", {}).pop("headers", None)
-            span_copy.get("info", {}).get("httpInfo", {}).get("request", {}).pop("body", None)
-            span_copy.get("info", {}).get("httpInfo", {}).get("response", {}).pop("headers", None)
-            span_copy.get("info", {}).get("httpInfo", {}).get("response", {}).pop("body", None)
-            return span_copy
-        if span_type == MONGO_SPAN:
-            span_copy.pop("request", None)
-            span_copy.pop("response", None)
-            return span_copy
-        if span_type == REDIS_SPAN:
-            span_copy.pop("requestArgs", None)
-            span_copy.pop("response", None)
-            return span_copy
-        if span_type == SQL_SPAN:
-            span_copy.pop("query", None)
-            span_copy.pop("values", None)
-            span_copy.pop("response", None)
-            return span_copy
+        projector = SPAN_METADATA_PROJECTORS.get(span_type)  # type: ignore[arg-type]
+        if projector:
+            return projector(span)
 
     get_logger().warning(f"Got unsupported span type: {span_type}", extra={"span_type": span_type})
     return {}
 
 
 def _get_prioritized_spans(
-    msgs: List[dict], request_max_size: int, too_big_spans_threshold: int  # type: ignore[type-arg]
-) -> List[dict]:  # type: ignore[type-arg]
+    spans: List[SerializedSpan], request_max_size: int
+) -> List[SerializedSpan]:
     """
     When we exceed the request size limit, we need to apply the smart span selection.
 
-    The smart span selection has 3 parts:
-    1. We order the spans by the spans priority logic see get_span_priority.
-    2. We take all the spans metadata,
-    3 We take the full spans.
-    We do steps 2 and 3 until we reach the request_max_size.
+    The smart span selection has 2 parts, both by the spans priority logic see get_span_priority:
+    1. We take the spans metadata (we always take at least the function span).
+    2. We replace the metadata with the full spans.
+    Within the same priority the cheapest spans are taken first, so we fit as many spans as
+    possible. A span that doesn't fit doesn't stop the selection, so no budget is left unused.
+    The budget is the exact size of the json list that we are going to send.
     """
+    final_spans_list: List[SerializedSpan] = []
     with lumigo_safe_execute("create_request_body: smart span selection"):
         get_logger().info("Starting smart span selection")
-        # If we didn't send all the spans, we need to apply the smart span selection.
-        ordered_spans = sorted(msgs, key=get_span_priority)
+        priorities = [span.priority for span in spans]
+        selected: List[Optional[SerializedSpan]] = [None] * len(spans)
+        # Every span costs its size and a separator, the first one's separator pays for the brackets
+        budget = (request_max_size - SPANS_SEND_SIZE_ENRICHMENT_SPAN_BUFFER) // 4 * 3
         current_size = 0
-        too_big_spans = 0
-        spans_to_send_sizes = {}
-        spans_to_send_dict = {}
-
-        buffered_max_size = request_max_size - SPANS_SEND_SIZE_ENRICHMENT_SPAN_BUFFER
-
-        # Take only spans metadata
-        for index, span in enumerate(ordered_spans):
-            spans_to_send_sizes[index] = 0
-            span_metadata = get_span_metadata(span)
-            if span_metadata == {}:
-                continue
-            span_metadata_size = get_event_base64_size(span_metadata)
-
-            if (
-                current_size + span_metadata_size < buffered_max_size
-                or span.get("type") == FUNCTION_TYPE
-            ):
-                # We always want to at least send the function span
-                spans_to_send_dict[index] = span_metadata
-                spans_to_send_sizes[index] = span_metadata_size
-                current_size += span_metadata_size
-            else:
-                # This is an optimization step. If the spans are too big, don't try to send them.
-                too_big_spans += 1
-                if too_big_spans >= too_big_spans_threshold:
-                    break
-
-        # Override basic spans with full spans
-        for index, span in enumerate(ordered_spans):
-            span_metadata_size = spans_to_send_sizes[index]
-            span_size = get_event_base64_size(span)
-
-            if current_size + span_size - span_metadata_size < buffered_max_size:
-                spans_to_send_dict[index] = span
-                current_size += span_size - span_metadata_size
-            else:
-                # This is an optimization step. If the spans are too big, don't try to send them.
-                too_big_spans += 1
-                if too_big_spans >= too_big_spans_threshold:
-                    break
 
+        metadata_heap = []
+        for index, span in enumerate(spans):
+            if span.metadata is not None:
+                metadata_heap.append((priorities[index], span.metadata.size + 2, index))
+        heapq.heapify(metadata_heap)
+        while metadata_heap:
+            _, cost, index = heapq.heappop(metadata_heap)
+            if current_size + cost <= budget or spans[index].span.get("type") == FUNCTION_TYPE:
+                selected[index] = spans[index].metadata
+                current_size += cost
+
+        upgrade_heap = []
+        for index, span in enumerate(spans):
+            selected_span = selected[index]
+            cost = span.size - selected_span.size if selected_span else span.size + 2
+            upgrade_heap.append((priorities[index], cost, index))
+        heapq.heapify(upgrade_heap)
+        while upgrade_heap:
+            _, cost, index = heapq.heappop(upgrade_heap)
+            if current_size + cost <= budget:
+                selected[index] = spans[index]
+                current_size += cost
+
+        final_spans_list = [span for span in selected if span is not None]
         # If we dropped spans we need to update the enrichment spans dropped spans reasons
-        final_spans_list = list(spans_to_send_dict.values())
-        if len(spans_to_send_dict) != len(msgs):
+        if any(selected_span is not span for selected_span, span in zip(selected, spans)):
             with lumigo_safe_execute(
                 "create_request_body: smart span selection: updating enrichment span"
             ):
                 final_spans_list = _update_enrichment_span_about_prioritized_spans(
-                    spans_to_send_dict, msgs, current_size, request_max_size
+                    final_spans_list, spans, request_max_size
                 )
 
     return final_spans_list
 
 
 def _update_enrichment_span_about_prioritized_spans(
-    spans_dict: Dict[int, Dict[str, Any]],
-    msgs: List[Dict[str, Any]],
-    current_size: int,
-    max_size: int,
-) -> List[Dict[str, Any]]:
+    spans_to_send: List[SerializedSpan], msgs: List[SerializedSpan], max_size: int,
+) -> List[SerializedSpan]:
     """
     Looks at the given spans about to be sent + the total number of messages,
-    and updates the enrichment spans about any dropped spans
-    @param spans_dict: The mapping of spans about to be sent
+    and updates the enrichment spans about any dropped spans and spans that are sent as metadata
+    @param spans_to_send: The spans about to be sent
     @param msgs: The complete list of spans created
-    @param current_size: The current size of all the spans in spans_dict
     @param max_size: The maximum size of all spans together
     @return: An updated list of spans, including the updated enrichment span
     """
     # Split spans into enrichment span and all other spans
     enrichment_spans = []
     spans = []
-    spans_size = current_size
-    for span in spans_dict.values():
-        if span.get("type") == ENRICHMENT_TYPE:
+    for span in spans_to_send:
+        if span.span.get("type") == ENRICHMENT_TYPE:
             enrichment_spans.append(span)
-            current_span_size = get_event_base64_size(span)
-            spans_size -= current_span_size
         else:
             spans.append(span)
 
     if not enrichment_spans or len(enrichment_spans) > 1:
         # We should never get here, if we did it probably means a bug in the tracer code.
         get_logger().warning(f"Got unsupported number of enrichment spans: {len(enrichment_spans)}")
-        return list(spans_dict.values())
-
-    dropped_spans_due_to_size_limit = len(msgs) - len(spans_dict)
-    if dropped_spans_due_to_size_limit == 0:
-        return list(spans_dict.values())
+        return spans_to_send
+
+    sent_spans = {id(span) for span in spans_to_send}
+    dropped_spans_types: Dict[str, int] = Counter()
+    metadata_spans_types: Dict[str, int] = Counter()
+    for span in msgs:
+        if id(span) in sent_spans:
+            continue
+        span_type = str(span.span.get("type"))
+        if span.metadata is not None and id(span.metadata) in sent_spans:
+            metadata_spans_types[span_type] += 1
+        else:
+            dropped_spans_types[span_type] += 1
+    if not dropped_spans_types and not metadata_spans_types:
+        return spans_to_send
 
     # We have drops, we need to update the enrichment span about them
-    enrichment_span = dict(enrichment_spans[0])
-    dropped_spans_reasons = {
-        **enrichment_span.get(DROPPED_SPANS_REASONS_KEY, {}),
-        DroppedSpansReasons.SPANS_SENT_SIZE_LIMIT.value: {
-            "drops": dropped_spans_due_to_size_limit,
-        },
-    }
+    enrichment_span = dict(enrichment_spans[0].span)
+    dropped_spans_reasons = dict(enrichment_span.get(DROPPED_SPANS_REASONS_KEY, {}))
+    if dropped_spans_types:
+        dropped_spans_reasons[DroppedSpansReasons.SPANS_SENT_SIZE_LIMIT.value] = {
+            "drops": sum(dropped_spans_types.values()),
+            "dropsByType": dict(dropped_spans_types),
+        }
+    if metadata_spans_types:
+        dropped_spans_reasons[DroppedSpansReasons.SPANS_SENT_AS_METADATA.value] = {
+            "drops": sum(metadata_spans_types.values()),
+            "dropsByType": dict(metadata_spans_types),
+        }
     enrichment_span[DROPPED_SPANS_REASONS_KEY] = dropped_spans_reasons
+    serialized_enrichment_span = SerializedSpan(enrichment_span)
 
     # Check if the enrichment span size increased too much
-    enrichment_span_size = get_event_base64_size(enrichment_span)
-    if enrichment_span_size + spans_size > max_size:
+    updated_spans = spans + [serialized_enrichment_span]
+    total_size = get_base64_size(get_serialized_spans_size(updated_spans))
+    if total_size > max_size:
         get_logger().warning(
-            f"Enrichment span size increased (enrichment span size {enrichment_span_size} bytes), "
-            f"making the total size too big: {spans_size + enrichment_span_size} bytes (max: {max_size} bytes)"
+            f"Enrichment span size increased (enrichment span size {serialized_enrichment_span.size} bytes), "
+            f"making the total size too big: {total_size} bytes (max: {max_size} bytes)"
         )
-        return list(spans_dict.values())
+        return spans_to_send
 
-    return spans + [enrichment_span]
+    return updated_spans
 
 
 def _create_request_body(
@@ -404,11 +1092,16 @@ def _create_request_body(
     should_try_zip: bool,
     max_size: int = MAX_SIZE_FOR_REQUEST,
     max_error_size: int = MAX_SIZE_FOR_REQUEST_ON_ERROR,
-    too_big_spans_threshold: int = TOO_BIG_SPANS_THRESHOLD,
-) -> Union[str, List[str]]:
+    max_bulks: Optional[int] = None,
+    stats: Optional[ReportStats] = None,
+    cached_spans: Optional[Dict[str, SerializedSpan]] = None,
+    has_error: Optional[bool] = None,
+) -> Union[str, List[RequestBody]]:
     """
     This function creates the request body from the given spans.
     If there is an error we limit the size of the request to max_error_size otherwise to max_size.
+    Whether there is an error is given by has_error, or checked in the spans if it's not given.
+    When zipping, we split the spans into up to max_bulks requests.
 
     First we try to take all the spans and then we apply the smart span selection.
 
@@ -416,13 +1109,23 @@ def _create_request_body(
     1. We order the spans by FUNCTION_SPAN, ERROR_HTTP_SPAN, ENRICHMENT_SPAN, HTTP_SPAN.
     2. We take all the spans metadata, We take the full spans. We do this until reach the max_size.
     """
-    request_size_limit = max_error_size if any(map(is_span_has_error, msgs)) else max_size
+    with measure(stats, "serialization"):
+        serialized_spans = [_get_serialized_span(span, cached_spans) for span in msgs]
+        spans_size = get_base64_size(get_serialized_spans_size(serialized_spans))
+    if has_error is None:
+        has_error = any(span.has_error for span in serialized_spans)
+    request_size_limit = max_error_size if has_error else max_size
+    if stats:
+        stats.uncompressed_bytes = get_serialized_spans_size(serialized_spans)
 
     if not prune_size_flag or (
         len(msgs) < NUMBER_OF_SPANS_IN_REPORT_OPTIMIZATION
-        and get_event_base64_size(msgs) < request_size_limit  # noqa
+        and spans_size < request_size_limit  # noqa
     ):
-        return aws_dump(msgs)[:request_size_limit]
+        with measure(stats, "serialization"):
+            return _dump_serialized_spans(
+                serialized_spans, request_size_limit, should_use_compact_envelope()
+            )
 
     # Process spans: if should_try_zip is True, split and zip the spans, check their size,
     # and either return the zipped bulks or continue processing.
@@ -431,37 +1134,84 @@ def _create_request_body(
         get_logger().debug(
             f"Spans are too big, [{len(msgs)}] spans, bigger than: [{request_size_limit}], trying to split and zip"
         )
-        with lumigo_safe_execute("create_request_body: split and zip spans"):
-            zipped_spans_bulks = _split_and_zip_spans(msgs)
-            are_all_spans_small_enough = all(
-                len(zipped_span) <= request_size_limit for zipped_span in zipped_spans_bulks
+        with lumigo_safe_execute("create_request_body: split and zip spans"), measure(
+            stats, "compression"
+        ):
+            zipped_spans_bulks = _split_and_zip_serialized_spans(
+                serialized_spans, request_size_limit, max_bulks
             )
-
-            if are_all_spans_small_enough:
+            if zipped_spans_bulks:
                 get_logger().debug(f"Created {len(zipped_spans_bulks)} bulks of zipped spans")
                 return zipped_spans_bulks
-            else:
-                # Continue trimming spans logic goes here
-                get_logger().debug(
-                    "Some spans are still too large, further trimming may be needed."
-                )
-                pass
+            # Continue to the trimming spans logic
+            get_logger().debug("Some spans are too large even after zipping, trimming spans.")
+
+    with measure(stats, "prioritization"):
+        current_size = 0
+        spans_to_send: List[SerializedSpan] = []
+        for span in serialized_spans:
+            span_size = span.base64_size
+            if current_size + span_size > request_size_limit:
+                break
+
+            spans_to_send.append(span)
+            current_size += span_size
+
+        if len(spans_to_send) < len(serialized_spans):
+            selected_spans = _get_prioritized_spans(serialized_spans, request_size_limit)
+            spans_to_send = sorted(selected_spans, key=lambda s: s.priority)
+
+    with measure(stats, "serialization"):
+        return _dump_serialized_spans(
+            spans_to_send, request_size_limit, should_use_compact_envelope()
+        )
+
+
+def _get_serialized_span(
+    span: Dict[Any, Any], cached_spans: Optional[Dict[str, SerializedSpan]]
+) -> SerializedSpan:
+    """
+    :return: The cached serialization of the span if it is of this very span, otherwise a new one.
+    """
+    cached = cached_spans.get(span.get("id")) if cached_spans else None  # type: ignore[arg-type]
+    if cached is not None and cached.span is span:
+        return cached
+    return SerializedSpan(span)
 
-    current_size = 0
-    spans_to_send: List[dict] = []  # type: ignore[type-arg]
-    for index, span in enumerate(msgs):
-        span_size = get_event_base64_size(span)
-        if current_size + span_size > request_size_limit:
-            break
 
-        spans_to_send.append(span)
+def _dump_serialized_spans(
+    spans: List[SerializedSpan], max_size: Optional[int] = None, compact: bool = False
+) -> str:
+    """
+    Join the already serialized spans into a json list, identical to `aws_dump` of the spans.
+    If max_size is given, we take the longest prefix of the spans that fits into it,
+    so the result is always a valid json.
+    If compact is set, we use the compact envelope, unless it's not smaller than the list.
+    """
+    dumped_spans: List[str] = []
+    current_size = 2  # The list brackets
+    for span in spans:
+        span_size = span.size + (2 if dumped_spans else 0)  # The ", " separator
+        if max_size is not None and current_size + span_size > max_size:
+            get_logger().warning(
+                f"Dropping {len(spans) - len(dumped_spans)} spans that exceed the request size limit"
+            )
+            break
+        dumped_spans.append(span.dumped)
         current_size += span_size
+    dumped = "[" + ", ".join(dumped_spans) + "]"
+    if compact:
+        envelope = dump_compact_envelope([span.field_dumps for span in spans[: len(dumped_spans)]])
+        if len(envelope) < len(dumped):
+            return envelope
+    return dumped
 
-    if len(spans_to_send) < len(msgs):
-        selected_spans = _get_prioritized_spans(msgs, request_size_limit, too_big_spans_threshold)
-        spans_to_send = sorted(selected_spans, key=get_span_priority)
 
-    return aws_dump(spans_to_send)[:request_size_limit]
+def get_serialized_spans_size(spans: List[SerializedSpan]) -> int:
+    """
+    :return: The exact size of the json list of the given spans, without dumping it again.
+    """
+    return 2 + sum(span.size for span in spans) + 2 * max(len(spans) - 1, 0)
 
 
 def write_spans_to_files(
@@ -477,8 +1227,11 @@ def write_spans_to_files(
 
 
 def write_extension_file(data: List[Dict], span_type: str):  # type: ignore[no-untyped-def,type-arg]
-    Path(get_extension_dir()).mkdir(parents=True, exist_ok=True)
     to_send = aws_dump(data).encode()
+    if should_use_extension_segments():
+        get_segment_writer(get_extension_dir()).append(span_type, to_send)
+        return
+    Path(get_extension_dir()).mkdir(parents=True, exist_ok=True)
     file_path = get_span_file_name(span_type)
     with open(file_path, "wb") as span_file:
         span_file.write(to_send)
@@ -494,7 +1247,9 @@ def get_span_file_name(span_type: str):  # type: ignore[no-untyped-def]
     return os.path.join(get_extension_dir(), f"{unique_name}_{span_type}")
 
 
-def _publish_spans_to_kinesis(to_send: bytes, region: str) -> int:
+def _publish_spans_to_kinesis(
+    msgs: List[Dict[Any, Any]], prune_size_flag: bool, region: str, deadline: Optional[int] = None
+) -> int:
     start_time = time.time()
     try:
         get_logger().info("Sending spans to Kinesis")
@@ -508,10 +1263,11 @@ def _publish_spans_to_kinesis(to_send: bytes, region: str) -> int:
             return 0
         _send_data_to_kinesis(
             stream_name=Configuration.edge_kinesis_stream_name,
-            to_send=to_send,
+            records=_create_kinesis_records(msgs, prune_size_flag),
             region=region,
             aws_access_key_id=Configuration.edge_kinesis_aws_access_key_id,
             aws_secret_access_key=Configuration.edge_kinesis_aws_secret_access_key,
+            deadline=deadline,
         )
     except Exception as err:
         get_logger().exception("Failed to send spans to Kinesis", exc_info=err)
@@ -519,13 +1275,46 @@ def _publish_spans_to_kinesis(to_send: bytes, region: str) -> int:
     return int((time.time() - start_time) * 1000)
 
 
-def _send_data_to_kinesis(  # type: ignore[no-untyped-def]
+def _create_kinesis_records(msgs: List[Dict[Any, Any]], prune_size_flag: bool) -> List[bytes]:
+    """
+    Split the spans into records, each is a json list of spans up to the Kinesis record size.
+
+    If the spans exceed EDGE_KINESIS_MAX_SIZE we apply the smart span selection,
+    and a span that is too big for a record by itself is sent as metadata only.
+    """
+    serialized_spans = [SerializedSpan(span) for span in msgs]
+    if prune_size_flag and get_serialized_spans_size(serialized_spans) > EDGE_KINESIS_MAX_SIZE:
+        serialized_spans = _get_prioritized_spans(
+            serialized_spans, get_base64_size(EDGE_KINESIS_MAX_SIZE)
+        )
+    max_record_size = KINESIS_MAX_RECORD_SIZE - KINESIS_MAX_PARTITION_KEY_SIZE
+    records: List[bytes] = []
+    record_spans: List[SerializedSpan] = []
+    record_size = 2  # The list brackets
+    for span in serialized_spans:
+        if span.size + 4 > max_record_size:
+            if not span.metadata or span.metadata.size + 4 > max_record_size:
+                get_logger().warning("A span is too big to be sent to Kinesis even as metadata")
+                continue
+            span = span.metadata
+        if record_spans and record_size + span.size + 2 > max_record_size:
+            records.append(_dump_serialized_spans(record_spans).encode())
+            record_spans, record_size = [], 2
+        record_spans.append(span)
+        record_size += span.size + 2  # The span and its separator
+    if record_spans:
+        records.append(_dump_serialized_spans(record_spans).encode())
+    return records
+
+
+def _send_data_to_kinesis(
     stream_name: str,
-    to_send: bytes,
+    records: List[bytes],
     region: str,
     aws_access_key_id: str,
     aws_secret_access_key: str,
-):
+    deadline: Optional[int] = None,
+) -> None:
     if not boto3:
         get_logger().error("boto3 is missing. Unable to send to Kinesis.")
         return None
@@ -534,13 +1323,87 @@ def _send_data_to_kinesis(  # type: ignore[no-untyped-def]
         aws_access_key_id=aws_access_key_id,
         aws_secret_access_key=aws_secret_access_key,
     )
-    client.put_record(Data=to_send, StreamName=stream_name, PartitionKey=str(random.random()))
-    get_logger().info("Successful sending to Kinesis")
+    entries = [{"Data": record, "PartitionKey": str(random.random())} for record in records]
+    lost_records = 0
+    for batch in _get_kinesis_batches(entries):
+        lost_records += _put_kinesis_records(client, stream_name, batch, deadline)
+    if lost_records:
+        get_logger().warning(f"Failed to send {lost_records} records to Kinesis: spans were lost.")
+        internal_analytics_message("report: kinesis records lost")
+    else:
+        get_logger().info(f"Successful sending {len(entries)} records to Kinesis")
+
+
+def _get_kinesis_batches(entries: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """
+    Split the entries into batches that are within the limits of a single put_records.
+    """
+    batches: List[List[Dict[str, Any]]] = []
+    batch: List[Dict[str, Any]] = []
+    batch_size = 0
+    for entry in entries:
+        entry_size = len(entry["Data"]) + len(entry["PartitionKey"])
+        if batch and (
+            len(batch) >= KINESIS_MAX_RECORDS_PER_REQUEST
+            or batch_size + entry_size > KINESIS_MAX_REQUEST_SIZE  # noqa
+        ):
+            batches.append(batch)
+            batch, batch_size = [], 0
+        batch.append(entry)
+        batch_size += entry_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _put_kinesis_records(
+    client: Any, stream_name: str, entries: List[Dict[str, Any]], deadline: Optional[int] = None
+) -> int:
+    """
+    Send the entries with put_records, and retry only the entries that failed (e.g. throttled).
+    We retry only if there is enough time for another request before the deadline.
+
+    :return: The number of entries that were not sent.
+    """
+    for attempt in range(KINESIS_MAX_ATTEMPTS):
+        if attempt:
+            if not _has_time_for_request(deadline):
+                get_logger().info("Not retrying the failed Kinesis records due to the deadline")
+                break
+            time.sleep(KINESIS_RETRY_BACKOFF * 2 ** (attempt - 1))
+        response = client.put_records(Records=entries, StreamName=stream_name)
+        if not response.get("FailedRecordCount"):
+            return 0
+        results = response["Records"]
+        entries = [entry for entry, result in zip(entries, results) if result.get("ErrorCode")]
+        error_codes = Counter(result["ErrorCode"] for result in results if result.get("ErrorCode"))
+        get_logger().info(f"Failed to send {len(entries)} records to Kinesis: {dict(error_codes)}")
+    return len(entries)
+
+
+def warm_edge_kinesis_client() -> None:
+    """
+    Build the Kinesis client during the initialization, so it's not built on the invocation's path.
+    The credentials are taken from the environment, as the tracer is not configured yet.
+    """
+    aws_access_key_id = Configuration.edge_kinesis_aws_access_key_id or os.environ.get(
+        "LUMIGO_EDGE_KINESIS_AWS_ACCESS_KEY_ID"
+    )
+    aws_secret_access_key = Configuration.edge_kinesis_aws_secret_access_key or os.environ.get(
+        "LUMIGO_EDGE_KINESIS_AWS_SECRET_ACCESS_KEY"
+    )
+    if boto3 and aws_access_key_id and aws_secret_access_key:
+        _get_edge_kinesis_boto_client(CHINA_REGION, aws_access_key_id, aws_secret_access_key)
 
 
 def _get_edge_kinesis_boto_client(region: str, aws_access_key_id: str, aws_secret_access_key: str):  # type: ignore[no-untyped-def]
-    global edge_kinesis_boto_client
-    if not edge_kinesis_boto_client or _is_edge_kinesis_connection_cache_disabled():
+    global edge_kinesis_boto_client, edge_kinesis_boto_client_key
+    client_key = (region, aws_access_key_id, aws_secret_access_key)
+    if (
+        not edge_kinesis_boto_client
+        or edge_kinesis_boto_client_key != client_key  # noqa
+        or _is_edge_kinesis_connection_cache_disabled()  # noqa
+    ):
         edge_kinesis_boto_client = boto3.client(
             "kinesis",
             region_name=region,
@@ -548,6 +1411,7 @@ def _get_edge_kinesis_boto_client(region: str, aws_access_key_id: str, aws_secre
             aws_secret_access_key=aws_secret_access_key,
             config=botocore.config.Config(retries={"max_attempts": 1, "mode": "standard"}),
         )
+        edge_kinesis_boto_client_key = client_key
     return edge_kinesis_boto_client
 
 
@@ -559,23 +1423,136 @@ def _should_try_zip() -> bool:
     return os.environ.get("LUMIGO_SUPPORT_LARGE_INVOCATIONS", "").lower() == "true"
 
 
-def _split_and_zip_spans(spans: List[Dict[Any, Any]]) -> List[str]:
+def _get_edge_content_encoding() -> Optional[str]:
+    """
+    :return: The Content-Encoding to send to the edge, or None to send plain json.
+    """
+    if InternalState.edge_rejected_content_encoding:
+        return None
+    content_encoding = os.environ.get("LUMIGO_EDGE_CONTENT_ENCODING", "").lower()
+    return content_encoding if content_encoding in CONTENT_ENCODING_WBITS else None
+
+
+def _should_use_compression_dictionary() -> bool:
+    return os.environ.get("LUMIGO_EDGE_COMPRESSION_DICTIONARY", "").lower() == "true"
+
+
+def _create_compressor(wbits: int) -> "zlib._Compress":
+    """
+    The preset dictionary is supported only by the zlib format, which is sent as "deflate".
+    """
+    if wbits == zlib.MAX_WBITS and _should_use_compression_dictionary():
+        return zlib.compressobj(
+            COMPRESSION_LEVEL, zlib.DEFLATED, wbits, zdict=COMPRESSION_DICTIONARY
+        )
+    return zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, wbits)
+
+
+def _compress(data: bytes, content_encoding: str) -> bytes:
+    compressor = _create_compressor(CONTENT_ENCODING_WBITS[content_encoding])
+    return compressor.compress(data) + compressor.flush()
+
+
+def _is_compressed_with_dictionary(data: bytes) -> bool:
+    return not data.startswith(GZIP_MAGIC) and len(data) > 1 and bool(data[1] & ZLIB_FDICT_FLAG)
+
+
+def _decompress(data: bytes) -> bytes:
+    if _is_compressed_with_dictionary(data):
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=COMPRESSION_DICTIONARY)
+    else:
+        # zlib detects the header of both gzip and deflate formats
+        decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+class ZippedBulk:
+    """
+    A gzipped json list of spans, that is filled incrementally until it reaches its size limit.
+
+    We avoid compressing every span twice: as long as the upper bound of the compressed size is
+    below the limit, the span is just fed to the compressor. Only near the limit we compress a
+    copy of the compressor to get the exact size.
+    """
+
+    def __init__(self, max_size: int, wbits: int = GZIP_WBITS):
+        self.max_size = max_size
+        self.spans_count = 0
+        self._compressor = _create_compressor(wbits)
+        self._chunks: List[bytes] = [self._compressor.compress(b"[")]
+        self._output_size = len(self._chunks[0])
+        # The exact size of the closed bulk at the last time we checked it,
+        #   and the uncompressed size of the data that was added since.
+        self._exact_size = 0
+        self._pending_size = 1
+
+    def try_add(self, span: SerializedSpan) -> bool:
+        data = (b", " if self.spans_count else b"") + span.dumped.encode()
+        size_upper_bound = self._exact_size + _get_max_deflated_size(self._pending_size + len(data))
+        if size_upper_bound > self.max_size:
+            probe = self._compressor.copy()
+            exact_size = self._output_size + len(probe.compress(data + b"]")) + len(probe.flush())
+            if exact_size > self.max_size:
+                return False
+            self._exact_size = exact_size
+            self._pending_size = 0
+        else:
+            self._pending_size += len(data)
+        chunk = self._compressor.compress(data)
+        self._chunks.append(chunk)
+        self._output_size += len(chunk)
+        self.spans_count += 1
+        return True
+
+    def close(self) -> bytes:
+        self._chunks.append(self._compressor.compress(b"]"))
+        self._chunks.append(self._compressor.flush())
+        return b"".join(self._chunks)
+
+
+def _get_max_deflated_size(size: int) -> int:
+    """
+    :return: An upper bound of the deflated size of `size` bytes, even if they are incompressible.
+    """
+    return size + size // 1000 + ZIPPED_BULK_OVERHEAD
+
+
+def _split_and_zip_spans(
+    spans: List[Dict[Any, Any]], max_size: int = MAX_SIZE_FOR_REQUEST
+) -> List[RequestBody]:
     """
     Split spans into bulks and gzip each bulk.
     """
-    # Start time
+    return _split_and_zip_serialized_spans([SerializedSpan(span) for span in spans], max_size)
+
+
+def _split_and_zip_serialized_spans(
+    spans: List[SerializedSpan], max_size: int, max_bulks: Optional[int] = None
+) -> List[RequestBody]:
+    """
+    Pack the spans into as few zipped bulks as possible (up to max_bulks),
+    each bulk's request is up to max_size.
+
+    If all the spans fit in a single bulk we keep their original order.
+    Otherwise, we pack them by their priority, so the important spans are sent first.
+    Spans that are too big for a bulk by themselves are sent as metadata only.
+
+    When the edge content encoding is configured, the bulks are sent as is (with a matching
+    Content-Encoding header). Otherwise, each request is the base64 of the bulk, as a json string.
+
+    :return: The requests to send, or an empty list if some spans could not be sent even as metadata
+        or if more than max_bulks bulks are needed.
+    """
     start_time = time.time()
-    get_logger().debug(f"Splitting the spans into bulks of {MAX_SPANS_BULK_SIZE} spans")
-    spans_bulks = []
-    for i in range(0, len(spans), MAX_SPANS_BULK_SIZE):
-        start_index = i
-        end_index = i + MAX_SPANS_BULK_SIZE
-        bulk = spans[start_index:end_index]
-        zipped_spans = b64encode(gzip_compress(aws_dump(bulk).encode("utf-8"))).decode("utf-8")
-        spans_bulks.append(aws_dump(zipped_spans))
-    # End time and calculate duration
-    end_time = time.time()
-    duration = end_time - start_time
+    content_encoding = _get_edge_content_encoding()
+    wbits = CONTENT_ENCODING_WBITS[content_encoding] if content_encoding else GZIP_WBITS
+    max_zipped_size = max_size if content_encoding else (max_size - 2) // 4 * 3
+    zipped_bulks = _pack_zipped_bulks(spans, max_zipped_size, wbits, max_bulks=1)
+    if zipped_bulks is None:
+        prioritized_spans = sorted(spans, key=lambda s: s.priority)
+        zipped_bulks = _pack_zipped_bulks(prioritized_spans, max_zipped_size, wbits, max_bulks)
+    spans_bulks = _encode_zipped_bulks(zipped_bulks or [], content_encoding)
+    duration = time.time() - start_time
 
     # Log the execution time
     get_logger().debug(
@@ -584,5 +1561,105 @@ def _split_and_zip_spans(spans: List[Dict[Any, Any]]) -> List[str]:
     return spans_bulks
 
 
+def can_stream_spans(region: Optional[str]) -> bool:
+    """
+    :return: Whether the reporter can take spans as a stream (see `report_json`),
+        which is when it sends them in as many zipped bulks as needed.
+    """
+    return _should_try_zip() and region != CHINA_REGION and not should_use_tracer_extension()
+
+
+def _add_streamed_spans_bulks(
+    to_send: Union[str, List[RequestBody]],
+    spans: Iterable[SerializedSpan],
+    max_size: int,
+    max_bulks: Optional[int] = None,
+    stats: Optional[ReportStats] = None,
+) -> List[RequestBody]:
+    """
+    :return: The requests to send, with the zipped bulks of the streamed spans.
+        If the requests are limited to max_bulks (by the deadline), there is no room for them.
+    """
+    requests: List[RequestBody] = to_send if isinstance(to_send, list) else [to_send]
+    if max_bulks is not None:
+        get_logger().warning("Skip sending the streamed spans, there is no time left")
+        return requests
+    with measure(stats, "compression"):
+        return requests + _zip_streamed_spans(spans, max_size)
+
+
+def _zip_streamed_spans(spans: Iterable[SerializedSpan], max_size: int) -> List[RequestBody]:
+    """
+    Pack the spans into zipped bulks as they are read, so only the compressed bulks are kept in memory.
+    Spans that are too big for a bulk by themselves are sent as metadata only, or dropped.
+    """
+    content_encoding = _get_edge_content_encoding()
+    wbits = CONTENT_ENCODING_WBITS[content_encoding] if content_encoding else GZIP_WBITS
+    max_zipped_size = max_size if content_encoding else (max_size - 2) // 4 * 3
+    bulks: List[bytes] = []
+    current_bulk = ZippedBulk(max_zipped_size, wbits)
+    for span in spans:
+        if current_bulk.try_add(span):
+            continue
+        if current_bulk.spans_count:
+            bulks.append(current_bulk.close())
+            current_bulk = ZippedBulk(max_zipped_size, wbits)
+            if current_bulk.try_add(span):
+                continue
+        if not (span.metadata and current_bulk.try_add(span.metadata)):
+            get_logger().warning("A streamed span is too big to be sent even as metadata")
+    if current_bulk.spans_count:
+        bulks.append(current_bulk.close())
+    get_logger().debug(f"Zipped the streamed spans into {len(bulks)} bulks")
+    return _encode_zipped_bulks(bulks, content_encoding)
+
+
+def _encode_zipped_bulks(bulks: List[bytes], content_encoding: Optional[str]) -> List[RequestBody]:
+    """
+    When the edge content encoding is configured, the bulks are sent as is (with a matching
+    Content-Encoding header). Otherwise, each request is the base64 of the bulk, as a json string.
+    """
+    if content_encoding:
+        return list(bulks)
+    return [aws_dump(b64encode(bulk).decode("utf-8")) for bulk in bulks]
+
+
+def _pack_zipped_bulks(
+    spans: List[SerializedSpan],
+    max_zipped_size: int,
+    wbits: int = GZIP_WBITS,
+    max_bulks: Optional[int] = None,
+) -> Optional[List[bytes]]:
+    """
+    :return: The closed bulks, or None if more than `max_bulks` bulks are needed or a span was lost.
+    """
+    bulks: List[bytes] = []
+    current_bulk = ZippedBulk(max_zipped_size, wbits)
+    for span in spans:
+        if current_bulk.try_add(span):
+            continue
+        if current_bulk.spans_count:
+            bulks.append(current_bulk.close())
+            if max_bulks is not None and len(bulks) >= max_bulks:
+                return None
+            current_bulk = ZippedBulk(max_zipped_size, wbits)
+            if current_bulk.try_add(span):
+                continue
+        # The span is too big for a bulk by itself
+        if not (span.metadata and current_bulk.try_add(span.metadata)):
+            get_logger().warning("A span is too big to be sent even as metadata")
+            return None
+    if current_bulk.spans_count:
+        bulks.append(current_bulk.close())
+    return bulks
+
+
 def get_event_base64_size(event: Union[Dict[Any, Any], List[Dict[Any, Any]]]) -> int:
-    return len(b64encode(aws_dump(event).encode()))
+    return get_base64_size(len(aws_dump(event)))
+
+
+def get_base64_size(size: int) -> int:
+    """
+    :return: The length of the base64 encoding of `size` bytes, without encoding them.
+    """
+    return 4 * ((size + 2) // 3)
@@ -0,0 +1,82 @@
+"""
+Streams the spans over a Unix domain socket to a local collector process (e.g. the extension),
+which takes the TLS and the network latency off the function's critical path.
+
+Every report is a frame, in the record format of the extension segments:
+    [record type: 1 byte][payload length: 4 bytes, big endian][payload]
+A frame that was partially sent is followed by closing the connection, so the collector
+should discard an incomplete frame at the end of a connection.
+"""
+import os
+import socket
+import threading
+from typing import Optional
+
+from lumigo_tracer.lambda_tracer.extension_segment import RECORD_HEADER, RECORD_TYPES
+from lumigo_tracer.lumigo_utils import get_logger
+
+COLLECTOR_SOCKET_TIMEOUT = float(os.environ.get("LUMIGO_COLLECTOR_SOCKET_TIMEOUT", 0.2))
+
+collector_socket: Optional[socket.socket] = None
+collector_socket_path: Optional[str] = None
+# The socket is shared with the background reporter, so only one thread may use it at a time.
+collector_lock = threading.RLock()
+
+
+def get_collector_socket_path() -> Optional[str]:
+    return os.environ.get("LUMIGO_COLLECTOR_SOCKET") or None
+
+
+def connect_to_collector() -> bool:
+    """
+    Connect to the collector, unless we are already connected.
+
+    :return: Whether we are connected to the collector.
+    """
+    global collector_socket, collector_socket_path
+    path = get_collector_socket_path()
+    if not path:
+        return False
+    with collector_lock:
+        if collector_socket and collector_socket_path == path:
+            return True
+        close_collector_socket()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(COLLECTOR_SOCKET_TIMEOUT)
+        try:
+            sock.connect(path)
+        except OSError as e:
+            sock.close()
+            get_logger().debug(f"Could not connect to the collector at {path}: {e}")
+            return False
+        collector_socket, collector_socket_path = sock, path
+        return True
+
+
+def send_to_collector(record_type: str, payload: bytes) -> bool:
+    """
+    Send a frame to the collector. If the connection was closed (e.g. the collector restarted),
+    we reconnect and send the frame again once.
+
+    :return: Whether the frame was sent, otherwise the caller should fall back to another transport.
+    """
+    frame = RECORD_HEADER.pack(RECORD_TYPES[record_type], len(payload)) + payload
+    with collector_lock:
+        for attempt in range(2):
+            if not connect_to_collector():
+                return False
+            try:
+                collector_socket.sendall(frame)  # type: ignore[union-attr]
+                return True
+            except OSError as e:
+                get_logger().info(f"Could not send to the collector (attempt {attempt}): {e}")
+                close_collector_socket()
+    return False
+
+
+def close_collector_socket() -> None:
+    global collector_socket, collector_socket_path
+    with collector_lock:
+        if collector_socket:
+            collector_socket.close()
+        collector_socket, collector_socket_path = None, None
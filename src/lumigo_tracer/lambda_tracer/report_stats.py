@@ -0,0 +1,75 @@
+"""
+The breakdown of a report to the edge: how long each phase took and how many bytes were sent.
+
+The enrichment span is created before it is reported, so it carries the stats of the last report
+that was completed (usually the start span of the invocation, or the end of the previous one).
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+REPORT_STATS_KEY = "reporterStats"
+PHASES = ("serialization", "prioritization", "compression", "connection", "send", "response")
+
+
+class ReportStats:
+    """
+    The stats of a single report. Bulks may be sent in parallel, so the phase durations are summed.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.phase_durations: Dict[str, float] = {phase: 0.0 for phase in PHASES}
+        self.uncompressed_bytes = 0
+        self.sent_bytes = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def add_duration(self, phase: str, duration: float) -> None:
+        with self._lock:
+            self.phase_durations[phase] += duration
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **{f"{phase}Ms": _to_ms(duration) for phase, duration in self.phase_durations.items()},
+            "totalMs": _to_ms(time.time() - self.started),
+            "uncompressedBytes": self.uncompressed_bytes,
+            "sentBytes": self.sent_bytes,
+            "requests": self.requests,
+        }
+
+
+@contextmanager
+def measure(stats: Optional[ReportStats], phase: str) -> Iterator[None]:
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats:
+            stats.add_duration(phase, time.perf_counter() - start_time)
+
+
+last_report_stats: Optional[Dict[str, Any]] = None
+
+
+def record_report(stats: ReportStats) -> Dict[str, Any]:
+    """
+    :return: The recorded stats, to be logged with the report.
+    """
+    global last_report_stats
+    last_report_stats = stats.to_dict()
+    return last_report_stats
+
+
+def get_last_report_stats() -> Optional[Dict[str, Any]]:
+    return last_report_stats
+
+
+def reset() -> None:
+    global last_report_stats
+    last_report_stats = None
+
+
+def _to_ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
@@ -0,0 +1,203 @@
+"""
+Compact span objects, instead of nested dicts.
+
+A dict of a dozen keys costs several hundreds of bytes, while an object with `__slots__` keeps
+only a pointer per field. These spans are mutable mappings of their set fields, so the wrappers
+and the reporter use them exactly like span dicts, and they become dicts only when reported.
+The nested parts of a known structure (e.g. `info.httpInfo` of an HTTP span) are slotted mappings too.
+"""
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Iterator,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Tuple,
+    Type,
+)
+
+from lumigo_core.scrubbing import MANUAL_TRACES_KEY
+
+from lumigo_tracer.lambda_tracer.lambda_reporter import (
+    FUNCTION_TYPE,
+    HTTP_TYPE,
+    MONGO_SPAN,
+    REDIS_SPAN,
+    SQL_SPAN,
+)
+
+
+class SlottedMapping(MutableMapping[str, Any]):
+    """
+    A mapping whose known fields are slots. A field that was not set is missing from the mapping.
+    Fields that are not slots are kept in an extra dict, which is created only when needed.
+    A mapping that is set to a field in NESTED is converted to the slotted mapping of that field.
+    """
+
+    __slots__ = ("_extra",)
+    FIELDS: Tuple[str, ...] = ()
+    FIELD_NAMES: FrozenSet[str] = frozenset()
+    NESTED: Dict[str, Type["SlottedMapping"]] = {}
+
+    def __init_subclass__(cls, **kwargs: Any):
+        super().__init_subclass__(**kwargs)
+        cls.FIELDS = tuple(
+            name
+            for klass in reversed(cls.__mro__)
+            for name in klass.__dict__.get("__slots__", ())
+            if not name.startswith("_")
+        )
+        cls.FIELD_NAMES = frozenset(cls.FIELDS)
+
+    def __init__(self, **fields: Any):
+        self._extra: Optional[Dict[str, Any]] = None
+        self.update(fields)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.FIELD_NAMES:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        nested_type = self.NESTED.get(key)
+        if nested_type and isinstance(value, Mapping) and not isinstance(value, nested_type):
+            value = nested_type(**value)
+        if key in self.FIELD_NAMES:
+            setattr(self, key, value)
+            return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in self.FIELD_NAMES:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+            return
+        if self._extra is None:
+            raise KeyError(key)
+        del self._extra[key]
+
+    def __contains__(self, key: object) -> bool:
+        if key in self.FIELD_NAMES:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self) -> Iterator[str]:
+        for name in self.FIELDS:
+            if hasattr(self, name):
+                yield name
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self)})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        :return: The wire dict of this mapping, the nested slotted mappings become dicts too.
+        """
+        return {
+            key: value.to_dict() if isinstance(value, SlottedMapping) else value
+            for key, value in self.items()
+        }
+
+
+class SlottedSpan(SlottedMapping):
+    __slots__ = ("id", "type", "started", "ended", "error")
+    SPAN_TYPE = ""
+
+    def __init__(self, **fields: Any):
+        self._extra = None
+        self["type"] = self.SPAN_TYPE
+        self.update(fields)
+
+
+class RedisSpan(SlottedSpan):
+    __slots__ = ("requestCommand", "requestArgs", "connectionOptions", "response")
+    SPAN_TYPE = REDIS_SPAN
+
+
+class MongoSpan(SlottedSpan):
+    __slots__ = (
+        "databaseName",
+        "commandName",
+        "request",
+        "mongoRequestId",
+        "mongoOperationId",
+        "mongoConnectionId",
+        "response",
+    )
+    SPAN_TYPE = MONGO_SPAN
+
+
+class SqlSpan(SlottedSpan):
+    __slots__ = ("connectionParameters", "query", "values", "response")
+    SPAN_TYPE = SQL_SPAN
+
+
+class HttpInfo(SlottedMapping):
+    """
+    The `info.httpInfo` of an HTTP span. The request and response stay dicts, their fields vary.
+    """
+
+    __slots__ = ("host", "request", "response")
+
+
+class HttpSpanInfo(SlottedMapping):
+    """
+    The `info` of an HTTP span. The fields that only some of the parsers add are kept as extra.
+    """
+
+    __slots__ = ("httpInfo", "messageId", "resourceName")
+    NESTED = {"httpInfo": HttpInfo}
+
+
+class HttpSpan(SlottedSpan):
+    """
+    An HTTP span, built from the dict of the parsers (see `http_parser`).
+    `span["info"]["httpInfo"]` is a mapping view over the slots, that is read and updated like the dict.
+    """
+
+    __slots__ = ("info",)
+    SPAN_TYPE = HTTP_TYPE
+    NESTED = {"info": HttpSpanInfo}
+
+
+class FunctionSpan(SlottedSpan):
+    """
+    The span of the invocation, which is reported at the end (and its copy as the start span).
+    """
+
+    __slots__ = (
+        "name",
+        "runtime",
+        "event",
+        "envs",
+        "memoryAllocated",
+        "readiness",
+        "info",
+        "isMalformedTransactionId",
+        MANUAL_TRACES_KEY,
+        "lambda_container_id",
+        "transactionId",
+        "account",
+        "region",
+        "parentId",
+        "token",
+        "return_value",
+        "reporter_rtt",
+    )
+    SPAN_TYPE = FUNCTION_TYPE
@@ -0,0 +1,154 @@
+"""
+Bounds the memory of the spans in a long invocation (e.g. a batch job with tens of thousands of calls).
+
+When the spans in memory reach LUMIGO_SPANS_MEMORY_LIMIT bytes, they are spilled to a log file
+on the disk, and only a small index entry is kept for every one of them. The spans that were not
+serialized yet are counted by an estimated size, and serialized only when they are spilled.
+When the spans are reported, they are streamed back one by one into the zipped bulks, by the priority
+in their index entry. If the reporter sends a single request, they are read back up to its size.
+"""
+import os
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from lumigo_tracer.lambda_tracer.lambda_reporter import SerializedSpan
+from lumigo_tracer.lumigo_utils import get_logger
+
+SPILLED_SPANS_DIR = "/tmp/lumigo-spilled-spans"
+# The size that we assume for a span that was not serialized, until we know the average size
+ESTIMATED_SPAN_SIZE = 1024
+
+
+def get_spans_memory_limit() -> int:
+    return int(os.environ.get("LUMIGO_SPANS_MEMORY_LIMIT", 32 * 1024 * 1024))
+
+
+def remove_spilled_spans_files(directory: Optional[str] = None) -> None:
+    """
+    Remove the spilled spans of previous invocations that didn't close them (e.g. timed out or crashed).
+    """
+    directory = directory or SPILLED_SPANS_DIR
+    try:
+        file_names = os.listdir(directory)
+    except OSError:
+        return
+    for file_name in file_names:
+        try:
+            os.remove(os.path.join(directory, file_name))
+        except OSError as e:
+            get_logger().debug(f"Could not remove the spilled spans file {file_name}: {e}")
+
+
+class SpilledSpanEntry(NamedTuple):
+    offset: int
+    size: int
+    priority: int
+    span_type: str
+    has_error: bool
+
+
+class SpilledSpans:
+    """
+    An append-only log of the spilled spans (their json dumps), and an index to read them back.
+    A span that is read back is removed from the index, its bytes are left in the log.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or SPILLED_SPANS_DIR
+        self.path: Optional[str] = None
+        self.index: Dict[str, SpilledSpanEntry] = {}
+        self._file: Optional[BinaryIO] = None
+        self._offset = 0
+
+    def __contains__(self, span_id: str) -> bool:
+        return span_id in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def spill(self, spans: Iterable[Tuple[str, SerializedSpan]]) -> None:
+        if self._file is None:
+            Path(self.directory).mkdir(parents=True, exist_ok=True)
+            self.path = os.path.join(self.directory, f"{uuid.uuid4()}.log")
+            self._file = open(self.path, "w+b")
+        for span_id, span in spans:
+            self._file.write(span.dumped.encode())
+            self.index[span_id] = SpilledSpanEntry(
+                offset=self._offset,
+                size=span.size,
+                priority=span.priority,
+                span_type=str(span.span.get("type")),
+                has_error=span.has_error,
+            )
+            self._offset += span.size
+
+    def get(self, span_id: str) -> Optional[SerializedSpan]:
+        entry = self.index.get(span_id)
+        if entry is None:
+            return None
+        return self._read(entry)
+
+    def pop(self, span_id: str) -> Optional[SerializedSpan]:
+        entry = self.index.pop(span_id, None)
+        if entry is None:
+            return None
+        return self._read(entry)
+
+    def discard(self, span_id: str) -> None:
+        self.index.pop(span_id, None)
+
+    def stream(self, span_ids: Iterable[str]) -> Iterator[SerializedSpan]:
+        """
+        Read back the given spilled spans one by one, the most important first.
+        The spans must be consumed before the log is closed.
+        """
+        for span_id in self._sorted_by_priority(span_ids):
+            entry = self.index.get(span_id)
+            if entry is not None:
+                yield self._read(entry)
+
+    def read_back(
+        self, span_ids: Iterable[str], max_size: int
+    ) -> Tuple[Dict[str, SerializedSpan], Dict[str, int]]:
+        """
+        Read back the given spilled spans, the most important first, up to max_size bytes.
+        The spans are selected by their index entries, only the selected ones are read.
+
+        :return: The spans that were read back (by their id), and the number of the rest by type.
+        """
+        spans: Dict[str, SerializedSpan] = {}
+        dropped_types: Dict[str, int] = Counter()
+        current_size = 0
+        for span_id in self._sorted_by_priority(span_ids):
+            entry = self.index[span_id]
+            if current_size + entry.size > max_size:
+                dropped_types[entry.span_type] += 1
+                continue
+            spans[span_id] = self._read(entry)
+            current_size += entry.size
+        return spans, dict(dropped_types)
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        try:
+            os.remove(self.path)  # type: ignore[arg-type]
+        except OSError as e:
+            get_logger().debug(f"Could not remove the spilled spans file {self.path}: {e}")
+        self._file, self.path, self._offset = None, None, 0
+        self.index.clear()
+
+    def _sorted_by_priority(self, span_ids: Iterable[str]) -> List[str]:
+        return sorted(
+            (span_id for span_id in span_ids if span_id in self.index),
+            key=lambda span_id: self.index[span_id].priority,
+        )
+
+    def _read(self, entry: SpilledSpanEntry) -> SerializedSpan:
+        self._file.seek(entry.offset)  # type: ignore[union-attr]
+        dumped = self._file.read(entry.size).decode()  # type: ignore[union-attr]
+        self._file.seek(0, os.SEEK_END)  # type: ignore[union-attr]
+        return SerializedSpan.from_dump(dumped, has_error=entry.has_error)
@@ -1,11 +1,25 @@
-import copy
 import inspect
+import itertools
 import os
 import signal
 import time
 import uuid
+from collections import Counter
 from datetime import datetime
-from typing import Callable, Dict, List, Optional, Set, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    MutableMapping,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from lumigo_core.configuration import CoreConfiguration
 from lumigo_core.parsing_utils import (
@@ -17,8 +31,25 @@ from lumigo_core.scrubbing import EXECUTION_TAGS_KEY, MANUAL_TRACES_KEY, TRUNCAT
 from lumigo_core.triggers.event_trigger import parse_triggers
 
 from lumigo_tracer.event.event_dumper import EventDumper
-from lumigo_tracer.lambda_tracer import lambda_reporter
-from lumigo_tracer.lambda_tracer.lambda_reporter import ENRICHMENT_TYPE, FUNCTION_TYPE
+from lumigo_tracer.lambda_tracer import edge_health, lambda_reporter, report_stats
+from lumigo_tracer.lambda_tracer.invocation_template import (
+    get_invocation_template,
+    get_tracer_version,
+)
+from lumigo_tracer.lambda_tracer.lambda_reporter import (
+    DROPPED_SPANS_REASONS_KEY,
+    ENRICHMENT_TYPE,
+    FUNCTION_TYPE,
+    DroppedSpansReasons,
+)
+from lumigo_tracer.lambda_tracer.slotted_spans import FunctionSpan, SlottedMapping
+from lumigo_tracer.lambda_tracer.span_store import (
+    ESTIMATED_SPAN_SIZE,
+    SpilledSpans,
+    get_spans_memory_limit,
+    remove_spilled_spans_files,
+)
+from lumigo_tracer.lambda_tracer.timeout_payload import TimeoutPayload
 from lumigo_tracer.lumigo_utils import (
     LUMIGO_EVENT_KEY,
     STEP_FUNCTION_UID_KEY,
@@ -27,23 +58,22 @@ from lumigo_tracer.lumigo_utils import (
     format_frames,
     get_current_ms_time,
     get_logger,
-    get_region,
     get_stacktrace,
     get_timeout_buffer,
     is_provision_concurrency_initialization,
     is_python_37,
     is_span_has_error,
     lumigo_dumps,
-    lumigo_dumps_with_context,
     lumigo_safe_execute,
     should_use_tracer_extension,
 )
 from lumigo_tracer.w3c_context import add_w3c_trace_propagator
 
-_VERSION_PATH = os.path.join(os.path.dirname(__file__), "../VERSION")
 MAX_LAMBDA_TIME = 15 * 60 * 1000
 MALFORMED_TXID = "000000000000000000000000"
 TOTAL_SPANS_KEY = "totalSpans"
+# A span dict, or a mapping that is used like one (see `slotted_spans`)
+SpanT = TypeVar("SpanT", bound=MutableMapping[str, Any])
 
 
 class SpansContainer:
@@ -71,8 +101,7 @@ class SpansContainer:
         event: str = None,
         envs: str = None,
     ):
-        version = open(_VERSION_PATH, "r").read() if os.path.exists(_VERSION_PATH) else "unknown"
-        version = version.strip()
+        version = get_tracer_version()
         self.name = name
         self.region = region
         self.trace_root = trace_root
@@ -94,25 +123,27 @@ class SpansContainer:
             "token": Configuration.token,
         }
         is_cold = SpansContainer.is_cold and not is_provision_concurrency_initialization()
-        self.function_span = recursive_json_join(
-            {
-                "id": request_id,
-                "type": FUNCTION_TYPE,
-                "name": name,
-                "runtime": runtime,
-                "event": event,
-                "envs": envs,
-                "memoryAllocated": memory_allocated,
-                "readiness": "cold" if is_cold else "warm",
-                "info": {
-                    "logStreamName": log_stream_name,
-                    "logGroupName": log_group_name,
-                    **({"trigger": trigger_by} if trigger_by else {}),
+        self.function_span = FunctionSpan(
+            **recursive_json_join(
+                {
+                    "id": request_id,
+                    "type": FUNCTION_TYPE,
+                    "name": name,
+                    "runtime": runtime,
+                    "event": event,
+                    "envs": envs,
+                    "memoryAllocated": memory_allocated,
+                    "readiness": "cold" if is_cold else "warm",
+                    "info": {
+                        "logStreamName": log_stream_name,
+                        "logGroupName": log_group_name,
+                        **({"trigger": trigger_by} if trigger_by else {}),
+                    },
+                    "isMalformedTransactionId": malformed_txid,
+                    MANUAL_TRACES_KEY: [],
                 },
-                "isMalformedTransactionId": malformed_txid,
-                MANUAL_TRACES_KEY: [],
-            },
-            self.base_msg,
+                self.base_msg,
+            )
         )
         self.base_enrichment_span = {
             "type": ENRICHMENT_TYPE,
@@ -122,25 +153,62 @@ class SpansContainer:
         }
         self.execution_tags: List[Dict[str, str]] = []
         self.span_ids_to_send: Set[str] = set()
+        # The spans without the base fields of the invocation, which are joined only for reporting
         self.spans: Dict[str, Dict] = {}  # type: ignore[type-arg]
+        # The spans that were serialized when they completed, so `end` doesn't serialize them again
+        self.serialized_spans: Dict[str, lambda_reporter.SerializedSpan] = {}
+        self.serialized_spans_size = 0
+        # The spans that changed since they were serialized (or were never serialized)
+        self.unserialized_span_ids: Set[str] = set()
+        self._serialized_count = 0
+        self._serialized_bytes = 0
+        # The spans are spilled to the disk when they reach the memory limit
+        self.spilled_spans = SpilledSpans()
+        self.spilled_spans_drops: Dict[str, int] = Counter()
+        # A spilled span that a caller got (to update it), it is spilled again before reporting
+        self._loaded_span_id: Optional[str] = None
+        self._loaded_span: Optional[dict] = None  # type: ignore[type-arg]
+        # The dumps of the completed spans, ready to be sent by the timeout handler
+        self.timeout_payload = TimeoutPayload()
+        # The ids of the spans with an error, updated with the spans so we never scan all of them.
+        # The spans that were fetched for an update (e.g. to add an exception) are checked again later.
+        self.error_span_ids: Set[str] = set()
+        self._unindexed_span_ids: Set[str] = set()
         self.manual_trace_start_times: Dict[str, int] = {}
+        self.start_span_reporter: Optional[lambda_reporter.BackgroundReporter] = None
         if is_new_invocation:
             SpansContainer.is_cold = False
 
-    def _generate_start_span(self) -> dict:  # type: ignore[type-arg]
-        to_send = self.function_span.copy()
+    def _generate_start_span(self) -> Dict[str, Any]:
+        to_send = self.function_span.to_dict()
         to_send["id"] = f"{to_send['id']}_started"
         to_send["ended"] = to_send["started"]
         to_send["maxFinishTime"] = self.max_finish_time
-        return to_send  # type: ignore[no-any-return]
+        return to_send
 
     def generate_enrichment_span(self) -> Dict[str, Union[str, int]]:
+        edge_health_stats = edge_health.get_edge_health()
+        last_report_stats = report_stats.get_last_report_stats()
         return recursive_json_join(  # type: ignore[no-any-return]
             {
                 "sending_time": get_current_ms_time(),
                 EXECUTION_TAGS_KEY: self.execution_tags.copy(),
                 TOTAL_SPANS_KEY: len(self.span_ids_to_send)
                 + 2,  # 1 function span + 1 enrichment span
+                **({edge_health.EDGE_HEALTH_KEY: edge_health_stats} if edge_health_stats else {}),
+                **({report_stats.REPORT_STATS_KEY: last_report_stats} if last_report_stats else {}),
+                **(
+                    {
+                        DROPPED_SPANS_REASONS_KEY: {
+                            DroppedSpansReasons.SPANS_STORE_SIZE_LIMIT.value: {
+                                "drops": sum(self.spilled_spans_drops.values()),
+                                "dropsByType": dict(self.spilled_spans_drops),
+                            }
+                        }
+                    }
+                    if self.spilled_spans_drops
+                    else {}
+                ),
             },
             self.base_enrichment_span,
         )
@@ -148,25 +216,102 @@ class SpansContainer:
     def start(self, event=None, context=None):  # type: ignore[no-untyped-def]
         to_send = self._generate_start_span()
         if not Configuration.send_only_if_error:
-            report_duration = lambda_reporter.report_json(
-                region=self.region, msgs=[to_send], is_start_span=True
-            )
-            self.function_span["reporter_rtt"] = report_duration
+            if Configuration.async_start_span:
+                self.start_span_reporter = lambda_reporter.BackgroundReporter(
+                    region=self.region,
+                    msgs=[to_send],
+                    is_start_span=True,
+                    deadline=self.max_finish_time,
+                )
+                self.start_span_reporter.start()
+            else:
+                report_duration = lambda_reporter.report_json(
+                    region=self.region,
+                    msgs=[to_send],
+                    is_start_span=True,
+                    deadline=self.max_finish_time,
+                )
+                self.function_span["reporter_rtt"] = report_duration
         else:
             get_logger().debug("Skip sending start because tracer in 'send only if error' mode .")
         self.start_timeout_timer(context)
 
+    def wait_for_start_span_reporter(self) -> None:
+        """
+        Wait for the start span that is sent in the background (if any), up to the reporting deadline.
+        The send was overlapped with the user's handler, so we report its duration separately
+            from `reporter_rtt`, which only counts the time that we actually blocked.
+        """
+        if not self.start_span_reporter:
+            return
+        wait_start = time.time()
+        timeout = None
+        if self.max_finish_time:
+            timeout = max((self.max_finish_time - get_current_ms_time()) / 1000, 0)
+        overlapped_duration = self.start_span_reporter.wait(timeout)
+        if self.start_span_reporter.is_alive():
+            get_logger().info("The start span is still being sent, not waiting for it anymore")
+        self.function_span["reporter_rtt"] = int((time.time() - wait_start) * 1000)
+        self.function_span["reporter_overlapped_rtt"] = overlapped_duration
+        self.start_span_reporter = None
+
     def handle_timeout(self, *args):  # type: ignore[no-untyped-def]
         with lumigo_safe_execute("spans container: handle_timeout"):
             get_logger().info("The tracer reached the end of the timeout timer")
+            # In the signal handler of the timer, we send the payload that we prepared for it.
+            # We don't wait for the start span here, the little time that is left is for the spans.
+            if TimeoutMechanism.is_activated() and self._report_timeout_payload():
+                return
             spans_id_copy = self.span_ids_to_send.copy()
-            to_send = [self.generate_enrichment_span()] + [
-                self.spans[span_id] for span_id in spans_id_copy
-            ]
+            spans, cached_spans, streamed_spans = self._get_spans_to_send(spans_id_copy)
+            to_send = [self.generate_enrichment_span()] + spans
             self.span_ids_to_send.clear()
+            self.timeout_payload.clear()
             if Configuration.send_only_if_error:
                 to_send.append(self._generate_start_span())
-            lambda_reporter.report_json(region=self.region, msgs=to_send)
+            lambda_reporter.report_json(
+                region=self.region,
+                msgs=to_send,
+                deadline=self.max_finish_time,
+                cached_spans=cached_spans,
+                has_error=self.has_error_spans(),
+                streamed_spans=streamed_spans,
+            )
+
+    def _report_timeout_payload(self) -> bool:
+        """
+        Report the completed spans that were prepared for the timeout, and serialize only the rest.
+
+        :return: Whether the spans were reported, otherwise they should be reported regularly.
+        """
+        last_spans = [lambda_reporter.SerializedSpan(self.generate_enrichment_span())]
+        if Configuration.send_only_if_error:
+            last_spans.append(lambda_reporter.SerializedSpan(self._generate_start_span()))
+        prepared_span_ids = []
+        for span_id in self.span_ids_to_send:
+            if span_id in self.timeout_payload:
+                prepared_span_ids.append(span_id)
+            elif span_id in self.serialized_spans:
+                last_spans.append(self.serialized_spans[span_id])
+            elif span_id in self.spans:
+                last_spans.append(
+                    lambda_reporter.SerializedSpan(self.get_full_span(self.spans[span_id]))
+                )
+            elif span_id in self.spilled_spans:
+                # Reading the spans back from the disk is left to the regular report
+                return False
+        request_body = self.timeout_payload.dump(prepared_span_ids, last_spans)
+        if request_body is None:
+            return False
+        duration = lambda_reporter.report_prepared_request(
+            self.region, request_body, self.max_finish_time
+        )
+        if duration is None:
+            return False
+        get_logger().info(f"Reported {len(last_spans) + len(prepared_span_ids)} spans on timeout")
+        self.span_ids_to_send.clear()
+        self.timeout_payload.clear()
+        return True
 
     def start_timeout_timer(self, context=None) -> None:  # type: ignore[no-untyped-def]
         if Configuration.timeout_timer:
@@ -180,33 +325,213 @@ class SpansContainer:
                 return
             TimeoutMechanism.start(remaining_time - buffer, self.handle_timeout)
 
-    def add_span(self, span: dict) -> dict:  # type: ignore[type-arg]
+    def add_span(self, span: SpanT) -> SpanT:
         """
         This function parses an request event and add it to the span.
+        The span is stored as is, without the base fields (see `get_full_span`).
         """
-        new_span = recursive_json_join(span, self.base_msg)
-        span_id = new_span["id"]
-        self.spans[span_id] = new_span
+        span_id = span["id"]
+        self._discard_spilled_span(span_id)
+        self.spans[span_id] = span  # type: ignore[assignment]
+        self._mark_dirty(span_id)
+        # The caller may still change the span (e.g. add an exception to it), so it is indexed later
+        self._unindexed_span_ids.add(span_id)
         self.span_ids_to_send.add(span_id)
-        return new_span  # type: ignore[no-any-return]
+        # For the same reason, the span is not spilled
+        self._check_spans_memory_limit(keep_span_id=span_id)
+        return span
+
+    def get_full_span(
+        self, span: Union[Dict[str, Any], SlottedMapping]
+    ) -> dict:  # type: ignore[type-arg]
+        """
+        :return: The span joined with the base fields of the invocation, as it is reported.
+        """
+        if isinstance(span, SlottedMapping):
+            span = span.to_dict()
+        return recursive_json_join(span, self.base_msg)  # type: ignore[no-any-return]
+
+    def _get_spans_to_send(self, span_ids: Iterable[str]) -> Tuple[
+        List[Dict[str, Any]],
+        Dict[str, lambda_reporter.SerializedSpan],
+        Optional[Iterator[lambda_reporter.SerializedSpan]],
+    ]:
+        """
+        :return: The spans to report, the serializations that we already have of them,
+            and the spilled spans to stream into the zipped bulks (if the reporter can stream them).
+            Otherwise, the spilled spans are read back, up to the size of a request.
+        """
+        span_ids = list(span_ids)
+        cached_spans: Dict[str, lambda_reporter.SerializedSpan] = {}
+        streamed_spans = None
+        self._spill_loaded_span()
+        if self.spilled_spans and lambda_reporter.can_stream_spans(self.region):
+            streamed_spans = self.spilled_spans.stream(span_ids)
+        elif self.spilled_spans:
+            max_size = (
+                lambda_reporter.MAX_SIZE_FOR_REQUEST_ON_ERROR
+                if self.has_error_spans()
+                else lambda_reporter.MAX_SIZE_FOR_REQUEST
+            )
+            cached_spans, drops = self.spilled_spans.read_back(span_ids, max_size)
+            self.spilled_spans_drops.update(drops)
+        cached_spans.update(self.serialized_spans)
+        spans = []
+        for span_id in span_ids:
+            if span_id in cached_spans:
+                spans.append(cached_spans[span_id].span)
+            elif span_id in self.spans:
+                spans.append(self.get_full_span(self.spans[span_id]))
+        return spans, cached_spans, streamed_spans
+
+    def has_error_spans(self) -> bool:
+        self._spill_loaded_span()
+        for span_id in list(self._unindexed_span_ids):
+            self._index_span_error(span_id)
+        return bool(self.error_span_ids)
+
+    def _index_span_error(self, span_id: str) -> None:
+        self._unindexed_span_ids.discard(span_id)
+        span = self.spans.get(span_id)
+        if span is None:
+            return
+        if is_span_has_error(span):
+            self.error_span_ids.add(span_id)
+        else:
+            self.error_span_ids.discard(span_id)
+
+    def _mark_dirty(self, span_id: str) -> None:
+        self.timeout_payload.discard(span_id)
+        serialized_span = self.serialized_spans.pop(span_id, None)
+        if serialized_span:
+            self.serialized_spans_size -= serialized_span.size
+        if span_id in self.spans:
+            self.unserialized_span_ids.add(span_id)
+
+    def _load_spilled_span(self, span_id: str) -> Optional[dict]:  # type: ignore[type-arg]
+        """
+        A spilled span that is needed again (e.g. for another chunk of a response) is read from the disk.
+        It is spilled again, with the changes of the caller, when another span is loaded or the spans
+        are reported. So there is a single spilled span in memory at a time.
+        """
+        if span_id == self._loaded_span_id:
+            return self._loaded_span
+        serialized_span = self.spilled_spans.get(span_id) if span_id in self.spilled_spans else None
+        if serialized_span is None:
+            return None
+        self._spill_loaded_span()
+        self.timeout_payload.discard(span_id)
+        self._loaded_span_id, self._loaded_span = span_id, serialized_span.span
+        return self._loaded_span
+
+    def _spill_loaded_span(self) -> None:
+        span_id, span = self._loaded_span_id, self._loaded_span
+        self._loaded_span_id, self._loaded_span = None, None
+        if span_id is None or span is None or span_id not in self.spilled_spans:
+            return
+        serialized_span = lambda_reporter.SerializedSpan(span)
+        self.spilled_spans.spill([(span_id, serialized_span)])
+        if serialized_span.has_error:
+            self.error_span_ids.add(span_id)
+        else:
+            self.error_span_ids.discard(span_id)
+
+    def _discard_spilled_span(self, span_id: str) -> None:
+        if span_id == self._loaded_span_id:
+            self._loaded_span_id, self._loaded_span = None, None
+        self.spilled_spans.discard(span_id)
+
+    def _get_spans_memory_size(self) -> int:
+        """
+        :return: The size of the spans in memory. The spans that are not serialized are counted
+            by the average size of a serialized span, so we don't dump them for it.
+        """
+        average_size = (
+            self._serialized_bytes // self._serialized_count
+            if self._serialized_count
+            else ESTIMATED_SPAN_SIZE
+        )
+        return self.serialized_spans_size + len(self.unserialized_span_ids) * average_size
+
+    def _check_spans_memory_limit(self, keep_span_id: Optional[str] = None) -> None:
+        if self._get_spans_memory_size() > get_spans_memory_limit():
+            self._spill_spans(keep_span_id)
+
+    def _spill_spans(self, keep_span_id: Optional[str] = None) -> None:
+        """
+        Spill all the spans in memory, except for keep_span_id. The spans that are not serialized
+        are serialized now, and a spilled span that is changed later is moved back to memory.
+        """
+        for span_id in list(self.unserialized_span_ids):
+            if span_id != keep_span_id:
+                self._serialize(span_id)
+        if not self.serialized_spans:
+            return
+        get_logger().info(f"Spilling {len(self.serialized_spans)} spans to the disk")
+        self.spilled_spans.spill(self.serialized_spans.items())
+        for span_id in self.serialized_spans:
+            self.spans.pop(span_id, None)
+        self.serialized_spans.clear()
+        self.serialized_spans_size = 0
 
     def get_span_by_id(self, span_id: Optional[str]) -> Optional[dict]:  # type: ignore[type-arg]
+        """
+        The span may be changed by the caller, so its serialization is dirty from now on.
+        """
         if not span_id:
             return None
-        return self.spans.get(span_id)
+        if span_id not in self.spans:
+            return self._load_spilled_span(span_id)
+        self._mark_dirty(span_id)
+        self._unindexed_span_ids.add(span_id)
+        return self.spans[span_id]
 
     def pop_span(self, span_id: Optional[str]) -> Optional[dict]:  # type: ignore[type-arg]
         if not span_id:
             return None
+        spilled_span = self._load_spilled_span(span_id)
+        self._discard_spilled_span(span_id)
         self.span_ids_to_send.discard(span_id)
-        return self.spans.pop(span_id, None)
+        self._mark_dirty(span_id)
+        self.error_span_ids.discard(span_id)
+        self._unindexed_span_ids.discard(span_id)
+        self.unserialized_span_ids.discard(span_id)
+        return self.spans.pop(span_id, spilled_span)
+
+    def serialize_span(self, span_id: Optional[str]) -> None:
+        """
+        Serialize a span when it's final, so the work is not done on the return path of the handler.
+        A span that didn't change since it was serialized is not serialized again.
+        """
+        with lumigo_safe_execute("spans container: serialize span"):
+            if not span_id or span_id in self.serialized_spans or span_id not in self.spans:
+                return
+            serialized_span = self._serialize(span_id)
+            if Configuration.timeout_timer:
+                self.timeout_payload.add(span_id, serialized_span)
+            self._check_spans_memory_limit()
+
+    def _serialize(self, span_id: str) -> lambda_reporter.SerializedSpan:
+        self._index_span_error(span_id)
+        serialized_span = lambda_reporter.SerializedSpan(
+            self.get_full_span(self.spans[span_id]), has_error=span_id in self.error_span_ids
+        )
+        self._mark_dirty(span_id)
+        self.serialized_spans[span_id] = serialized_span
+        self.serialized_spans_size += serialized_span.size
+        self.unserialized_span_ids.discard(span_id)
+        self._serialized_count += 1
+        self._serialized_bytes += serialized_span.size
+        return serialized_span
 
     def update_event_end_time(self, span_id: str) -> None:
         """
         This function assumes synchronous execution - we update the last http event.
         """
-        if span_id in self.spans:
-            self.spans[span_id]["ended"] = get_current_ms_time()
+        span = self.spans.get(span_id) or self._load_spilled_span(span_id)
+        if span is not None:
+            span["ended"] = get_current_ms_time()
+            self._mark_dirty(span_id)
             self.span_ids_to_send.add(span_id)
         else:
             get_logger().warning(f"update_event_end_time: Got unknown span id: {span_id}")
@@ -220,11 +545,13 @@ class SpansContainer:
         """
         This function assumes synchronous execution - we update the last http event.
         """
-        if span_id in self.spans:
+        span = self.spans.get(span_id) or self._load_spilled_span(span_id)
+        if span is not None:
+            self._mark_dirty(span_id)
             start_timestamp = start_time.timestamp() if start_time else time.time()
-            self.spans[span_id]["started"] = int(start_timestamp * 1000)
+            span["started"] = int(start_timestamp * 1000)
             if end_time:
-                self.spans[span_id]["ended"] = end_time.timestamp()
+                span["ended"] = end_time.timestamp()
         else:
             get_logger().warning(f"update_event_times: Got unknown span id: {span_id}")
 
@@ -241,7 +568,7 @@ class SpansContainer:
 
     @staticmethod
     def add_exception_to_span(  # type: ignore[no-untyped-def]
-        span: dict, exception: Exception, frames_infos: List[inspect.FrameInfo]  # type: ignore[type-arg]
+        span: MutableMapping[str, Any], exception: Exception, frames_infos: List[inspect.FrameInfo]
     ):
         message = exception.args[0] if exception.args else None
         if not isinstance(message, str):
@@ -254,6 +581,16 @@ class SpansContainer:
             stacktrace=get_stacktrace(exception),
             frames=format_frames(frames_infos) if Configuration.verbose else [],
         )
+        if SpansContainer._span and span.get("id"):
+            SpansContainer._span.update_span_error(span["id"])
+
+    def update_span_error(self, span_id: str) -> None:
+        """
+        Update the error index of a span that was changed in place, after it was added.
+        """
+        if span_id in self.spans:
+            self._mark_dirty(span_id)
+            self._index_span_error(span_id)
 
     def add_exception_event(
         self, exception: Exception, frames_infos: List[inspect.FrameInfo]
@@ -265,7 +602,7 @@ class SpansContainer:
         message_id = str(uuid.uuid4())
         step_function_span = create_step_function_span(message_id)
         span_id = step_function_span["id"]
-        self.spans[span_id] = recursive_json_join(step_function_span, self.base_msg)
+        self.spans[span_id] = step_function_span
         self.span_ids_to_send.add(span_id)
         if isinstance(ret_val, dict):
             ret_val[LUMIGO_EVENT_KEY] = {STEP_FUNCTION_UID_KEY: message_id}
@@ -294,6 +631,9 @@ class SpansContainer:
         reported_rtt = None
         self.previous_request = None
         self.function_span.update({"ended": get_current_ms_time()})
+        # The function ended already, waiting for the start span is not part of its duration
+        with lumigo_safe_execute("spans container: wait for start span"):
+            self.wait_for_start_span_reporter()
         if Configuration.is_step_function:
             self.add_step_end_event(ret_val)
         parsed_ret_val = None
@@ -317,31 +657,41 @@ class SpansContainer:
         self.function_span.update({"return_value": parsed_ret_val})
         if is_span_has_error(self.function_span):
             self._set_error_extra_data(event)
-        spans_contain_errors: bool = any(
-            is_span_has_error(s) for s in self.spans.values()
-        ) or is_span_has_error(self.function_span)
+        spans_contain_errors: bool = self.has_error_spans() or is_span_has_error(self.function_span)
 
         if (not Configuration.send_only_if_error) or spans_contain_errors:
-            to_send = (
-                [self.function_span]
-                + [self.generate_enrichment_span()]
-                + [span for span_id, span in self.spans.items() if span_id in self.span_ids_to_send]
+            spans, cached_spans, streamed_spans = self._get_spans_to_send(
+                span_id
+                for span_id in itertools.chain(self.spans, self.spilled_spans.index)
+                if span_id in self.span_ids_to_send
+            )
+            to_send = [self.function_span.to_dict()] + [self.generate_enrichment_span()] + spans
+            reported_rtt = lambda_reporter.report_json(
+                region=self.region,
+                msgs=to_send,
+                deadline=self.max_finish_time,
+                cached_spans=cached_spans,
+                has_error=spans_contain_errors,
+                streamed_spans=streamed_spans,
             )
-            reported_rtt = lambda_reporter.report_json(region=self.region, msgs=to_send)
         else:
             get_logger().debug(
                 "No Spans were sent, `Configuration.send_only_if_error` is on and no span has error"
             )
             if should_use_tracer_extension():
                 lambda_reporter.write_extension_file([{}], "stop")
+        with lumigo_safe_execute("spans container: close spilled spans"):
+            self.spilled_spans.close()
         return reported_rtt
 
     def _set_error_extra_data(self, event):  # type: ignore[no-untyped-def]
-        self.function_span["envs"] = _get_envs_for_span(has_error=True)
+        self.function_span["envs"] = get_invocation_template().get_envs_dump(has_error=True)
+        dumped_event = self.function_span.get("event")
+        if dumped_event and not dumped_event.endswith(TRUNCATE_SUFFIX):
+            # The event was dumped whole before the handler could change it, so we reuse that dump
+            return
         if event:
-            self.function_span["event"] = EventDumper.dump_event(
-                copy.deepcopy(event), has_error=True
-            )
+            self.function_span["event"] = EventDumper.dump_event(event, has_error=True)
 
     def can_path_root(self):  # type: ignore[no-untyped-def]
         return self.trace_root and self.transaction_id and self.trace_id_suffix
@@ -375,24 +725,28 @@ class SpansContainer:
         """
         if cls._span and not is_new_invocation:
             return cls._span
-        # copy the event to ensure that we will not change it
-        event = copy.deepcopy(event)
+        with lumigo_safe_execute("spans container: remove spilled spans"):
+            if cls._span:
+                cls._span.spilled_spans.close()
+            remove_spilled_spans_files()
+        # The event is read here before the handler runs, and the event dumper doesn't change it
+        template = get_invocation_template()
         additional_info = {}
         if Configuration.verbose:
             additional_info.update(
-                {"event": EventDumper.dump_event(event), "envs": _get_envs_for_span()}
+                {"event": EventDumper.dump_event(event), "envs": template.get_envs_dump()}
             )
 
         trace_root, transaction_id, suffix = parse_trace_id(os.environ.get("_X_AMZN_TRACE_ID", ""))
         remaining_time = getattr(context, "get_remaining_time_in_millis", lambda: MAX_LAMBDA_TIME)()
         cls._span = SpansContainer(
             started=get_current_ms_time(),
-            name=os.environ.get("AWS_LAMBDA_FUNCTION_NAME"),
-            runtime=os.environ.get("AWS_EXECUTION_ENV"),
-            region=get_region(),
-            memory_allocated=os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE"),
-            log_stream_name=os.environ.get("AWS_LAMBDA_LOG_STREAM_NAME"),
-            log_group_name=os.environ.get("AWS_LAMBDA_LOG_GROUP_NAME"),
+            name=template.name,
+            runtime=template.runtime,
+            region=template.region,
+            memory_allocated=template.memory_allocated,
+            log_stream_name=template.log_stream_name,
+            log_group_name=template.log_group_name,
             trace_root=trace_root,
             transaction_id=transaction_id,
             trace_id_suffix=suffix,
@@ -422,9 +776,3 @@ class TimeoutMechanism:
     @staticmethod
     def is_activated():  # type: ignore[no-untyped-def]
         return Configuration.timeout_timer and signal.getsignal(signal.SIGALRM) != signal.SIG_DFL
-
-
-def _get_envs_for_span(has_error: bool = False) -> str:
-    return lumigo_dumps_with_context(
-        "environment", dict(os.environ), CoreConfiguration.get_max_entry_size(has_error)
-    )
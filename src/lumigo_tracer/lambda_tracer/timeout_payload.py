@@ -0,0 +1,66 @@
+"""
+A ready-to-send request of the completed spans, for the timeout handler.
+
+The timeout handler runs in a signal handler, shortly before the Lambda is killed. Instead of
+collecting, serializing and pruning all the spans there, we keep the dumps of the completed spans
+(up to the request size limit) as they complete, and the handler only adds the last spans.
+"""
+from typing import Dict, Iterable, List, Optional
+
+from lumigo_tracer.lambda_tracer.lambda_reporter import (
+    MAX_SIZE_FOR_REQUEST,
+    SerializedSpan,
+    get_base64_size,
+)
+
+
+class TimeoutPayload:
+    """
+    The dumps of the completed spans by their id. A span that doesn't fit is not kept,
+    so the handler should fall back to a regular report when some spans are missing.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size or MAX_SIZE_FOR_REQUEST
+        self.dumps: Dict[str, str] = {}
+        self.size = 0
+
+    def __contains__(self, span_id: str) -> bool:
+        return span_id in self.dumps
+
+    def __len__(self) -> int:
+        return len(self.dumps)
+
+    def add(self, span_id: str, span: SerializedSpan) -> None:
+        self.discard(span_id)
+        if self._get_request_size(self.size + span.size, len(self.dumps) + 1) > self.max_size:
+            return
+        self.dumps[span_id] = span.dumped
+        self.size += span.size
+
+    def discard(self, span_id: str) -> None:
+        dumped = self.dumps.pop(span_id, None)
+        if dumped is not None:
+            self.size -= len(dumped)
+
+    def clear(self) -> None:
+        self.dumps.clear()
+        self.size = 0
+
+    def dump(self, span_ids: Iterable[str], last_spans: List[SerializedSpan]) -> Optional[str]:
+        """
+        Join the last spans and the kept dumps of the given spans into a json list.
+
+        :return: The request, or None if it is too big.
+        """
+        dumps = [span.dumped for span in last_spans]
+        dumps.extend(self.dumps[span_id] for span_id in span_ids)
+        size = sum(len(dumped) for dumped in dumps)
+        if self._get_request_size(size, len(dumps)) > self.max_size:
+            return None
+        return "[" + ", ".join(dumps) + "]"
+
+    @staticmethod
+    def _get_request_size(spans_size: int, count: int) -> int:
+        # The list brackets and the ", " separators
+        return get_base64_size(spans_size + 2 + 2 * max(count - 1, 0))
@@ -1,5 +1,4 @@
 import base64
-import datetime
 import inspect
 import logging
 import os
@@ -7,7 +6,7 @@ import re
 import traceback
 import uuid
 from contextlib import contextmanager
-from typing import Any, Dict, List, Optional, Pattern, TypeVar, Union
+from typing import Any, Dict, List, Mapping, Optional, Pattern, TypeVar, Union
 
 from lumigo_core.configuration import (
     MASKING_REGEX_ENVIRONMENT,
@@ -46,6 +45,7 @@ DOMAIN_SCRUBBER_REGEXES = [
     r"sts\..*amazonaws\.com",
 ]
 LUMIGO_SYNC_TRACING = "LUMIGO_SYNC_TRACING"
+LUMIGO_ASYNC_START_SPAN = "LUMIGO_ASYNC_START_SPAN"
 LUMIGO_PROPAGATE_W3C = "LUMIGO_PROPAGATE_W3C"
 WARN_CLIENT_PREFIX = "Lumigo Warning"
 INTERNAL_ANALYTICS_PREFIX = "Lumigo Analytic Log"
@@ -69,17 +69,13 @@ def get_region() -> str:
 
 
 class InternalState:
-    timeout_on_connection: Optional[datetime.datetime] = None
     internal_error_already_logged = False
+    edge_rejected_content_encoding = False
 
     @staticmethod
     def reset():  # type: ignore[no-untyped-def]
-        InternalState.timeout_on_connection = None
         InternalState.internal_error_already_logged = False
-
-    @staticmethod
-    def mark_timeout_to_edge():  # type: ignore[no-untyped-def]
-        InternalState.timeout_on_connection = datetime.datetime.now()
+        InternalState.edge_rejected_content_encoding = False
 
 
 class Configuration:
@@ -96,6 +92,7 @@ class Configuration:
     edge_kinesis_aws_access_key_id: Optional[str] = None
     edge_kinesis_aws_secret_access_key: Optional[str] = None
     is_sync_tracer: bool = False
+    async_start_span: bool = False
     auto_tag: List[str] = []
     skip_collecting_http_body: bool = False
     propagate_w3c: bool = False
@@ -197,6 +194,9 @@ def config(
         or os.environ.get("LUMIGO_EDGE_KINESIS_AWS_SECRET_ACCESS_KEY")  # noqa
     )
     Configuration.is_sync_tracer = os.environ.get(LUMIGO_SYNC_TRACING, "FALSE").lower() == "true"
+    Configuration.async_start_span = (
+        os.environ.get(LUMIGO_ASYNC_START_SPAN, "FALSE").lower() == "true"
+    )
     Configuration.propagate_w3c = (
         propagate_w3c or os.environ.get(LUMIGO_PROPAGATE_W3C, "true").lower() == "true"
     )
@@ -226,7 +226,7 @@ def config(
     Configuration.secret_masking_regex_environment = parse_regex_from_env(MASKING_REGEX_ENVIRONMENT)
 
 
-def is_span_has_error(span: dict) -> bool:  # type: ignore[type-arg]
+def is_span_has_error(span: Mapping[str, Any]) -> bool:
     return (
         span.get("error") is not None  # noqa
         or span.get("info", {}).get("httpInfo", {}).get("response", {}).get("statusCode", 0)  # noqa
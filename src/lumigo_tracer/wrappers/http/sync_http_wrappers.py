@@ -11,6 +11,7 @@ from lumigo_core.configuration import CoreConfiguration
 from lumigo_core.parsing_utils import recursive_json_join, safe_get_list
 
 from lumigo_tracer.lambda_tracer.lambda_reporter import get_edge_host
+from lumigo_tracer.lambda_tracer.slotted_spans import HttpSpan
 from lumigo_tracer.lambda_tracer.spans_container import SpansContainer
 from lumigo_tracer.libs.wrapt import wrap_function_wrapper
 from lumigo_tracer.lumigo_utils import (
@@ -51,13 +52,13 @@ def add_request_event(span_id: Optional[str], parse_params: HttpRequest) -> Dict
     if is_lumigo_edge(parse_params.host):
         return {}
     parser = get_parser(parse_params.host, parse_params.headers)()
-    msg = parser.parse_request(parse_params)
+    msg = HttpSpan(**parser.parse_request(parse_params))
     if span_id:
         msg["id"] = span_id
     HttpState.previous_request = parse_params
     new_span = SpansContainer.get_span().add_span(msg)
     HttpState.previous_span_id = new_span["id"]
-    return new_span
+    return new_span  # type: ignore[return-value]
 
 
 def add_unparsed_request(span_id: Optional[str], parse_params: HttpRequest) -> Optional[Dict]:  # type: ignore[type-arg]
@@ -118,7 +119,7 @@ def update_event_response(
         if has_error:
             _update_request_data_increased_size_limit(http_info, max_size)
         update = parser.parse_response(host, status_code, headers, body)  # type: ignore[arg-type]
-        SpansContainer.get_span().add_span(recursive_json_join(update, last_event))
+        SpansContainer.get_span().add_span(HttpSpan(**recursive_json_join(update, last_event)))
         return update.get("id", span_id)
     return span_id
 
@@ -320,12 +321,15 @@ def _read_wrapper(func, instance, args, kwargs):  # type: ignore[no-untyped-def]
     This is the wrapper of the function that can be called only after `getresponse` was called.
     """
     ret_val = func(*args, **kwargs)
-    if ret_val:
-        with lumigo_safe_execute("parse response.read"):
-            span_id = HttpState.response_id_to_span_id.get(get_lumigo_connection_id(instance))  # type: ignore[arg-type]
-            update_event_response(
+    with lumigo_safe_execute("parse response.read"):
+        span_id = HttpState.response_id_to_span_id.get(get_lumigo_connection_id(instance))  # type: ignore[arg-type]
+        if ret_val:
+            span_id = update_event_response(
                 span_id, None, instance.code, dict(instance.headers.items()), ret_val  # type: ignore[arg-type]
             )
+        if instance.isclosed():
+            # The response was read to its end, so its span is final
+            SpansContainer.get_span().serialize_span(span_id)
     return ret_val
 
 
@@ -335,15 +339,19 @@ def _read_stream_wrapper(func, instance, args, kwargs):  # type: ignore[no-untyp
 
 
 def _read_stream_wrapper_generator(stream_generator, instance):  # type: ignore[no-untyped-def]
+    span_id = None
     for partial_response in stream_generator:
         with lumigo_safe_execute("parse response.read_chunked"):
             span_id = HttpState.response_id_to_span_id.get(
                 get_lumigo_connection_id(instance._original_response)  # type: ignore[arg-type]
             )
-            update_event_response(
+            span_id = update_event_response(
                 span_id, None, instance.status, dict(instance.headers.items()), partial_response  # type: ignore[arg-type]
             )
         yield partial_response
+    with lumigo_safe_execute("serialize response.read_chunked"):
+        # All the chunks were read, so the span is final
+        SpansContainer.get_span().serialize_span(span_id)
 
 
 def _putheader_wrapper(func, instance, args, kwargs):  # type: ignore[no-untyped-def]
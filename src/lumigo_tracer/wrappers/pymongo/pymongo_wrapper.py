@@ -1,7 +1,7 @@
 import uuid
 from typing import Dict
 
-from lumigo_tracer.lambda_tracer.lambda_reporter import MONGO_SPAN
+from lumigo_tracer.lambda_tracer.slotted_spans import MongoSpan
 from lumigo_tracer.lambda_tracer.spans_container import SpansContainer
 from lumigo_tracer.lumigo_utils import (
     get_current_ms_time,
@@ -25,17 +25,16 @@ if monitoring:
                 span_id = str(uuid.uuid4())
                 LumigoMongoMonitoring.request_to_span_id[event.request_id] = span_id
                 SpansContainer.get_span().add_span(
-                    {
-                        "id": span_id,
-                        "type": MONGO_SPAN,
-                        "started": get_current_ms_time(),
-                        "databaseName": event.database_name,
-                        "commandName": event.command_name,
-                        "request": lumigo_dumps(event.command),
-                        "mongoRequestId": event.request_id,
-                        "mongoOperationId": event.operation_id,
-                        "mongoConnectionId": event.connection_id,
-                    }
+                    MongoSpan(
+                        id=span_id,
+                        started=get_current_ms_time(),
+                        databaseName=event.database_name,
+                        commandName=event.command_name,
+                        request=lumigo_dumps(event.command),
+                        mongoRequestId=event.request_id,
+                        mongoOperationId=event.operation_id,
+                        mongoConnectionId=event.connection_id,
+                    )
                 )
 
         def succeeded(self, event):  # type: ignore[no-untyped-def]
@@ -51,6 +50,7 @@ if monitoring:
                         "response": lumigo_dumps(event.reply),
                     }
                 )
+                SpansContainer.get_span().serialize_span(span_id)
 
         def failed(self, event):  # type: ignore[no-untyped-def]
             with lumigo_safe_execute("pymongo failed"):
@@ -65,6 +65,7 @@ if monitoring:
                         "error": lumigo_dumps(event.failure),
                     }
                 )
+                SpansContainer.get_span().serialize_span(span_id)
 
 
 else:
@@ -3,7 +3,7 @@ import importlib
 import uuid
 from typing import Dict, List, Optional, Union
 
-from lumigo_tracer.lambda_tracer.lambda_reporter import REDIS_SPAN
+from lumigo_tracer.lambda_tracer.slotted_spans import RedisSpan
 from lumigo_tracer.lambda_tracer.spans_container import SpansContainer
 from lumigo_tracer.libs.wrapt import wrap_function_wrapper
 from lumigo_tracer.lumigo_utils import (
@@ -21,14 +21,13 @@ def command_started(
     host = (connection_options or {}).get("host")
     port = (connection_options or {}).get("port")
     SpansContainer.get_span().add_span(
-        {
-            "id": span_id,
-            "type": REDIS_SPAN,
-            "started": get_current_ms_time(),
-            "requestCommand": command,
-            "requestArgs": lumigo_dumps(copy.deepcopy(request_args)),
-            "connectionOptions": {"host": host, "port": port},
-        }
+        RedisSpan(
+            id=span_id,
+            started=get_current_ms_time(),
+            requestCommand=command,
+            requestArgs=lumigo_dumps(copy.deepcopy(request_args)),
+            connectionOptions={"host": host, "port": port},
+        )
     )
     return span_id
 
@@ -42,6 +41,7 @@ def command_finished(span_id: str, ret_val: Dict):  # type: ignore[no-untyped-de
         span.update(
             {"ended": get_current_ms_time(), "response": lumigo_dumps(copy.deepcopy(ret_val))}
         )
+        SpansContainer.get_span().serialize_span(span_id)
 
 
 def command_failed(span_id: str, exception: Exception):  # type: ignore[no-untyped-def]
@@ -53,6 +53,7 @@ def command_failed(span_id: str, exception: Exception):  # type: ignore[no-untyp
         span.update(
             {"ended": get_current_ms_time(), "error": exception.args[0] if exception.args else None}
         )
+        SpansContainer.get_span().serialize_span(span_id)
 
 
 def execute_command_wrapper(func, instance, args, kwargs):  # type: ignore[no-untyped-def]
@@ -2,7 +2,7 @@ import importlib
 import uuid
 from typing import Optional
 
-from lumigo_tracer.lambda_tracer.lambda_reporter import SQL_SPAN
+from lumigo_tracer.lambda_tracer.slotted_spans import SqlSpan
 from lumigo_tracer.lambda_tracer.spans_container import SpansContainer
 from lumigo_tracer.libs.wrapt import wrap_function_wrapper
 from lumigo_tracer.lumigo_utils import (
@@ -26,19 +26,18 @@ def _before_cursor_execute(conn, cursor, statement, parameters, context, execute
     with lumigo_safe_execute("handle sqlalchemy before execute"):
         _last_span_id = str(uuid.uuid4())
         SpansContainer.get_span().add_span(
-            {
-                "id": _last_span_id,
-                "type": SQL_SPAN,
-                "started": get_current_ms_time(),
-                "connectionParameters": {
+            SqlSpan(
+                id=_last_span_id,
+                started=get_current_ms_time(),
+                connectionParameters={
                     "host": conn.engine.url.host or conn.engine.url.database,
                     "port": conn.engine.url.port,
                     "database": conn.engine.url.database,
                     "user": conn.engine.url.username,
                 },
-                "query": lumigo_dumps(statement),
-                "values": lumigo_dumps(parameters),
-            }
+                query=lumigo_dumps(statement),
+                values=lumigo_dumps(parameters),
+            )
         )
 
 
@@ -49,6 +48,7 @@ def _after_cursor_execute(conn, cursor, statement, parameters, context, executem
             get_logger().warning("SQLAlchemy span ended without a record on its start")
             return
         span.update({"ended": get_current_ms_time(), "response": ""})
+        SpansContainer.get_span().serialize_span(_last_span_id)
 
 
 def _handle_error(context):  # type: ignore[no-untyped-def]
@@ -68,6 +68,7 @@ def _handle_error(context):  # type: ignore[no-untyped-def]
                 ),
             }
         )
+        SpansContainer.get_span().serialize_span(_last_span_id)
 
 
 def execute_wrapper(func, instance, args, kwargs):  # type: ignore[no-untyped-def]
@@ -12,7 +12,13 @@ from lumigo_core.logger import get_logger
 from lumigo_core.scrubbing import get_omitting_regex
 
 from lumigo_tracer import lumigo_utils, wrappers
-from lumigo_tracer.lambda_tracer import lambda_reporter
+from lumigo_tracer.lambda_tracer import (
+    edge_health,
+    edge_network,
+    lambda_reporter,
+    local_collector,
+    report_stats,
+)
 from lumigo_tracer.lambda_tracer.lambda_reporter import get_edge_host
 from lumigo_tracer.lambda_tracer.spans_container import SpansContainer
 from lumigo_tracer.lumigo_utils import Configuration, InternalState
@@ -47,6 +53,9 @@ def remove_caches(monkeypatch):
     get_omitting_regex.cache_clear()
     get_edge_host.cache_clear()
     monkeypatch.setattr(lambda_reporter, "edge_kinesis_boto_client", None)
+    lambda_reporter.edge_connection_pool.clear()
+    local_collector.close_collector_socket()
+    edge_network.clear()
 
 
 @pytest.yield_fixture(autouse=True)
@@ -58,6 +67,13 @@ def restart_global_span():
     SpansContainer._span = None
     HttpState.clear()
     InternalState.reset()
+    if lambda_reporter.edge_executor:
+        # Bulks that are still being sent in the background must not affect the next test,
+        # and the next test may use another EDGE_CONNECTION_POOL_SIZE
+        lambda_reporter.edge_executor.shutdown(wait=True)
+        lambda_reporter.edge_executor = None
+    edge_health.reset()
+    report_stats.reset()
 
 
 @pytest.yield_fixture(autouse=True)
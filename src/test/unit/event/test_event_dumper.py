@@ -277,6 +277,28 @@ def test_parse_event_api_gw_v2():
     )
 
 
+def test_parse_event_api_gw_does_not_change_the_event():
+    event = {
+        "resource": "/add-user",
+        "httpMethod": "POST",
+        "headers": {"Accept": "application/json", "Host": "aaaa.execute-api.com"},
+        "requestContext": {
+            "requestId": "1",
+            "domainName": "aaaa.execute-api.com",
+            "authorizer": {"claims": {}},
+        },
+        "multiValueHeaders": {"Accept": ["application/json"]},
+        "body": "{}",
+    }
+    original_event = json.loads(json.dumps(event))
+
+    dumped = json.loads(EventDumper.dump_event(event=event))
+
+    assert event == original_event
+    assert dumped["headers"] == {"Host": "aaaa.execute-api.com"}
+    assert dumped["requestContext"] == {"requestId": "1", "authorizer": {"claims": {}}}
+
+
 def test_parse_event_sns():
     not_order_sns_event = {
         "Records": [
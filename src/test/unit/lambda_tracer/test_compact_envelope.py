@@ -0,0 +1,112 @@
+import copy
+import json
+from unittest.mock import Mock
+
+from lumigo_tracer.lambda_tracer import compact_envelope
+from lumigo_tracer.lambda_tracer.compact_envelope import (
+    dump_compact_envelope,
+    dump_span_fields,
+    join_span_fields,
+)
+from lumigo_tracer.lambda_tracer.lambda_reporter import (
+    SerializedSpan,
+    _create_request_body,
+    _dump_serialized_spans,
+)
+from lumigo_tracer.lambda_tracer.spans_container import SpansContainer
+from lumigo_tracer.lumigo_utils import aws_dump
+
+
+def expand_request_body(body: str) -> list:
+    """
+    The decoding of the edge: a plain list of spans, or the compact envelope.
+    """
+    data = json.loads(body)
+    if isinstance(data, list):
+        return data
+    assert data["envelopeVersion"] == 1
+    return [_join(span, data["shared"]) for span in data["spans"]]
+
+
+def _join(delta: dict, shared: dict) -> dict:
+    joined = copy.deepcopy(shared)
+    for key, value in delta.items():
+        if isinstance(value, dict) and isinstance(joined.get(key), dict):
+            joined[key] = _join(value, joined[key])
+        else:
+            joined[key] = value
+    return joined
+
+
+def _create_invocation_spans(context, count: int) -> list:
+    SpansContainer.create_span(context=context)
+    container = SpansContainer.get_span()
+    for i in range(count):
+        container.add_span(
+            {
+                "id": f"span{i}",
+                "type": "http",
+                "started": i,
+                "info": {"httpInfo": {"host": f"host{i % 3}", "request": {"body": "b" * i}}},
+            }
+        )
+    return [container.function_span.to_dict(), container.generate_enrichment_span()] + [
+        container.get_full_span(span) for span in container.spans.values()
+    ]
+
+
+def test_dump_span_fields_is_identical_to_aws_dump():
+    span = {"id": "1", "info": {"traceId": "x", "body": 'caf\u00e9 "quoted"'}, "duration": 1.5}
+
+    assert join_span_fields(dump_span_fields(span).values()) == aws_dump(span)
+
+
+def test_dump_compact_envelope_shares_the_same_fields():
+    spans = [
+        {"id": "1", "token": "t", "info": {"traceId": "x"}},
+        {"id": "2", "token": "t", "info": {"traceId": "x"}},
+    ]
+
+    envelope = json.loads(dump_compact_envelope([dump_span_fields(span) for span in spans]))
+
+    assert envelope == {
+        "envelopeVersion": 1,
+        "shared": {"token": "t", "info": {"traceId": "x"}},
+        "spans": [{"id": "1"}, {"id": "2"}],
+    }
+
+
+def test_dump_compact_envelope_expands_to_the_spans(context):
+    spans = _create_invocation_spans(context, 20)
+
+    envelope = dump_compact_envelope([dump_span_fields(span) for span in spans])
+
+    assert expand_request_body(envelope) == spans
+
+
+def test_create_request_body_compact_envelope(monkeypatch, context):
+    spans = _create_invocation_spans(context, 200)
+    plain_body = _create_request_body(None, spans, True, False)
+
+    monkeypatch.setenv("LUMIGO_COMPACT_ENVELOPE", "true")
+    compact_body = _create_request_body(None, spans, True, False)
+
+    assert expand_request_body(compact_body) == json.loads(plain_body)
+    assert len(compact_body) < len(plain_body)
+
+
+def test_create_request_body_compact_envelope_single_span(monkeypatch):
+    monkeypatch.setenv("LUMIGO_COMPACT_ENVELOPE", "true")
+    span = {"id": "1", "type": "http"}
+
+    assert json.loads(_create_request_body(None, [span], True, False)) == [span]
+
+
+def test_dump_serialized_spans_compact_doesnt_dump_again(monkeypatch):
+    monkeypatch.setenv("LUMIGO_COMPACT_ENVELOPE", "true")
+    spans = [SerializedSpan({"id": str(i), "token": "t" * 100}) for i in range(3)]
+    monkeypatch.setattr(compact_envelope, "aws_dump", Mock(side_effect=AssertionError))
+
+    body = _dump_serialized_spans(spans, compact=True)
+
+    assert json.loads(body)["shared"] == {"token": "t" * 100}
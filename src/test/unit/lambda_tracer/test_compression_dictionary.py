@@ -0,0 +1,64 @@
+import zlib
+
+import pytest
+
+from lumigo_tracer.lambda_tracer.compression_dictionary import COMPRESSION_DICTIONARY
+from lumigo_tracer.lambda_tracer.spans_container import SpansContainer
+from lumigo_tracer.lumigo_utils import aws_dump
+from lumigo_tracer.wrappers.http.http_data_classes import HttpRequest
+from lumigo_tracer.wrappers.http.sync_http_wrappers import (
+    add_request_event,
+    update_event_response,
+)
+
+
+@pytest.fixture
+def small_report(context, aws_env):
+    """
+    The spans of a typical invocation: a function span, an enrichment span and some http spans.
+    """
+    event = {
+        "httpMethod": "POST",
+        "path": "/items",
+        "headers": {"content-type": "application/json"},
+        "requestContext": {"requestId": "abc", "stage": "prod"},
+    }
+    span = SpansContainer.create_span(event, context)
+    for service in ["dynamodb", "sqs", "sns"]:
+        host = f"{service}.us-east-1.amazonaws.com"
+        http_span = add_request_event(
+            None,
+            HttpRequest(
+                host=host,
+                method="POST",
+                uri=f"{host}/",
+                headers={"content-type": "application/x-amz-json-1.0"},
+                body=b'{"TableName": "table", "Item": {"id": {"S": "1"}}}',
+            ),
+        )
+        update_event_response(http_span["id"], host, 200, {"x-amzn-requestid": service}, body=b"{}")
+    http_spans = [span.get_full_span(http_span) for http_span in span.spans.values()]
+    spans = [span.function_span.to_dict(), *http_spans, span.generate_enrichment_span()]
+    return aws_dump(spans).encode()
+
+
+def _compress(data, zdict=None):
+    compressor = zlib.compressobj(
+        9, zlib.DEFLATED, zlib.MAX_WBITS, **({"zdict": zdict} if zdict else {})
+    )
+    return compressor.compress(data) + compressor.flush()
+
+
+def test_compression_dictionary_reduces_report_size(small_report):
+    plain_size = len(_compress(small_report))
+    dictionary_size = len(_compress(small_report, COMPRESSION_DICTIONARY))
+
+    assert dictionary_size / plain_size < 0.9
+
+
+def test_compression_dictionary_start_span(context, aws_env):
+    start_span = aws_dump([SpansContainer.create_span({}, context)._generate_start_span()])
+
+    assert len(_compress(start_span.encode(), COMPRESSION_DICTIONARY)) < len(
+        _compress(start_span.encode())
+    )
@@ -0,0 +1,171 @@
+import time
+
+import pytest
+
+from lumigo_tracer.lambda_tracer import edge_health
+from lumigo_tracer.lambda_tracer.edge_health import (
+    EDGE_THROUGHPUT,
+    EDGE_TIMEOUT,
+    MAX_EDGE_TIMEOUT,
+    MIN_EDGE_TIMEOUT,
+    CircuitBreaker,
+    CircuitState,
+    RttStats,
+    get_edge_health,
+    get_edge_timeout,
+    record_edge_success,
+    record_edge_timeout,
+)
+
+
+def test_rtt_stats():
+    stats = RttStats(window_size=10, alpha=0.5)
+    assert stats.percentile(50) is None
+
+    for rtt in [0.1, 0.2, 0.3, 0.4]:
+        stats.record(rtt)
+
+    assert stats.ewma == pytest.approx(0.3125)
+    assert stats.percentile(50) == 0.2
+    assert stats.percentile(95) == 0.4
+    assert stats.to_dict() == {"rttSamples": 4, "rttEwmaMs": 312, "rttP50Ms": 200, "rttP95Ms": 400}
+
+
+def test_rtt_stats_keeps_only_recent_samples():
+    stats = RttStats(window_size=3)
+
+    for rtt in [10, 10, 0.1, 0.1, 0.1]:
+        stats.record(rtt)
+
+    assert stats.samples_count == 3
+    assert stats.percentile(100) == 0.1
+
+
+def test_circuit_breaker_opens_on_failure_and_probes_after_cooldown(monkeypatch):
+    now = 1000
+    monkeypatch.setattr(time, "time", lambda: now)
+    breaker = CircuitBreaker(cooldown=10, max_cooldown=15, probe_timeout=1)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow_request()
+
+    now += 10
+    assert breaker.state == CircuitState.HALF_OPEN
+    # Checking the state doesn't take the probe
+    assert breaker.allow_request()
+    assert breaker.allow_request()
+    assert breaker.start_request()
+    # Only a single probe at a time
+    assert not breaker.allow_request()
+    assert not breaker.start_request()
+
+    # The probe failed, so the cooldown is doubled, up to its maximum
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert breaker.cooldown == 15
+    assert breaker.consecutive_failures == 2
+
+    now += 15
+    assert breaker.start_request()
+    breaker.record_success()
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.cooldown == 10
+    assert breaker.to_dict() == {
+        "circuitState": "closed",
+        "consecutiveTimeouts": 0,
+        "cooldownSeconds": 10,
+    }
+
+
+def test_circuit_breaker_allows_new_probe_if_the_previous_never_finished(monkeypatch):
+    now = 1000
+    monkeypatch.setattr(time, "time", lambda: now)
+    breaker = CircuitBreaker(cooldown=10, probe_timeout=1)
+    breaker.record_failure()
+    now += 10
+
+    assert breaker.start_request()
+    now += 1
+    assert breaker.start_request()
+
+
+def test_get_edge_timeout_adapts_to_rtt(monkeypatch):
+    monkeypatch.delenv("LUMIGO_EDGE_TIMEOUT", raising=False)
+    assert get_edge_timeout() == EDGE_TIMEOUT
+
+    for _ in range(10):
+        record_edge_success(0.15)
+    assert get_edge_timeout() == pytest.approx(0.3)
+
+    # Fast regions don't go below the minimal timeout
+    edge_health.reset()
+    for _ in range(10):
+        record_edge_success(0.01)
+    assert get_edge_timeout() == MIN_EDGE_TIMEOUT
+
+    # Slow regions go above the default timeout, up to the maximal timeout
+    edge_health.reset()
+    for _ in range(10):
+        record_edge_success(0.4)
+    assert EDGE_TIMEOUT < get_edge_timeout() < MAX_EDGE_TIMEOUT
+    for _ in range(10):
+        record_edge_success(10)
+    assert get_edge_timeout() == MAX_EDGE_TIMEOUT
+
+
+def test_get_edge_timeout_grows_after_timeouts(monkeypatch):
+    monkeypatch.delenv("LUMIGO_EDGE_TIMEOUT", raising=False)
+    for _ in range(10):
+        record_edge_success(0.15)
+    timeout = get_edge_timeout()
+
+    # The round-trip time was at least the timeout
+    record_edge_timeout(timeout)
+    assert get_edge_timeout() == pytest.approx(timeout * 2)
+
+    for _ in range(10):
+        record_edge_timeout(get_edge_timeout())
+    assert get_edge_timeout() == MAX_EDGE_TIMEOUT
+
+
+def test_get_edge_timeout_by_request_size(monkeypatch):
+    monkeypatch.delenv("LUMIGO_EDGE_TIMEOUT", raising=False)
+    request_size = int(EDGE_THROUGHPUT / 10)
+    # The upload time of the requests is not part of their latency
+    for _ in range(5):
+        record_edge_success(0.15)
+        record_edge_success(0.15 + 0.1, request_size)
+    assert edge_health.edge_rtt_stats.percentile(95) == pytest.approx(0.15)
+
+    assert get_edge_timeout() == pytest.approx(0.3)
+    assert get_edge_timeout(request_size) == pytest.approx(0.4)
+
+
+def test_get_edge_timeout_configured(monkeypatch):
+    monkeypatch.setenv("LUMIGO_EDGE_TIMEOUT", "1")
+    for _ in range(10):
+        record_edge_success(0.01)
+
+    assert get_edge_timeout() == EDGE_TIMEOUT
+
+
+def test_get_edge_health(monkeypatch):
+    monkeypatch.delenv("LUMIGO_EDGE_TIMEOUT", raising=False)
+    assert get_edge_health() is None
+
+    record_edge_success(0.1)
+    record_edge_timeout()
+
+    assert get_edge_health() == {
+        "circuitState": "open",
+        "consecutiveTimeouts": 1,
+        "cooldownSeconds": 10,
+        "rttSamples": 1,
+        "rttEwmaMs": 100,
+        "rttP50Ms": 100,
+        "rttP95Ms": 100,
+        "timeoutMs": int(EDGE_TIMEOUT * 1000),
+    }
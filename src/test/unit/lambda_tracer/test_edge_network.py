@@ -0,0 +1,145 @@
+import datetime
+import socket
+import ssl
+import threading
+
+import pytest
+
+from lumigo_tracer.lambda_tracer import edge_network
+from lumigo_tracer.lambda_tracer.edge_network import (
+    EdgeSSLContext,
+    create_edge_socket,
+    is_connection_alive,
+    resolve_edge_address,
+)
+
+
+@pytest.fixture
+def getaddrinfo_calls(monkeypatch):
+    calls = []
+    original_getaddrinfo = socket.getaddrinfo
+
+    def _getaddrinfo(host, port, *args, **kwargs):
+        calls.append(host)
+        return original_getaddrinfo("127.0.0.1", port, *args, **kwargs)
+
+    monkeypatch.setattr(socket, "getaddrinfo", _getaddrinfo)
+    return calls
+
+
+@pytest.fixture
+def tcp_server():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    yield server
+    server.close()
+
+
+def test_resolve_edge_address_is_cached(getaddrinfo_calls, monkeypatch):
+    assert resolve_edge_address("edge.lumigo.io", 443) == ("127.0.0.1", 443)
+    assert resolve_edge_address("edge.lumigo.io", 443) == ("127.0.0.1", 443)
+    assert getaddrinfo_calls == ["edge.lumigo.io"]
+
+    monkeypatch.setattr(edge_network, "DNS_CACHE_TTL_SECONDS", 0)
+    resolve_edge_address("edge.lumigo.io", 443)
+    assert getaddrinfo_calls == ["edge.lumigo.io"] * 2
+
+
+def test_create_edge_socket_uses_the_cached_address(getaddrinfo_calls, tcp_server):
+    port = tcp_server.getsockname()[1]
+
+    create_edge_socket(("edge.lumigo.io", port)).close()
+    create_edge_socket(("edge.lumigo.io", port)).close()
+
+    assert getaddrinfo_calls.count("edge.lumigo.io") == 1
+
+
+def test_create_edge_socket_resolves_again_if_the_cached_address_fails(tcp_server):
+    port = tcp_server.getsockname()[1]
+    unused_port_socket = socket.socket()
+    unused_port_socket.bind(("127.0.0.1", 0))
+    unused_port = unused_port_socket.getsockname()[1]
+    unused_port_socket.close()
+    edge_network._resolved_addresses[("127.0.0.1", port)] = (
+        ("127.0.0.1", unused_port),
+        float("inf"),
+    )
+
+    create_edge_socket(("127.0.0.1", port)).close()
+
+    assert ("127.0.0.1", port) not in edge_network._resolved_addresses
+
+
+def test_is_connection_alive():
+    client, server = socket.socketpair()
+    assert is_connection_alive(None) is True
+    assert is_connection_alive(client) is True
+
+    server.close()
+
+    assert is_connection_alive(client) is False
+    client.close()
+
+
+def _create_certificate(directory):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.utcnow()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = directory / "cert.pem", directory / "key.pem"
+    cert_path.write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    return str(cert_path), str(key_path)
+
+
+def test_edge_ssl_context_resumes_the_tls_session(tmp_path, tcp_server):
+    cert_path, key_path = _create_certificate(tmp_path)
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(cert_path, key_path)
+
+    def _serve():
+        for _ in range(2):
+            connection, _ = tcp_server.accept()
+            with server_context.wrap_socket(connection, server_side=True) as tls_connection:
+                tls_connection.recv(1)
+                tls_connection.sendall(b"ok")
+
+    server_thread = threading.Thread(target=_serve, daemon=True)
+    server_thread.start()
+    context = EdgeSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_verify_locations(cert_path)
+
+    session_reused = []
+    for _ in range(2):
+        sock = socket.create_connection(tcp_server.getsockname(), timeout=5)
+        with context.wrap_socket(sock, server_hostname="localhost") as tls_sock:
+            tls_sock.sendall(b"?")
+            assert tls_sock.recv(2) == b"ok"
+            context.remember_session(tls_sock)
+            session_reused.append(tls_sock.session_reused)
+    server_thread.join(5)
+
+    assert session_reused == [False, True]
@@ -0,0 +1,62 @@
+import os
+import time
+
+import pytest
+
+from lumigo_tracer.lambda_tracer import edge_spool
+from lumigo_tracer.lambda_tracer.edge_spool import (
+    has_spooled_requests,
+    spool_requests,
+    take_spooled_requests,
+)
+
+
+@pytest.fixture(autouse=True)
+def spool_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(edge_spool, "SPOOL_DIR", str(tmp_path / "spool"))
+    return tmp_path / "spool"
+
+
+def test_spool_and_take_requests():
+    assert not has_spooled_requests()
+
+    spool_requests(["[{}]", b"\x1f\x8bcompressed"])
+    spool_requests(['[{"a": "b"}]'])
+
+    assert has_spooled_requests()
+    assert take_spooled_requests() == ["[{}]", b"\x1f\x8bcompressed", '[{"a": "b"}]']
+    assert not has_spooled_requests()
+    assert take_spooled_requests() == []
+
+
+def test_spool_evicts_oldest_requests_when_full(monkeypatch, caplog):
+    monkeypatch.setattr(edge_spool, "SPOOL_MAX_SIZE", 25)
+
+    spool_requests(["a" * 10, "b" * 10])
+    spool_requests(["c" * 10])
+
+    assert take_spooled_requests() == ["b" * 10, "c" * 10]
+    assert any("old requests were lost" in r.message for r in caplog.records)
+
+
+def test_spool_skips_request_bigger_than_the_spool(monkeypatch):
+    monkeypatch.setattr(edge_spool, "SPOOL_MAX_SIZE", 25)
+
+    spool_requests(["a" * 10, "b" * 30])
+
+    assert take_spooled_requests() == ["a" * 10]
+
+
+def test_take_spooled_requests_drops_old_requests(monkeypatch):
+    spool_requests(["old"])
+    monkeypatch.setattr(time, "time", lambda: os.path.getmtime(edge_spool.SPOOL_DIR) + 3600)
+
+    assert take_spooled_requests() == []
+    assert not has_spooled_requests()
+
+
+def test_partially_written_requests_are_not_taken(spool_dir):
+    spool_requests(["[{}]"])
+    (spool_dir / f"{int(time.time() * 1000):013d}-partial").write_bytes(b"[{")
+
+    assert take_spooled_requests() == ["[{}]"]
@@ -0,0 +1,106 @@
+import json
+import os
+
+import pytest
+
+from lumigo_tracer.lambda_tracer import extension_segment
+from lumigo_tracer.lambda_tracer.extension_segment import (
+    ACTIVE_SEGMENT_SUFFIX,
+    SEGMENT_MAGIC,
+    SEGMENT_SUFFIX,
+    SegmentWriter,
+    get_segment_writer,
+    read_segment_records,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_segment_writer(monkeypatch):
+    monkeypatch.setattr(extension_segment, "segment_writer", None)
+
+
+def _completed_segments(directory):
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(SEGMENT_SUFFIX)
+    )
+
+
+def test_read_active_segment_incrementally(tmp_path):
+    writer = SegmentWriter(str(tmp_path))
+
+    writer.append("span", b'[{"a": "b"}]')
+    active_path = writer.active_path
+    assert active_path.endswith(ACTIVE_SEGMENT_SUFFIX)
+    records, offset = read_segment_records(active_path)
+    assert records == [("span", b'[{"a": "b"}]')]
+
+    writer.append("span", b"[{}]")
+    records, offset = read_segment_records(active_path, offset)
+    assert records == [("span", b"[{}]")]
+    assert read_segment_records(active_path, offset) == ([], offset)
+
+
+def test_segment_is_rotated_at_the_end_of_the_invocation(tmp_path):
+    writer = SegmentWriter(str(tmp_path))
+
+    writer.append("span", b"[1]")
+    writer.append("end", b"[2]")
+    writer.append("span", b"[3]")
+
+    [completed_path] = _completed_segments(tmp_path)
+    records, offset = read_segment_records(completed_path)
+    assert records == [("span", b"[1]"), ("end", b"[2]")]
+    # The completed segment is truncated to its records
+    assert os.path.getsize(completed_path) == offset
+    assert read_segment_records(writer.active_path)[0] == [("span", b"[3]")]
+
+
+def test_segment_is_rotated_when_full(tmp_path):
+    writer = SegmentWriter(str(tmp_path), max_size=len(SEGMENT_MAGIC) + 50)
+    payloads = [json.dumps([{"id": str(i)}]).encode() for i in range(6)]
+
+    for payload in payloads:
+        writer.append("span", payload)
+    writer.rotate()
+
+    segments = _completed_segments(tmp_path)
+    assert len(segments) > 1
+    assert [p for path in segments for _, p in read_segment_records(path)[0]] == payloads
+
+
+def test_record_bigger_than_segment(tmp_path):
+    writer = SegmentWriter(str(tmp_path), max_size=100)
+    payload = b"a" * 1000
+
+    writer.append("stop", payload)
+
+    [completed_path] = _completed_segments(tmp_path)
+    assert read_segment_records(completed_path)[0] == [("stop", payload)]
+
+
+def test_reader_stops_at_uncommitted_record(tmp_path):
+    path = tmp_path / f"container{SEGMENT_SUFFIX}"
+    # A payload without a header yet, followed by the preallocated zeros
+    path.write_bytes(SEGMENT_MAGIC + b"\x00" * 5 + b"[{}]" + b"\x00" * 100)
+
+    assert read_segment_records(str(path)) == ([], len(SEGMENT_MAGIC))
+
+
+def test_read_segment_records_of_other_file(tmp_path):
+    path = tmp_path / "span_name_span"
+    path.write_bytes(b"[{}]")
+
+    with pytest.raises(ValueError):
+        read_segment_records(str(path))
+
+
+def test_get_segment_writer_rotates_when_directory_changes(tmp_path):
+    writer = get_segment_writer(str(tmp_path / "a"))
+    writer.append("span", b"[]")
+    assert get_segment_writer(str(tmp_path / "a")) is writer
+
+    get_segment_writer(str(tmp_path / "b"))
+
+    assert len(_completed_segments(tmp_path / "a")) == 1
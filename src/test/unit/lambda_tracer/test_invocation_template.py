@@ -0,0 +1,109 @@
+import json
+import os
+import re
+
+import mock
+import pytest
+from lumigo_core.configuration import CoreConfiguration
+from lumigo_core.scrubbing import TRUNCATE_SUFFIX
+
+from lumigo_tracer.lambda_tracer import invocation_template
+from lumigo_tracer.lambda_tracer.invocation_template import (
+    get_invocation_template,
+    get_tracer_version,
+)
+from lumigo_tracer.lumigo_utils import lumigo_dumps_with_context
+
+
+def _dump_environ(has_error: bool = False) -> str:
+    return lumigo_dumps_with_context(
+        "environment", dict(os.environ), CoreConfiguration.get_max_entry_size(has_error)
+    )
+
+
+@pytest.fixture
+def small_environ(monkeypatch):
+    monkeypatch.setattr(
+        os,
+        "environ",
+        {
+            "AWS_LAMBDA_FUNCTION_NAME": "my-function",
+            "AWS_REGION": "us-east-1",
+            "MY_SECRET": "123",
+            "_X_AMZN_TRACE_ID": "Root=1-2-3",
+        },
+    )
+
+
+def test_get_tracer_version():
+    assert get_tracer_version() == get_tracer_version()
+    assert get_tracer_version() != ""
+
+
+def test_invocation_template_fields(small_environ):
+    template = get_invocation_template()
+
+    assert template.name == "my-function"
+    assert template.region == "us-east-1"
+    assert template.runtime is None
+
+
+def test_invocation_template_reused_between_invocations(small_environ, monkeypatch):
+    template = get_invocation_template()
+    monkeypatch.setenv("_X_AMZN_TRACE_ID", "Root=4-5-6")
+
+    assert get_invocation_template() is template
+    assert json.loads(template.get_envs_dump()) == json.loads(_dump_environ())
+    assert "Root=4-5-6" in template.get_envs_dump()
+
+
+def test_invocation_template_rebuilt_when_environment_changes(small_environ, monkeypatch):
+    template = get_invocation_template()
+    monkeypatch.setenv("AWS_REGION", "eu-west-1")
+
+    assert get_invocation_template() is not template
+    assert get_invocation_template().region == "eu-west-1"
+
+
+def test_get_envs_dump_scrubs_once(small_environ, monkeypatch):
+    template = get_invocation_template()
+    assert json.loads(template.get_envs_dump())["MY_SECRET"] == "****"
+    dumps_mock = mock.Mock(wraps=lumigo_dumps_with_context)
+    monkeypatch.setattr(invocation_template, "lumigo_dumps_with_context", dumps_mock)
+
+    template.get_envs_dump()
+
+    # Only the per invocation variables are dumped again
+    dumps_mock.assert_called_once_with(
+        "environment", {"_X_AMZN_TRACE_ID": "Root=1-2-3"}, CoreConfiguration.max_entry_size
+    )
+
+
+def test_get_envs_dump_masking_config_changed(small_environ, monkeypatch):
+    template = get_invocation_template()
+    template.get_envs_dump()
+    monkeypatch.setattr(
+        CoreConfiguration, "secret_masking_regex_environment", re.compile(".*NAME.*")
+    )
+
+    dumped = json.loads(template.get_envs_dump())
+
+    assert dumped["AWS_LAMBDA_FUNCTION_NAME"] == "****"
+    assert dumped["MY_SECRET"] == "123"
+
+
+@pytest.mark.parametrize("has_error", [False, True])
+def test_get_envs_dump_truncated(small_environ, monkeypatch, has_error):
+    monkeypatch.setenv("LONG_STRING", "v" * CoreConfiguration.get_max_entry_size(has_error))
+
+    dump = get_invocation_template().get_envs_dump(has_error)
+
+    assert dump.endswith(TRUNCATE_SUFFIX)
+    assert len(dump) == len(_dump_environ(has_error))
+    assert dump.startswith('{"_X_AMZN_TRACE_ID": "Root=1-2-3", ')
+
+
+def test_get_envs_dump_without_per_invocation_envs(small_environ, monkeypatch):
+    monkeypatch.delenv("_X_AMZN_TRACE_ID")
+
+    assert get_invocation_template().get_envs_dump() == _dump_environ()
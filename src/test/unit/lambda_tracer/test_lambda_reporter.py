@@ -1,3 +1,5 @@
+import concurrent.futures
+import copy
 import gzip
 import http.client
 import importlib.util
@@ -5,9 +7,13 @@ import json
 import logging
 import os
 import socket
+import threading
+import time
 import uuid
-from base64 import b64decode
+import zlib
+from base64 import b64decode, b64encode
 from datetime import datetime, timedelta
+from types import SimpleNamespace
 from unittest.mock import Mock
 
 import boto3
@@ -15,28 +21,60 @@ import pytest
 from lumigo_core.configuration import CoreConfiguration
 from lumigo_core.scrubbing import EXECUTION_TAGS_KEY
 from mock import MagicMock
+from moto import mock_kinesis
+from werkzeug.wrappers import Response
 
 from lumigo_tracer import lumigo_utils
-from lumigo_tracer.lambda_tracer import lambda_reporter
+from lumigo_tracer.lambda_tracer import (
+    edge_health,
+    edge_network,
+    edge_spool,
+    extension_segment,
+    lambda_reporter,
+    report_stats,
+)
+from lumigo_tracer.lambda_tracer.compression_dictionary import (
+    COMPRESSION_DICTIONARY,
+    COMPRESSION_DICTIONARY_ID,
+)
+from lumigo_tracer.lambda_tracer.edge_health import CircuitState
+from lumigo_tracer.lambda_tracer.extension_segment import read_segment_records
 from lumigo_tracer.lambda_tracer.lambda_reporter import (
     CHINA_REGION,
+    COMPRESSION_DICTIONARY_HEADER,
+    DROPPED_SPANS_REASONS_KEY,
     EDGE_PATH,
     ENRICHMENT_TYPE,
     FUNCTION_TYPE,
     HTTP_TYPE,
     MONGO_SPAN,
+    SPAN_METADATA_PROJECTORS,
     SPANS_SEND_SIZE_ENRICHMENT_SPAN_BUFFER,
+    VERTEXAI_SPAN,
+    SerializedSpan,
     _create_request_body,
+    _dump_serialized_spans,
+    _send_bulks_in_parallel,
     _split_and_zip_spans,
     _update_enrichment_span_about_prioritized_spans,
     establish_connection,
+    establish_connection_global,
+    get_base64_size,
     get_edge_host,
     get_event_base64_size,
     get_extension_dir,
+    get_serialized_spans_size,
+    get_span_metadata,
     report_json,
+    report_prepared_request,
+    span_metadata_without,
 )
 from lumigo_tracer.lambda_tracer.spans_container import TOTAL_SPANS_KEY
-from lumigo_tracer.lumigo_utils import Configuration, InternalState
+from lumigo_tracer.lumigo_utils import (
+    EDGE_KINESIS_STREAM_NAME,
+    Configuration,
+    InternalState,
+)
 
 NOW = datetime.now()
 STARTED = (NOW - timedelta(seconds=10)).timestamp() * 1000
@@ -303,6 +341,24 @@ def test_create_request_body_not_effecting_small_events(should_try_zip):
     )
 
 
+def test_create_request_body_uses_cached_serialization():
+    span = {**DUMMY_SPAN, "id": "1"}
+    cached = SerializedSpan(span)
+    cached.dumped = '{"cached": true}'
+    stale = SerializedSpan({**DUMMY_SPAN, "id": "2"})
+    stale.dumped = '{"stale": true}'
+
+    body = _create_request_body(
+        None,
+        [span, {**DUMMY_SPAN, "id": "2"}],
+        True,
+        False,
+        cached_spans={"1": cached, "2": stale},
+    )
+
+    assert json.loads(body) == [{"cached": True}, {**DUMMY_SPAN, "id": "2"}]
+
+
 def test_create_request_body_keep_function_span_and_filter_other_spans(unzip_zipped_spans):
     input_spans = [DUMMY_SPAN, DUMMY_SPAN, DUMMY_SPAN, FUNCTION_END_SPAN, FUNCTION_END_SPAN]
     expected_result = [FUNCTION_END_SPAN_METADATA, FUNCTION_END_SPAN_METADATA]
@@ -370,20 +426,26 @@ def test_create_request_body_take_only_metadata_function_span(caplog):
 def test_create_request_body(
     test_case: str, wrapper_span: dict, wrapper_span_metadata: dict, caplog
 ) -> None:
-    expected_result = [
+    selected_spans = [
         FUNCTION_END_SPAN,
         {**ENRICHMENT_SPAN_METADATA, "totalSpans": 3},
         wrapper_span_metadata,
     ]
     input_spans = [wrapper_span, {**ENRICHMENT_SPAN, "totalSpans": 3}, FUNCTION_END_SPAN]
-    size = get_event_base64_size(expected_result) + SPANS_SEND_SIZE_ENRICHMENT_SPAN_BUFFER
+    size = get_event_base64_size(selected_spans) + SPANS_SEND_SIZE_ENRICHMENT_SPAN_BUFFER
 
     result = _create_request_body(
         None, input_spans, True, False, max_size=size, max_error_size=size
     )
 
     assert caplog.records[0].message == "Starting smart span selection"
-    assert result == json.dumps(expected_result)
+    selected_spans[1][DROPPED_SPANS_REASONS_KEY] = {
+        "SPANS_SENT_AS_METADATA": {
+            "drops": 2,
+            "dropsByType": {wrapper_span["type"]: 1, ENRICHMENT_TYPE: 1},
+        }
+    }
+    assert json.loads(result) == selected_spans
 
 
 def test_with_many_spans():
@@ -416,13 +478,21 @@ def test_with_many_spans():
     )
     assert isinstance(china_result, str)
 
-    # because size is small, zipping does not help
+    # because size is small, the spans are split into more bulks
     result_with_zip = _create_request_body(
         None, input_spans, True, True, max_size=size // 100, max_error_size=size // 100
     )
-    print(result_with_zip)
+    assert isinstance(result_with_zip, list)
+    assert len(result_with_zip) > 1
+    assert all(len(bulk) <= size // 100 for bulk in result_with_zip)
+    assert len(_unzip_bulks(result_with_zip)) == len(input_spans)
+
+    # because size is too small, even the metadata of the spans can't be zipped into a bulk
+    result_with_zip = _create_request_body(
+        None, input_spans, True, True, max_size=size // 1000, max_error_size=size // 1000
+    )
     assert isinstance(result_with_zip, str)
-    assert len(result_with_zip) <= size // 100
+    assert len(result_with_zip) <= size // 1000
 
 
 @pytest.mark.parametrize(
@@ -459,8 +529,29 @@ def test_report_json_extension_spans_mode(monkeypatch, reporter_mock, tmpdir):
     assert json.dumps(end_file_content) == json.dumps(spans)
 
 
+def test_report_json_extension_segments_mode(monkeypatch, reporter_mock, tmpdir):
+    extension_dir = str(tmpdir.mkdir("tmp"))
+    monkeypatch.setattr(extension_segment, "segment_writer", None)
+    monkeypatch.setattr(CoreConfiguration, "should_report", True)
+    monkeypatch.setenv("LUMIGO_USE_TRACER_EXTENSION", "TRUE")
+    monkeypatch.setenv("LUMIGO_EXTENSION_SEGMENTS", "TRUE")
+    monkeypatch.setenv("LUMIGO_EXTENSION_SPANS_DIR_KEY", extension_dir)
+    start_span = [{"span": "true"}]
+    spans = [{"id": str(i), "data": "a" * 100} for i in range(100)]
+
+    report_json(region=None, msgs=start_span, is_start_span=True)
+    report_json(region=None, msgs=spans, is_start_span=False)
+
+    [segment_name] = os.listdir(extension_dir)
+    records, _ = read_segment_records(os.path.join(extension_dir, segment_name))
+    assert [(record_type, json.loads(payload)) for record_type, payload in records] == [
+        ("span", start_span),
+        ("end", spans),
+    ]
+
+
 @pytest.mark.parametrize(
-    "errors, final_log", [(ValueError, "ERROR"), ([ValueError, Mock()], "INFO")]
+    "errors, final_log", [(ValueError, "ERROR"), ([ValueError, Mock(status=200)], "INFO")]
 )
 def test_report_json_retry(monkeypatch, reporter_mock, caplog, errors, final_log):
     reporter_mock.side_effect = report_json
@@ -489,7 +580,7 @@ def test_report_json_fast_failure_after_timeout(monkeypatch, reporter_mock, capl
     assert report_json(None, [{"a": "b"}]) == 0
     assert caplog.records[-1].msg == "Skip sending messages due to previous timeout"
 
-    InternalState.timeout_on_connection = datetime(2016, 1, 1)
+    edge_health.edge_circuit_breaker.opened_at = time.time() - 3600
     assert report_json(None, [{"a": "b"}]) == 0
     # Check if the expected message is in any of the log records
     messages = [record.msg for record in caplog.records]
@@ -581,35 +672,173 @@ def test_china_reuse_boto3_connection(monkeypatch):
     boto3.client.assert_called_once()
 
 
+@pytest.fixture
+def kinesis_stream(monkeypatch):
+    """
+    A moto stand-in for the edge Kinesis, which returns the spans of every record it got.
+    """
+    region = "ap-east-1"  # Moto doesn't work for China
+    monkeypatch.setattr(lambda_reporter, "CHINA_REGION", region)
+    monkeypatch.setattr(CoreConfiguration, "should_report", True)
+    monkeypatch.setattr(Configuration, "edge_kinesis_aws_access_key_id", "my_value")
+    monkeypatch.setattr(Configuration, "edge_kinesis_aws_secret_access_key", "my_value")
+    with mock_kinesis():
+        client = boto3.client(
+            "kinesis",
+            region_name=region,
+            aws_access_key_id="my_value",
+            aws_secret_access_key="my_value",  # pragma: allowlist secret
+        )
+        client.create_stream(StreamName=EDGE_KINESIS_STREAM_NAME, ShardCount=2)
+        shards = client.describe_stream(StreamName=EDGE_KINESIS_STREAM_NAME)["StreamDescription"][
+            "Shards"
+        ]
+
+        def _get_records():
+            records = []
+            for shard in shards:
+                shard_iterator = client.get_shard_iterator(
+                    StreamName=EDGE_KINESIS_STREAM_NAME,
+                    ShardId=shard["ShardId"],
+                    ShardIteratorType="TRIM_HORIZON",
+                )["ShardIterator"]
+                records.extend(client.get_records(ShardIterator=shard_iterator)["Records"])
+            return [json.loads(record["Data"]) for record in records]
+
+        yield SimpleNamespace(region=region, get_records=_get_records)
+
+
+def test_report_json_china_splits_spans_into_records(kinesis_stream, monkeypatch):
+    monkeypatch.setattr(
+        lambda_reporter, "EDGE_KINESIS_MAX_SIZE", lambda_reporter.KINESIS_MAX_REQUEST_SIZE
+    )
+    spans = [FUNCTION_END_SPAN] + [
+        {**HTTP_SPAN, "id": str(i), "data": os.urandom(100_000).hex()} for i in range(8)
+    ]
+
+    report_json(kinesis_stream.region, spans)
+
+    records = kinesis_stream.get_records()
+    assert len(records) > 1
+    assert sorted(json.dumps(span) for record in records for span in record) == sorted(
+        json.dumps(span) for span in spans
+    )
+
+
+def test_report_json_china_sends_metadata_of_span_bigger_than_record(kinesis_stream):
+    big_span = copy.deepcopy(HTTP_SPAN)
+    big_span["info"]["httpInfo"]["request"]["body"] = "a" * 1024 * 1024
+
+    report_json(kinesis_stream.region, [FUNCTION_END_SPAN, big_span])
+
+    [record] = kinesis_stream.get_records()
+    assert record == [FUNCTION_END_SPAN, get_span_metadata(big_span)]
+
+
+def test_put_kinesis_records_retries_only_failed_entries(monkeypatch):
+    monkeypatch.setattr(lambda_reporter, "KINESIS_RETRY_BACKOFF", 0)
+    client = MagicMock()
+    client.put_records.side_effect = [
+        {
+            "FailedRecordCount": 1,
+            "Records": [{"SequenceNumber": "1"}, {"ErrorCode": "ThrottlingException"}],
+        },
+        {"FailedRecordCount": 0, "Records": [{"SequenceNumber": "2"}]},
+    ]
+    entries = [{"Data": b"1", "PartitionKey": "1"}, {"Data": b"2", "PartitionKey": "2"}]
+
+    assert lambda_reporter._put_kinesis_records(client, "stream", entries) == 0
+
+    assert client.put_records.call_args_list[1].kwargs["Records"] == [entries[1]]
+
+
+def test_put_kinesis_records_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(lambda_reporter, "KINESIS_RETRY_BACKOFF", 0)
+    client = MagicMock()
+    client.put_records.return_value = {
+        "FailedRecordCount": 1,
+        "Records": [{"ErrorCode": "ProvisionedThroughputExceededException"}],
+    }
+
+    lost = lambda_reporter._put_kinesis_records(client, "stream", [{"Data": b"1"}])
+
+    assert lost == 1
+    assert client.put_records.call_count == lambda_reporter.KINESIS_MAX_ATTEMPTS
+
+
+def test_put_kinesis_records_doesnt_retry_after_deadline(monkeypatch):
+    sleep_mock = MagicMock()
+    monkeypatch.setattr(time, "sleep", sleep_mock)
+    client = MagicMock()
+    client.put_records.return_value = {
+        "FailedRecordCount": 1,
+        "Records": [{"ErrorCode": "ProvisionedThroughputExceededException"}],
+    }
+    deadline = lumigo_utils.get_current_ms_time()
+
+    lost = lambda_reporter._put_kinesis_records(client, "stream", [{"Data": b"1"}], deadline)
+
+    assert lost == 1
+    assert client.put_records.call_count == 1
+    assert not sleep_mock.called
+
+
+def test_create_kinesis_records_limits_to_edge_kinesis_max_size():
+    spans = [FUNCTION_END_SPAN] + [
+        {**HTTP_SPAN, "id": str(i), "data": os.urandom(100_000).hex()} for i in range(8)
+    ]
+
+    records = lambda_reporter._create_kinesis_records(spans, prune_size_flag=True)
+
+    assert lambda_reporter.EDGE_KINESIS_MAX_SIZE == lambda_reporter.MAX_SIZE_FOR_REQUEST
+    assert sum(len(record) for record in records) <= lambda_reporter.EDGE_KINESIS_MAX_SIZE
+
+
+def test_get_kinesis_batches_within_put_records_limits():
+    small_entries = [{"Data": b"1", "PartitionKey": "1"}] * 501
+    big_entries = [{"Data": b"1" * 1024 * 1024, "PartitionKey": "1"}] * 6
+
+    assert [len(b) for b in lambda_reporter._get_kinesis_batches(small_entries)] == [500, 1]
+    assert [len(b) for b in lambda_reporter._get_kinesis_batches(big_entries)] == [4, 2]
+
+
+def test_establish_connection_global_builds_kinesis_client_in_china(monkeypatch):
+    monkeypatch.setenv("AWS_REGION", CHINA_REGION)
+    monkeypatch.setenv("LUMIGO_EDGE_KINESIS_AWS_ACCESS_KEY_ID", "my_value")
+    monkeypatch.setenv("LUMIGO_EDGE_KINESIS_AWS_SECRET_ACCESS_KEY", "my_value")
+    monkeypatch.setattr(CoreConfiguration, "should_report", True)
+    monkeypatch.setattr(boto3, "client", MagicMock())
+
+    establish_connection_global()
+    boto3.client.assert_called_once()
+
+    monkeypatch.setattr(Configuration, "edge_kinesis_aws_access_key_id", "my_value")
+    monkeypatch.setattr(Configuration, "edge_kinesis_aws_secret_access_key", "my_value")
+    report_json(CHINA_REGION, [{"a": "b"}])
+    boto3.client.assert_called_once()
+
+
 def test_update_enrichment_span_about_prioritized_spans_no_drops():
     enrichment_span = {"type": ENRICHMENT_TYPE, "id": "enrich"}
     span1 = {"type": HTTP_TYPE, "id": "1"}
     span2 = {"type": HTTP_TYPE, "id": "2"}
-    spans_dict = {1: enrichment_span, 2: span1, 3: span2}
-    msgs = [enrichment_span, span1, span2]
-    current_size = sum([get_event_base64_size(s) for s in msgs])
-    max_size = current_size
-    result = _update_enrichment_span_about_prioritized_spans(
-        spans_dict, msgs, current_size, max_size
-    )
-    assert result == msgs
+    msgs = [SerializedSpan(enrichment_span), SerializedSpan(span1), SerializedSpan(span2)]
+    max_size = sum([s.base64_size for s in msgs])
+    result = [s.span for s in _update_enrichment_span_about_prioritized_spans(msgs, msgs, max_size)]
+    assert result == [enrichment_span, span1, span2]
 
 
 def test_update_enrichment_span_about_prioritized_spans_with_drops():
     enrichment_span = {"type": ENRICHMENT_TYPE, "id": "enrich"}
     span1 = {"type": HTTP_TYPE, "id": "1"}
     span2 = {"type": HTTP_TYPE, "id": "2"}
-    spans_dict = {
-        1: enrichment_span,
-        2: span1,
-        # Dropped span2
-    }
-    msgs = [enrichment_span, span1, span2]
-    current_size = sum([get_event_base64_size(s) for s in spans_dict.values()])
-    max_size = current_size * 100
-    result = _update_enrichment_span_about_prioritized_spans(
-        spans_dict, msgs, current_size, max_size
-    )
+    msgs = [SerializedSpan(enrichment_span), SerializedSpan(span1), SerializedSpan(span2)]
+    spans_to_send = msgs[:2]  # Dropped span2
+    max_size = sum([s.base64_size for s in spans_to_send]) * 100
+    result = [
+        s.span
+        for s in _update_enrichment_span_about_prioritized_spans(spans_to_send, msgs, max_size)
+    ]
     assert [s for s in result if s["type"] == HTTP_TYPE and s["id"] == "1"]
     assert [s for s in result if s["type"] == HTTP_TYPE and s["id"] == "2"] == []
     enrichment_spans = [s for s in result if s["type"] == ENRICHMENT_TYPE and s["id"] == "enrich"]
@@ -618,7 +847,25 @@ def test_update_enrichment_span_about_prioritized_spans_with_drops():
     assert resulting_enrichment_span == {
         "type": ENRICHMENT_TYPE,
         "id": "enrich",
-        "droppedSpansReasons": {"SPANS_SENT_SIZE_LIMIT": {"drops": 1}},
+        "droppedSpansReasons": {
+            "SPANS_SENT_SIZE_LIMIT": {"drops": 1, "dropsByType": {HTTP_TYPE: 1}}
+        },
+    }
+
+
+def test_update_enrichment_span_about_prioritized_spans_with_drops_and_metadata():
+    enrichment_span = {"type": ENRICHMENT_TYPE, "id": "enrich"}
+    msgs = [SerializedSpan(s) for s in [enrichment_span, HTTP_SPAN, REDIS_SPAN, SQL_SPAN]]
+    spans_to_send = [msgs[0], msgs[1].metadata, msgs[2].metadata]  # Dropped the sql span
+    result = _update_enrichment_span_about_prioritized_spans(spans_to_send, msgs, 100_000)
+
+    assert [s.span for s in result[:2]] == [HTTP_SPAN_METADATA, REDIS_SPAN_METADATA]
+    assert result[2].span[DROPPED_SPANS_REASONS_KEY] == {
+        "SPANS_SENT_SIZE_LIMIT": {"drops": 1, "dropsByType": {SQL_SPAN["type"]: 1}},
+        "SPANS_SENT_AS_METADATA": {
+            "drops": 2,
+            "dropsByType": {HTTP_TYPE: 1, REDIS_SPAN["type"]: 1},
+        },
     }
 
 
@@ -626,52 +873,904 @@ def test_update_enrichment_span_about_prioritized_spans_with_drops_no_size_left_
     enrichment_span = {"type": ENRICHMENT_TYPE, "id": "enrich"}
     span1 = {"type": HTTP_TYPE, "id": "1"}
     span2 = {"type": HTTP_TYPE, "id": "2"}
-    spans_dict = {
-        1: enrichment_span,
-        2: span1,
-        # Dropped span2
-    }
-    msgs = [enrichment_span, span1, span2]
-    current_size = sum([get_event_base64_size(s) for s in spans_dict.values()])
-    max_size = current_size
-    result = _update_enrichment_span_about_prioritized_spans(
-        spans_dict, msgs, current_size, max_size
-    )
+    msgs = [SerializedSpan(enrichment_span), SerializedSpan(span1), SerializedSpan(span2)]
+    spans_to_send = msgs[:2]  # Dropped span2
+    max_size = get_base64_size(get_serialized_spans_size(spans_to_send))
+    result = [
+        s.span
+        for s in _update_enrichment_span_about_prioritized_spans(spans_to_send, msgs, max_size)
+    ]
     assert [s for s in result if s["type"] == HTTP_TYPE and s["id"] == "1"]
     assert [s for s in result if s["type"] == HTTP_TYPE and s["id"] == "2"] == []
     enrichment_spans = [s for s in result if s["type"] == ENRICHMENT_TYPE and s["id"] == "enrich"]
     assert len(enrichment_spans) == 1
     resulting_enrichment_span = enrichment_spans[0]
     assert resulting_enrichment_span == {"type": ENRICHMENT_TYPE, "id": "enrich"}
-    assert sum([get_event_base64_size(s) for s in result]) <= max_size
+    assert get_event_base64_size(result) <= max_size
 
 
-def test_split_and_zip_spans_successfully():
-    MAX_SPANS_BULK_SIZE = 200
-    # Create spans list with size 2 * MAX_SPANS_BULK_SIZE
-    spans = [{} for _ in range(MAX_SPANS_BULK_SIZE * 2)]
+def test_create_request_body_skips_span_that_does_not_fit():
+    big_span = {**copy.deepcopy(HTTP_SPAN), "id": "big"}
+    big_span["info"]["httpInfo"]["request"]["body"] = "a" * 5000
+    input_spans = [FUNCTION_END_SPAN, big_span] + [HTTP_SPAN] * 10
+    selected_spans = [FUNCTION_END_SPAN] + [HTTP_SPAN] * 10 + [get_span_metadata(big_span)]
+    size = get_event_base64_size(selected_spans) + SPANS_SEND_SIZE_ENRICHMENT_SPAN_BUFFER
+
+    result = _create_request_body(
+        None, input_spans, True, False, max_size=size, max_error_size=size
+    )
+
+    # The big span doesn't stop the selection of the smaller spans after it
+    assert sorted(map(json.dumps, json.loads(result))) == sorted(map(json.dumps, selected_spans))
+
+
+def test_create_request_body_takes_cheapest_spans_of_the_same_priority():
+    spans = [copy.deepcopy({**HTTP_SPAN, "id": str(i)}) for i in range(10)]
+    for i, span in enumerate(spans):
+        span["info"]["httpInfo"]["request"]["body"] = "a" * (100 * (10 - i))
+    input_spans = [FUNCTION_END_SPAN] + spans
+    # All the metadata fits, and 5 full spans
+    selected_spans = [FUNCTION_END_SPAN] + [get_span_metadata(s) for s in spans[:5]] + spans[5:]
+    size = get_event_base64_size(selected_spans) + SPANS_SEND_SIZE_ENRICHMENT_SPAN_BUFFER
 
-    # Call split_and_zip_spans
-    zipped_spans_bulks = _split_and_zip_spans(spans)
+    result = _create_request_body(
+        None, input_spans, True, False, max_size=size, max_error_size=size
+    )
 
-    # Test that it splits into the correct number of bulks
-    assert len(zipped_spans_bulks) == (MAX_SPANS_BULK_SIZE * 2) // MAX_SPANS_BULK_SIZE
+    assert json.loads(result) == selected_spans
 
-    # Test unzipping and verify that it equals the original spans
+
+def _unzip_bulks(zipped_spans_bulks):
     unzipped_spans = []
     for zipped_span in zipped_spans_bulks:
         zipped_span_unload = json.loads(zipped_span)
         # Decode base64 and unzip
         unzipped: str = gzip.decompress(b64decode(zipped_span_unload)).decode("utf-8")
         unzipped_spans.extend(json.loads(unzipped))
+    return unzipped_spans
+
 
-    # Check that unzipped spans match the original spans
-    assert unzipped_spans == spans
+def test_split_and_zip_spans_successfully():
+    # Random data, so the bulks are split by size and not by the number of spans
+    spans = [{"id": str(i), "data": os.urandom(1000).hex()} for i in range(400)]
+    max_size = 100_000
 
-    # Create spans list with size MAX_SPANS_BULK_SIZE / 3
-    spans = [{} for _ in range(MAX_SPANS_BULK_SIZE // 3)]
+    zipped_spans_bulks = _split_and_zip_spans(spans, max_size)
 
-    # Call split_and_zip_spans
-    zipped_spans_bulks = _split_and_zip_spans(spans)
+    assert all(len(bulk) <= max_size for bulk in zipped_spans_bulks)
+    # The bulks are filled up to the limit. Each span is ~1500 bytes after zipping and encoding.
+    assert len(zipped_spans_bulks) > 1
+    assert all(len(bulk) > max_size - 3000 for bulk in zipped_spans_bulks[:-1])
+    unzipped_spans = _unzip_bulks(zipped_spans_bulks)
+    assert sorted(unzipped_spans, key=lambda s: int(s["id"])) == spans
+
+    # Small spans fit in a single bulk, regardless of their number
+    spans = [{} for _ in range(1000)]
+
+    zipped_spans_bulks = _split_and_zip_spans(spans, max_size)
 
     assert len(zipped_spans_bulks) == 1
+    assert _unzip_bulks(zipped_spans_bulks) == spans
+
+
+def test_split_and_zip_spans_prioritize_spans_when_splitting():
+    spans = [{**HTTP_SPAN, "id": str(i), "data": os.urandom(1000).hex()} for i in range(100)]
+    spans.append({**FUNCTION_END_SPAN, "data": os.urandom(1000).hex()})
+
+    zipped_spans_bulks = _split_and_zip_spans(spans, 20_000)
+
+    assert len(zipped_spans_bulks) > 1
+    assert _unzip_bulks(zipped_spans_bulks[:1])[0]["type"] == FUNCTION_TYPE
+    assert len(_unzip_bulks(zipped_spans_bulks)) == len(spans)
+
+
+def test_split_and_zip_spans_send_metadata_of_too_big_span():
+    big_span = {**copy.deepcopy(HTTP_SPAN), "id": "big"}
+    big_span["info"]["httpInfo"]["request"]["body"] = os.urandom(50_000).hex()
+    spans = [FUNCTION_END_SPAN, big_span, HTTP_SPAN]
+
+    zipped_spans_bulks = _split_and_zip_spans(spans, 10_000)
+
+    unzipped_spans = _unzip_bulks(zipped_spans_bulks)
+    assert len(unzipped_spans) == 3
+    assert [s for s in unzipped_spans if s.get("id") == "big"][0]["isMetadata"] is True
+    assert HTTP_SPAN in unzipped_spans
+
+
+@pytest.mark.parametrize(
+    ["span", "span_metadata"],
+    [
+        (FUNCTION_END_SPAN, FUNCTION_END_SPAN_METADATA),
+        (ENRICHMENT_SPAN, ENRICHMENT_SPAN_METADATA),
+        (HTTP_SPAN, HTTP_SPAN_METADATA),
+        (REDIS_SPAN, REDIS_SPAN_METADATA),
+        (PYMONGO_SPAN, PYMONGO_SPAN_METADATA),
+        (SQL_SPAN, SQL_SPAN_METADATA),
+        (
+            {"type": VERTEXAI_SPAN, "llmModel": "gemini"},
+            {"type": VERTEXAI_SPAN, "llmModel": "gemini", "isMetadata": True},
+        ),
+    ],
+)
+def test_get_span_metadata_does_not_copy_the_span(span, span_metadata, monkeypatch):
+    original_span = copy.deepcopy(span)
+    monkeypatch.setattr(copy, "deepcopy", Mock(side_effect=AssertionError("deepcopy")))
+
+    result = get_span_metadata(span)
+
+    assert result == span_metadata
+    assert span == original_span
+    # The fields that are kept are shared with the span, and not copied
+    for key, value in result.items():
+        if key in span and not isinstance(value, dict):
+            assert value is span[key]
+
+
+def test_get_span_metadata_omits_http_payloads_without_copying_them():
+    span = copy.deepcopy(HTTP_SPAN)
+    span["info"]["httpInfo"]["response"] = {"body": "a" * 1_000_000, "statusCode": 200}
+
+    result = get_span_metadata(span)
+
+    assert result["info"]["httpInfo"]["response"] == {"statusCode": 200}
+    assert result["info"]["tracer"] is span["info"]["tracer"]
+    assert len(span["info"]["httpInfo"]["response"]["body"]) == 1_000_000
+    assert "body" in span["info"]["httpInfo"]["request"]
+
+
+def test_get_span_metadata_of_new_span_type(monkeypatch):
+    monkeypatch.setitem(
+        SPAN_METADATA_PROJECTORS, "new", span_metadata_without(("payload",), ("a", "b", "c"))
+    )
+    span = {"type": "new", "payload": "big", "a": {"b": "not a dict"}, "id": "1"}
+
+    assert get_span_metadata(span) == {
+        "type": "new",
+        "a": {"b": "not a dict"},
+        "id": "1",
+        "isMetadata": True,
+    }
+    assert get_span_metadata({"type": "unsupported"}) == {}
+
+
+def test_serialized_span_sizes():
+    span = SerializedSpan(HTTP_SPAN)
+
+    assert span.dumped == json.dumps(HTTP_SPAN)
+    assert span.base64_size == get_event_base64_size(HTTP_SPAN)
+    assert span.metadata.span == HTTP_SPAN_METADATA
+    assert span.metadata is span.metadata
+    for size in range(10):
+        assert get_base64_size(size) == len(b64encode(b"a" * size))
+
+
+def test_serialized_span_priority():
+    error_span = {**HTTP_SPAN, "error": "failed"}
+
+    assert SerializedSpan(FUNCTION_END_SPAN).priority == 0
+    assert SerializedSpan(HTTP_SPAN).priority == 3
+    assert SerializedSpan(error_span).priority == 2
+    # A known error state is not checked again
+    assert SerializedSpan(HTTP_SPAN, has_error=True).priority == 2
+    assert SerializedSpan(error_span, has_error=False).has_error is False
+
+
+def test_dump_serialized_spans_is_identical_to_json_dumps():
+    spans = [FUNCTION_END_SPAN, HTTP_SPAN, REDIS_SPAN]
+    serialized_spans = [SerializedSpan(s) for s in spans]
+
+    assert _dump_serialized_spans(serialized_spans) == json.dumps(spans)
+    assert _dump_serialized_spans([]) == json.dumps([])
+    assert get_serialized_spans_size(serialized_spans) == len(json.dumps(spans))
+    assert get_serialized_spans_size([]) == len(json.dumps([]))
+
+
+def test_create_request_body_serialize_each_span_once(monkeypatch):
+    dump_mock = Mock(side_effect=json.dumps)
+    monkeypatch.setattr(lambda_reporter, "aws_dump", dump_mock)
+    input_spans = [FUNCTION_END_SPAN] + [{**HTTP_SPAN, "id": str(i)} for i in range(100)]
+    size = get_event_base64_size(input_spans) // 2
+
+    _create_request_body(None, input_spans, True, False, max_size=size, max_error_size=size)
+
+    # Every span is dumped once, and at most once more for its metadata
+    assert dump_mock.call_count <= 2 * len(input_spans) + 1
+
+
+def test_create_request_body_uses_the_given_error_index(monkeypatch):
+    monkeypatch.setattr(lambda_reporter, "is_span_has_error", Mock(side_effect=AssertionError))
+    input_spans = [FUNCTION_END_SPAN, HTTP_SPAN]
+
+    body = _create_request_body(None, input_spans, True, False, has_error=False)
+
+    assert json.loads(body) == input_spans
+
+
+def test_create_request_body_without_pruning_stays_valid_json():
+    input_spans = [FUNCTION_END_SPAN] + [HTTP_SPAN] * 10
+    size = len(json.dumps(input_spans[:5])) + 10
+
+    result = _create_request_body(None, input_spans, False, False, max_size=size)
+
+    assert len(result) <= size
+    assert json.loads(result) == input_spans[:5]
+
+
+@pytest.fixture
+def edge_connections(monkeypatch):
+    """
+    Mocks the edge connections, each request takes `request_duration` seconds and raises `error`.
+    """
+    connections = []
+
+    def _get_response():
+        time.sleep(_create_connection.request_duration)
+        if _create_connection.error:
+            raise _create_connection.error
+        return MagicMock(code=200, status=200)
+
+    def _create_connection(host, *args, **kwargs):
+        connection = MagicMock(host=host)
+        connection.getresponse.side_effect = _get_response
+        connections.append(connection)
+        return connection
+
+    _create_connection.request_duration = 0
+    _create_connection.error = None
+    _create_connection.connections = connections
+    monkeypatch.setattr(http.client, "HTTPSConnection", _create_connection)
+    return _create_connection
+
+
+def test_send_bulks_in_parallel_sends_concurrently(edge_connections, monkeypatch):
+    monkeypatch.setattr(lambda_reporter, "EDGE_CONNECTION_POOL_SIZE", 4)
+    edge_connections.request_duration = 0.3
+    bulks = [f"bulk{i}" for i in range(4)]
+
+    start_time = time.time()
+    _send_bulks_in_parallel("host", bulks)
+
+    assert time.time() - start_time < 0.3 * 3
+    sent = sorted(
+        c.args[2] for conn in edge_connections.connections for c in conn.request.mock_calls
+    )
+    assert sent == bulks
+    # The connections are kept alive for the next report
+    assert len(lambda_reporter.edge_connection_pool._idle_connections) == 4
+
+
+def test_send_bulks_in_parallel_retry_failed_bulk(edge_connections, caplog):
+    failed_once = []
+
+    def _request(*args, **kwargs):
+        if not failed_once:
+            failed_once.append(True)
+            raise ConnectionResetError()
+
+    edge_connections("host").request.side_effect = _request
+    lambda_reporter.edge_connection_pool.release(edge_connections.connections[0])
+
+    _send_bulks_in_parallel("host", ["bulk1", "bulk2"])
+
+    assert any("Retrying" in r.message for r in caplog.records)
+    assert not any(r.levelname == "ERROR" for r in caplog.records)
+    assert edge_connections.connections[0].close.called
+
+
+def test_send_bulks_in_parallel_overall_deadline(edge_connections, monkeypatch, caplog):
+    monkeypatch.setattr(lambda_reporter, "PARALLEL_SEND_DEADLINE", 0.2)
+    monkeypatch.setattr(lambda_reporter, "EDGE_CONNECTION_POOL_SIZE", 2)
+    edge_connections.request_duration = 1
+
+    start_time = time.time()
+    _send_bulks_in_parallel("host", ["bulk1", "bulk2", "bulk3"])
+
+    assert time.time() - start_time < 1
+    assert any("were not sent before the deadline" in r.message for r in caplog.records)
+
+
+def test_report_json_sends_zipped_bulks_in_parallel(edge_connections, monkeypatch):
+    monkeypatch.setattr(CoreConfiguration, "should_report", True)
+    monkeypatch.setenv("LUMIGO_SUPPORT_LARGE_INVOCATIONS", "true")
+    spans = [FUNCTION_END_SPAN] + [
+        {**HTTP_SPAN, "id": str(i), "data": os.urandom(2500).hex()} for i in range(300)
+    ]
+
+    report_json(None, spans)
+
+    requests = [c for conn in edge_connections.connections for c in conn.request.mock_calls]
+    assert len(requests) > 1
+    assert len(_unzip_bulks([c.args[2] for c in requests])) == len(spans)
+
+
+def test_establish_connection_global_warms_pool(edge_connections, monkeypatch):
+    monkeypatch.setenv("LUMIGO_SUPPORT_LARGE_INVOCATIONS", "true")
+    monkeypatch.setattr(lambda_reporter, "EDGE_CONNECTION_POOL_SIZE", 3)
+    monkeypatch.setattr(lambda_reporter.edge_connection_pool, "size", 3)
+    warming = []
+    warm = lambda_reporter.edge_connection_pool.warm
+    monkeypatch.setattr(
+        lambda_reporter.edge_connection_pool, "warm", lambda host: warming.extend(warm(host))
+    )
+
+    establish_connection_global()
+    concurrent.futures.wait(warming, timeout=1)
+
+    # One global connection and 3 pooled connections
+    assert len(edge_connections.connections) == 4
+    assert all(c.connect.called for c in edge_connections.connections)
+    assert len(lambda_reporter.edge_connection_pool._idle_connections) == 3
+
+
+def test_connection_pool_warms_connections_concurrently(edge_connections, monkeypatch):
+    monkeypatch.setattr(lambda_reporter.edge_connection_pool, "size", 3)
+    connect_duration = 0.2
+
+    def _create_connection(host, *args, **kwargs):
+        connection = MagicMock(host=host)
+        connection.connect.side_effect = lambda: time.sleep(connect_duration)
+        return connection
+
+    monkeypatch.setattr(http.client, "HTTPSConnection", _create_connection)
+
+    start_time = time.time()
+    warming = lambda_reporter.edge_connection_pool.warm("host")
+    assert time.time() - start_time < connect_duration
+    concurrent.futures.wait(warming, timeout=1)
+
+    assert time.time() - start_time < connect_duration * 3
+    assert len(lambda_reporter.edge_connection_pool._idle_connections) == 3
+
+
+def test_send_bulks_in_parallel_reuses_the_executor(edge_connections):
+    _send_bulks_in_parallel("host", ["bulk1", "bulk2"])
+    executor = lambda_reporter.edge_executor
+
+    _send_bulks_in_parallel("host", ["bulk3", "bulk4"])
+
+    assert executor is not None
+    assert lambda_reporter.edge_executor is executor
+
+
+@pytest.fixture
+def edge_server(httpserver, monkeypatch):
+    """
+    A local stand-in for the edge, which records the decoded spans of every request.
+    """
+    edge = SimpleNamespace(reject_encoding=False, encodings=[], spans=[])
+
+    def _handle(request):
+        encoding = request.headers.get("Content-Encoding")
+        edge.encodings.append(encoding)
+        if encoding and edge.reject_encoding:
+            return Response(status=415)
+        body = request.get_data()
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "deflate" and request.headers.get(COMPRESSION_DICTIONARY_HEADER):
+            assert request.headers[COMPRESSION_DICTIONARY_HEADER] == COMPRESSION_DICTIONARY_ID
+            decompressor = zlib.decompressobj(zdict=COMPRESSION_DICTIONARY)
+            body = decompressor.decompress(body) + decompressor.flush()
+        elif encoding == "deflate":
+            body = zlib.decompress(body)
+        data = json.loads(body)
+        edge.spans.extend(
+            json.loads(gzip.decompress(b64decode(data))) if isinstance(data, str) else data
+        )
+        return Response(status=200)
+
+    httpserver.expect_request(EDGE_PATH, method="POST").respond_with_handler(_handle)
+    monkeypatch.setattr(
+        http.client,
+        "HTTPSConnection",
+        lambda host, context=None, **kwargs: http.client.HTTPConnection(host, **kwargs),
+    )
+    monkeypatch.setattr(Configuration, "host", f"localhost:{httpserver.port}")
+    monkeypatch.setattr(CoreConfiguration, "should_report", True)
+    return edge
+
+
+def test_report_json_streams_spans_into_bulks(edge_server, monkeypatch):
+    monkeypatch.setenv("LUMIGO_SUPPORT_LARGE_INVOCATIONS", "true")
+    monkeypatch.setattr(lambda_reporter, "MAX_SIZE_FOR_REQUEST", 2000)
+    streamed_spans = [
+        SerializedSpan({**HTTP_SPAN, "id": str(i), "body": os.urandom(300).hex()})
+        for i in range(10)
+    ]
+
+    report_json(None, [FUNCTION_END_SPAN], streamed_spans=iter(streamed_spans))
+
+    assert len(edge_server.encodings) > 2
+    # The bulks are sent in parallel, so they may arrive in any order
+    assert sorted(edge_server.spans, key=json.dumps) == sorted(
+        [FUNCTION_END_SPAN] + [span.span for span in streamed_spans], key=json.dumps
+    )
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "deflate"])
+def test_report_json_content_encoding(edge_server, monkeypatch, encoding):
+    monkeypatch.setenv("LUMIGO_EDGE_CONTENT_ENCODING", encoding)
+    spans = [FUNCTION_END_SPAN, HTTP_SPAN]
+
+    report_json(None, spans)
+
+    assert edge_server.encodings == [encoding]
+    assert edge_server.spans == spans
+
+
+def test_report_json_content_encoding_zipped_bulks(edge_server, monkeypatch):
+    monkeypatch.setenv("LUMIGO_EDGE_CONTENT_ENCODING", "gzip")
+    monkeypatch.setenv("LUMIGO_SUPPORT_LARGE_INVOCATIONS", "true")
+    spans = [FUNCTION_END_SPAN] + [
+        {**HTTP_SPAN, "id": str(i), "data": os.urandom(2500).hex()} for i in range(300)
+    ]
+
+    report_json(None, spans)
+
+    assert len(edge_server.encodings) > 1
+    assert set(edge_server.encodings) == {"gzip"}
+    assert len(edge_server.spans) == len(spans)
+
+
+def test_zipped_bulks_with_content_encoding_use_the_whole_request_size(monkeypatch):
+    monkeypatch.setenv("LUMIGO_EDGE_CONTENT_ENCODING", "gzip")
+    spans = [{"id": str(i), "data": os.urandom(1000).hex()} for i in range(400)]
+    max_size = 100_000
+
+    zipped_spans_bulks = _split_and_zip_spans(spans, max_size)
+
+    assert all(isinstance(bulk, bytes) for bulk in zipped_spans_bulks)
+    assert all(len(bulk) <= max_size for bulk in zipped_spans_bulks)
+    assert all(len(bulk) > max_size - 2000 for bulk in zipped_spans_bulks[:-1])
+    unzipped_spans = [s for bulk in zipped_spans_bulks for s in json.loads(gzip.decompress(bulk))]
+    assert sorted(unzipped_spans, key=lambda s: int(s["id"])) == spans
+
+
+def test_report_json_content_encoding_fallback_to_json(edge_server, monkeypatch):
+    monkeypatch.setenv("LUMIGO_EDGE_CONTENT_ENCODING", "gzip")
+    edge_server.reject_encoding = True
+
+    report_json(None, [FUNCTION_END_SPAN])
+    report_json(None, [HTTP_SPAN])
+
+    # Only the first request is sent compressed, the rest are sent as plain json
+    assert edge_server.encodings == ["gzip", None, None]
+    assert edge_server.spans == [FUNCTION_END_SPAN, HTTP_SPAN]
+    assert InternalState.edge_rejected_content_encoding is True
+    # Only the accepted requests are round-trip samples
+    assert edge_health.edge_rtt_stats.samples_count == 2
+
+
+def test_report_json_unknown_content_encoding_sends_json(edge_server, monkeypatch):
+    monkeypatch.setenv("LUMIGO_EDGE_CONTENT_ENCODING", "br")
+
+    report_json(None, [FUNCTION_END_SPAN])
+
+    assert edge_server.encodings == [None]
+    assert edge_server.spans == [FUNCTION_END_SPAN]
+
+
+def test_report_json_compression_dictionary(edge_server, monkeypatch):
+    monkeypatch.setenv("LUMIGO_EDGE_CONTENT_ENCODING", "deflate")
+    monkeypatch.setenv("LUMIGO_EDGE_COMPRESSION_DICTIONARY", "true")
+    spans = [FUNCTION_END_SPAN, HTTP_SPAN, ENRICHMENT_SPAN]
+
+    report_json(None, spans)
+
+    assert edge_server.encodings == ["deflate"]
+    assert edge_server.spans == spans
+
+
+def test_report_json_compression_dictionary_zipped_bulks(edge_server, monkeypatch):
+    monkeypatch.setenv("LUMIGO_EDGE_CONTENT_ENCODING", "deflate")
+    monkeypatch.setenv("LUMIGO_EDGE_COMPRESSION_DICTIONARY", "true")
+    monkeypatch.setenv("LUMIGO_SUPPORT_LARGE_INVOCATIONS", "true")
+    spans = [FUNCTION_END_SPAN] + [
+        {**HTTP_SPAN, "id": str(i), "data": os.urandom(2500).hex()} for i in range(300)
+    ]
+
+    report_json(None, spans)
+
+    assert len(edge_server.encodings) > 1
+    assert len(edge_server.spans) == len(spans)
+
+
+def test_report_json_compression_dictionary_fallback_to_json(edge_server, monkeypatch):
+    monkeypatch.setenv("LUMIGO_EDGE_CONTENT_ENCODING", "deflate")
+    monkeypatch.setenv("LUMIGO_EDGE_COMPRESSION_DICTIONARY", "true")
+    edge_server.reject_encoding = True
+
+    report_json(None, [FUNCTION_END_SPAN])
+
+    assert edge_server.encodings == ["deflate", None]
+    assert edge_server.spans == [FUNCTION_END_SPAN]
+
+
+def test_compression_dictionary_is_not_used_with_gzip(edge_server, monkeypatch):
+    monkeypatch.setenv("LUMIGO_EDGE_CONTENT_ENCODING", "gzip")
+    monkeypatch.setenv("LUMIGO_EDGE_COMPRESSION_DICTIONARY", "true")
+
+    report_json(None, [FUNCTION_END_SPAN])
+
+    assert edge_server.encodings == ["gzip"]
+    assert edge_server.spans == [FUNCTION_END_SPAN]
+
+
+@pytest.fixture
+def spool(tmp_path, monkeypatch):
+    monkeypatch.setenv("LUMIGO_EDGE_SPOOL", "true")
+    monkeypatch.setattr(edge_spool, "SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(lambda_reporter, "edge_connection", None)
+
+
+def _wait_for_spool_replayer():
+    if lambda_reporter.spool_replayer:
+        lambda_reporter.spool_replayer.join()
+
+
+def test_report_json_spools_during_cooldown_and_replays_later(edge_server, spool):
+    edge_health.edge_circuit_breaker.record_failure()
+
+    report_json(None, [FUNCTION_END_SPAN])
+
+    assert edge_server.spans == []
+    assert edge_spool.has_spooled_requests()
+
+    edge_health.reset()
+    report_json(None, [HTTP_SPAN])
+    _wait_for_spool_replayer()
+
+    assert sorted(map(json.dumps, edge_server.spans)) == sorted(
+        map(json.dumps, [FUNCTION_END_SPAN, HTTP_SPAN])
+    )
+    assert not edge_spool.has_spooled_requests()
+
+
+def test_report_json_without_spool_skips_during_cooldown(edge_server, monkeypatch, tmp_path):
+    monkeypatch.setattr(edge_spool, "SPOOL_DIR", str(tmp_path / "spool"))
+    edge_health.edge_circuit_breaker.record_failure()
+
+    report_json(None, [FUNCTION_END_SPAN])
+
+    assert edge_server.spans == []
+    assert not edge_spool.has_spooled_requests()
+
+
+def test_report_json_spools_request_on_send_timeout(edge_connections, spool, monkeypatch):
+    monkeypatch.setattr(CoreConfiguration, "should_report", True)
+
+    def _create_connection(host, *args, **kwargs):
+        connection = edge_connections(host)
+        connection.request.side_effect = socket.timeout()
+        return connection
+
+    monkeypatch.setattr(http.client, "HTTPSConnection", _create_connection)
+
+    report_json(None, [FUNCTION_END_SPAN])
+
+    assert edge_health.edge_circuit_breaker.state == CircuitState.OPEN
+    assert edge_spool.take_spooled_requests() == [json.dumps([FUNCTION_END_SPAN])]
+
+
+def test_report_json_does_not_spool_request_on_response_timeout(
+    edge_connections, spool, monkeypatch
+):
+    monkeypatch.setattr(CoreConfiguration, "should_report", True)
+    edge_connections.error = socket.timeout()
+
+    report_json(None, [FUNCTION_END_SPAN])
+
+    # The edge may have accepted the request, replaying it could duplicate the spans
+    assert edge_health.edge_circuit_breaker.state == CircuitState.OPEN
+    assert edge_spool.take_spooled_requests() == []
+
+
+def test_replay_spooled_requests_drops_request_with_response_timeout(edge_connections, spool):
+    edge_spool.spool_requests(["bulk1", "bulk2"])
+    edge_connections.error = socket.timeout()
+
+    lambda_reporter._replay_spool_in_background(None)
+    _wait_for_spool_replayer()
+
+    assert edge_spool.take_spooled_requests() == ["bulk2"]
+
+
+def test_send_bulks_in_parallel_spools_bulks_after_deadline(edge_connections, spool, monkeypatch):
+    monkeypatch.setattr(lambda_reporter, "PARALLEL_SEND_DEADLINE", 0.2)
+    monkeypatch.setattr(lambda_reporter, "EDGE_CONNECTION_POOL_SIZE", 1)
+    edge_connections.request_duration = 0.5
+
+    _send_bulks_in_parallel("host", ["bulk1", "bulk2", "bulk3"])
+
+    # The first bulk is being sent, the others were never started
+    assert edge_spool.take_spooled_requests() == ["bulk2", "bulk3"]
+
+
+def test_send_bulks_in_parallel_aborts_bulks_after_deadline(edge_connections, spool, monkeypatch):
+    monkeypatch.setattr(lambda_reporter, "PARALLEL_SEND_DEADLINE", 0.2)
+    monkeypatch.setattr(lambda_reporter, "EDGE_CONNECTION_POOL_SIZE", 2)
+    aborted = threading.Event()
+
+    def _create_connection(host, *args, **kwargs):
+        connection = MagicMock(host=host)
+        connection.sock.shutdown.side_effect = lambda how: aborted.set()
+        connection.getresponse.side_effect = lambda: aborted.wait(5) and 1 / 0
+        edge_connections.connections.append(connection)
+        return connection
+
+    monkeypatch.setattr(http.client, "HTTPSConnection", _create_connection)
+
+    start_time = time.time()
+    _send_bulks_in_parallel("host", ["bulk1", "bulk2", "bulk3"])
+    lambda_reporter.edge_executor.shutdown(wait=True)
+
+    assert time.time() - start_time < 1
+    # The bulks that were being sent failed right away and were not retried
+    assert len(edge_connections.connections) == 2
+    assert all(c.close.called for c in edge_connections.connections)
+    assert sorted(edge_spool.take_spooled_requests()) == ["bulk1", "bulk2", "bulk3"]
+
+
+def test_get_edge_executor_is_created_once(monkeypatch):
+    executor = lambda_reporter._get_edge_executor()
+    monkeypatch.setattr(lambda_reporter, "EDGE_CONNECTION_POOL_SIZE", 1)
+
+    assert lambda_reporter._get_edge_executor() is executor
+
+
+def test_replay_spooled_requests_spools_back_on_failure(edge_connections, spool):
+    edge_spool.spool_requests(["bulk1", "bulk2"])
+    edge_connections.error = ConnectionResetError()
+
+    lambda_reporter._replay_spool_in_background(None)
+    _wait_for_spool_replayer()
+
+    assert edge_spool.take_spooled_requests() == ["bulk1", "bulk2"]
+
+
+def test_report_json_records_edge_rtt(edge_server):
+    report_json(None, [FUNCTION_END_SPAN])
+
+    assert edge_health.edge_rtt_stats.samples_count == 1
+    assert edge_health.edge_circuit_breaker.state == CircuitState.CLOSED
+
+
+def test_report_json_records_report_stats(edge_server, monkeypatch):
+    monkeypatch.setenv("LUMIGO_EDGE_CONTENT_ENCODING", "gzip")
+    spans = [FUNCTION_END_SPAN, HTTP_SPAN]
+
+    report_json(None, spans)
+
+    stats = report_stats.get_last_report_stats()
+    assert stats["requests"] == 1
+    assert stats["uncompressedBytes"] == len(json.dumps(spans))
+    assert 0 < stats["sentBytes"] < stats["uncompressedBytes"]
+    assert stats["connectionMs"] > 0
+    assert stats["responseMs"] > 0
+    assert stats["totalMs"] >= stats["sendMs"]
+
+
+def test_report_json_half_open_probe_closes_the_breaker(edge_server):
+    edge_health.edge_circuit_breaker.record_failure()
+    assert report_json(None, [FUNCTION_END_SPAN]) == 0
+
+    edge_health.edge_circuit_breaker.opened_at = time.time() - 3600
+    report_json(None, [HTTP_SPAN])
+
+    assert edge_server.spans == [HTTP_SPAN]
+    assert edge_health.edge_circuit_breaker.state == CircuitState.CLOSED
+
+
+def test_report_json_half_open_probe_is_taken_only_when_sending(edge_server):
+    edge_health.edge_circuit_breaker.record_failure()
+    edge_health.edge_circuit_breaker.opened_at = time.time() - 3600
+    # The request doesn't fit before the deadline, so it is not sent
+    deadline = lumigo_utils.get_current_ms_time() + 100
+    assert report_prepared_request(None, json.dumps([HTTP_SPAN]), deadline) is None
+
+    report_json(None, [HTTP_SPAN])
+
+    assert edge_server.spans == [HTTP_SPAN]
+    assert edge_health.edge_circuit_breaker.state == CircuitState.CLOSED
+
+
+def test_post_to_edge_uses_adaptive_timeout(edge_connections, monkeypatch):
+    monkeypatch.delenv("LUMIGO_EDGE_TIMEOUT", raising=False)
+    for _ in range(10):
+        edge_health.record_edge_success(0.15)
+    connection = edge_connections("host")
+
+    lambda_reporter._post_to_edge(connection, "[]")
+
+    # The timeout includes the (tiny) upload time of the request
+    assert connection.timeout == pytest.approx(0.3, abs=0.001)
+    connection.sock.settimeout.assert_called_once_with(connection.timeout)
+
+
+def test_report_json_timeout_is_recorded_as_rtt(edge_connections, monkeypatch):
+    monkeypatch.setattr(CoreConfiguration, "should_report", True)
+    monkeypatch.delenv("LUMIGO_EDGE_TIMEOUT", raising=False)
+    edge_connections.error = socket.timeout()
+
+    report_json(None, [FUNCTION_END_SPAN])
+
+    # The round-trip time was at least the timeout (less the upload time of the request)
+    assert edge_health.edge_rtt_stats.samples_count == 1
+    assert edge_health.edge_rtt_stats.percentile(100) == pytest.approx(
+        edge_health.EDGE_TIMEOUT, abs=0.01
+    )
+
+
+def test_report_json_sends_metadata_only_near_the_deadline(edge_server, monkeypatch):
+    monkeypatch.setattr(edge_health, "EDGE_THROUGHPUT", 100_000)
+    spans = [copy.deepcopy({**HTTP_SPAN, "id": str(i)}) for i in range(10)]
+    for span in spans:
+        span["info"]["httpInfo"]["request"]["body"] = os.urandom(2500).hex()
+    spans = [FUNCTION_END_SPAN] + spans
+
+    report_json(None, spans, deadline=lumigo_utils.get_current_ms_time() + 500)
+
+    assert FUNCTION_END_SPAN in edge_server.spans
+    assert any(span.get("isMetadata") for span in edge_server.spans)
+
+
+def test_report_json_skips_when_no_time_left(edge_server):
+    duration = report_json(None, [FUNCTION_END_SPAN], deadline=lumigo_utils.get_current_ms_time())
+
+    assert duration == 0
+    assert edge_server.spans == []
+
+
+def test_report_json_spools_when_no_time_left(edge_server, spool):
+    report_json(None, [FUNCTION_END_SPAN], deadline=lumigo_utils.get_current_ms_time())
+
+    assert edge_server.spans == []
+    assert edge_spool.take_spooled_requests() == [json.dumps([FUNCTION_END_SPAN])]
+    assert edge_health.edge_circuit_breaker.state == CircuitState.CLOSED
+
+
+def test_send_single_request_does_not_retry_near_the_deadline(edge_connections):
+    edge_connections.error = ConnectionResetError()
+    lambda_reporter.edge_connection = edge_connections("host")
+
+    lambda_reporter.send_single_request(
+        "host", "[]", deadline=lumigo_utils.get_current_ms_time() + 300
+    )
+    assert len(edge_connections.connections) == 1
+
+    lambda_reporter.send_single_request("host", "[]")
+    assert len(edge_connections.connections) == 2
+
+
+def test_post_to_edge_timeout_is_capped_by_the_deadline(edge_connections):
+    connection = edge_connections("host")
+
+    lambda_reporter._post_to_edge(
+        connection, "[]", deadline=lumigo_utils.get_current_ms_time() + 300
+    )
+
+    assert connection.timeout <= 0.2
+
+
+def test_timeout_at_the_deadline_does_not_open_the_breaker(edge_connections):
+    edge_connections.error = socket.timeout()
+    lambda_reporter.edge_connection = edge_connections("host")
+
+    lambda_reporter.send_single_request(
+        "host", "[]", deadline=lumigo_utils.get_current_ms_time() - 1000
+    )
+
+    assert edge_health.edge_circuit_breaker.state == CircuitState.CLOSED
+
+
+def test_report_json_to_local_collector(monkeypatch, tmp_path):
+    monkeypatch.setattr(CoreConfiguration, "should_report", True)
+    sent = []
+    monkeypatch.setenv("LUMIGO_COLLECTOR_SOCKET", str(tmp_path / "collector.sock"))
+    monkeypatch.setattr(
+        lambda_reporter, "send_to_collector", lambda *args: sent.append(args) or True
+    )
+
+    report_json(None, [FUNCTION_END_SPAN], is_start_span=True)
+    report_json(None, [FUNCTION_END_SPAN, HTTP_SPAN])
+
+    assert [(record_type, json.loads(payload)) for record_type, payload in sent] == [
+        ("span", [FUNCTION_END_SPAN]),
+        ("end", [FUNCTION_END_SPAN, HTTP_SPAN]),
+    ]
+
+
+def test_report_json_falls_back_to_the_edge_without_collector(edge_server, monkeypatch, tmp_path):
+    monkeypatch.setenv("LUMIGO_COLLECTOR_SOCKET", str(tmp_path / "missing.sock"))
+
+    report_json(None, [FUNCTION_END_SPAN])
+
+    assert edge_server.spans == [FUNCTION_END_SPAN]
+
+
+def test_post_to_edge_reconnects_stale_connection():
+    client, server = socket.socketpair()
+    connection = MagicMock(sock=client)
+    connection.getresponse.return_value.status = 200
+    server.close()
+
+    lambda_reporter._post_to_edge(connection, "[]")
+
+    connection.close.assert_called_once()
+    client.close()
+
+
+@pytest.mark.parametrize("status, state", [(503, CircuitState.OPEN), (401, CircuitState.CLOSED)])
+def test_post_to_edge_doesnt_record_error_responses_as_success(status, state):
+    connection = MagicMock()
+    connection.getresponse.return_value.status = status
+
+    lambda_reporter._post_to_edge(connection, "[]")
+
+    assert edge_health.edge_rtt_stats.samples_count == 0
+    assert edge_health.edge_circuit_breaker.state == state
+
+
+def test_establish_connection_resumes_tls_sessions():
+    connection = establish_connection("edge.lumigo.io")
+
+    assert connection._context is edge_network.get_edge_ssl_context()
+    assert connection._create_connection is edge_network.create_edge_socket
+
+
+def test_report_prepared_request(edge_server):
+    request_body = json.dumps([FUNCTION_END_SPAN, HTTP_SPAN])
+
+    assert report_prepared_request(None, request_body) is not None
+
+    assert edge_server.spans == [FUNCTION_END_SPAN, HTTP_SPAN]
+
+
+def test_report_prepared_request_doesnt_wait_for_the_edge_connection(edge_server, monkeypatch):
+    monkeypatch.setattr(lambda_reporter, "edge_connection", None)
+    lock_held, can_release = threading.Event(), threading.Event()
+
+    def _hold_the_edge_connection():
+        with lambda_reporter.edge_connection_lock:
+            lock_held.set()
+            can_release.wait(5)
+
+    holder = threading.Thread(target=_hold_the_edge_connection)
+    holder.start()
+    lock_held.wait(5)
+    try:
+        # Sent over a connection of the pool, while the shared connection is in use
+        assert report_prepared_request(None, json.dumps([FUNCTION_END_SPAN])) is not None
+        report_json(None, [HTTP_SPAN])
+    finally:
+        can_release.set()
+        holder.join()
+
+    assert edge_server.spans == [FUNCTION_END_SPAN, HTTP_SPAN]
+    assert lambda_reporter.edge_connection is None
+
+
+def test_report_prepared_request_spools_after_timeout(edge_server, monkeypatch, tmp_path):
+    monkeypatch.setenv("LUMIGO_EDGE_SPOOL", "true")
+    monkeypatch.setattr(edge_spool, "SPOOL_DIR", str(tmp_path / "spool"))
+    edge_health.edge_circuit_breaker.record_failure()
+    request_body = json.dumps([FUNCTION_END_SPAN])
+
+    # The request is handled here, without falling back to report_json
+    assert report_prepared_request(None, request_body) == 0
+
+    assert edge_server.spans == []
+    assert edge_spool.take_spooled_requests() == [request_body]
+
+
+def test_report_prepared_request_falls_back_to_report_json(edge_server, monkeypatch, tmp_path):
+    request_body = json.dumps([FUNCTION_END_SPAN])
+    monkeypatch.setenv("LUMIGO_COLLECTOR_SOCKET", str(tmp_path / "collector.sock"))
+    assert report_prepared_request(None, request_body) is None
+    monkeypatch.delenv("LUMIGO_COLLECTOR_SOCKET")
+
+    deadline = lumigo_utils.get_current_ms_time()
+    assert report_prepared_request(None, request_body, deadline=deadline) is None
+    assert report_prepared_request(CHINA_REGION, request_body) is None
+
+    assert edge_server.spans == []
@@ -0,0 +1,114 @@
+import contextlib
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import pytest
+
+from lumigo_tracer.lambda_tracer import local_collector
+from lumigo_tracer.lambda_tracer.extension_segment import (
+    RECORD_HEADER,
+    RECORD_TYPE_NAMES,
+)
+from lumigo_tracer.lambda_tracer.local_collector import (
+    connect_to_collector,
+    send_to_collector,
+)
+
+
+class Collector:
+    """
+    A local collector that reads the frames of every connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = []
+        self.connections = []
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections.append(connection)
+            threading.Thread(target=self._read_frames, args=(connection,), daemon=True).start()
+
+    def _read_frames(self, connection):
+        with connection.makefile("rb") as stream:
+            while True:
+                header = stream.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                record_type, length = RECORD_HEADER.unpack(header)
+                self.frames.append((RECORD_TYPE_NAMES[record_type], stream.read(length)))
+
+    def wait_for_frames(self, count, timeout=1):
+        deadline = time.time() + timeout
+        while len(self.frames) < count and time.time() < deadline:
+            time.sleep(0.01)
+        return self.frames
+
+    def close(self):
+        self.server.close()
+        for connection in self.connections:
+            with contextlib.suppress(OSError):
+                connection.shutdown(socket.SHUT_RDWR)
+            connection.close()
+
+
+@pytest.fixture
+def collector(monkeypatch):
+    # Unix socket paths are limited to ~100 characters, so we don't use the (long) tmp_path
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "collector.sock")
+        monkeypatch.setenv("LUMIGO_COLLECTOR_SOCKET", path)
+        collector = Collector(path)
+        yield collector
+        collector.close()
+
+
+def test_send_to_collector(collector):
+    assert send_to_collector("span", b"[1]") is True
+    assert send_to_collector("end", b"[2]") is True
+
+    assert collector.wait_for_frames(2) == [("span", b"[1]"), ("end", b"[2]")]
+    # The connection is reused
+    assert len(collector.connections) == 1
+
+
+def test_send_to_collector_without_socket(monkeypatch, tmp_path):
+    monkeypatch.setenv("LUMIGO_COLLECTOR_SOCKET", str(tmp_path / "missing.sock"))
+
+    assert connect_to_collector() is False
+    assert send_to_collector("span", b"[1]") is False
+
+
+def test_send_to_collector_not_configured(monkeypatch):
+    monkeypatch.delenv("LUMIGO_COLLECTOR_SOCKET", raising=False)
+
+    assert send_to_collector("span", b"[1]") is False
+
+
+def test_send_to_collector_reconnects_after_collector_restart(collector, monkeypatch):
+    send_to_collector("span", b"[1]")
+    collector.wait_for_frames(1)
+    collector.close()
+    os.unlink(collector.path)
+    restarted_collector = Collector(collector.path)
+
+    # The first write may still succeed on the closed connection, the following ones reconnect
+    for i in range(3):
+        send_to_collector("span", str([i]).encode())
+
+    assert restarted_collector.wait_for_frames(1)
+    assert local_collector.collector_socket is not None
+    restarted_collector.close()
@@ -0,0 +1,55 @@
+import pytest
+
+from lumigo_tracer.lambda_tracer import report_stats
+from lumigo_tracer.lambda_tracer.report_stats import PHASES, ReportStats, measure
+
+
+def test_measure_adds_to_the_phase():
+    stats = ReportStats()
+
+    with measure(stats, "send"):
+        pass
+    first = stats.phase_durations["send"]
+    with measure(stats, "send"):
+        pass
+
+    assert stats.phase_durations["send"] > first > 0
+    assert stats.phase_durations["response"] == 0
+
+
+def test_measure_without_stats():
+    with measure(None, "send"):
+        pass
+
+
+def test_measure_on_exception():
+    stats = ReportStats()
+
+    with pytest.raises(ZeroDivisionError):
+        with measure(stats, "compression"):
+            1 / 0
+
+    assert stats.phase_durations["compression"] > 0
+
+
+def test_record_report():
+    assert report_stats.get_last_report_stats() is None
+    stats = ReportStats()
+    stats.add_duration("send", 0.0012)
+    stats.uncompressed_bytes, stats.sent_bytes, stats.requests = 100, 40, 1
+
+    report_stats.record_report(stats)
+
+    recorded = report_stats.get_last_report_stats()
+    assert set(recorded) == {f"{phase}Ms" for phase in PHASES} | {
+        "totalMs",
+        "uncompressedBytes",
+        "sentBytes",
+        "requests",
+    }
+    assert recorded["sendMs"] == 1.2
+    assert (recorded["uncompressedBytes"], recorded["sentBytes"], recorded["requests"]) == (
+        100,
+        40,
+        1,
+    )
@@ -0,0 +1,176 @@
+import json
+import tracemalloc
+
+import pytest
+
+from lumigo_tracer.lambda_tracer.lambda_reporter import SerializedSpan
+from lumigo_tracer.lambda_tracer.slotted_spans import (
+    FunctionSpan,
+    HttpInfo,
+    HttpSpan,
+    RedisSpan,
+    SqlSpan,
+)
+from lumigo_tracer.lambda_tracer.spans_container import SpansContainer
+from lumigo_tracer.lumigo_utils import is_span_has_error
+
+
+def _redis_span_fields(i: int) -> dict:
+    return {
+        "id": f"span-{i}",
+        "started": 1000 + i,
+        "requestCommand": "SET",
+        "requestArgs": '["key"]',
+        "connectionOptions": {"host": "lumigo", "port": 6379},
+    }
+
+
+def test_slotted_span_is_a_mapping_of_its_set_fields():
+    span = RedisSpan(**_redis_span_fields(1))
+
+    assert span == {"type": "redis", **_redis_span_fields(1)}
+    assert "response" not in span
+    assert span.get("response") is None
+    with pytest.raises(KeyError):
+        span["response"]
+
+    span.update({"ended": 2000, "response": '"OK"'})
+    assert span["response"] == '"OK"'
+    assert len(span) == 8
+
+    del span["response"]
+    assert "response" not in span
+
+
+def test_slotted_span_extra_fields():
+    span = SqlSpan(id="1")
+    span["isMetadata"] = True
+
+    assert span["isMetadata"] is True
+    assert list(span) == ["id", "type", "isMetadata"]
+    del span["isMetadata"]
+    assert dict(span) == {"id": "1", "type": "mySql"}
+
+
+def test_slotted_span_has_no_dict():
+    assert not hasattr(RedisSpan(id="1"), "__dict__")
+
+
+def test_slotted_span_is_reported_like_a_dict():
+    SpansContainer.create_span()
+    container = SpansContainer.get_span()
+    span = container.add_span(RedisSpan(**_redis_span_fields(1), error="failed"))
+
+    full_span = container.get_full_span(span)
+
+    assert type(full_span) is dict
+    assert json.loads(SerializedSpan(full_span).dumped) == container.get_full_span(
+        {"type": "redis", **_redis_span_fields(1), "error": "failed"}
+    )
+    assert is_span_has_error(span)
+    assert container.has_error_spans()
+    assert container.error_span_ids == {"span-1"}
+
+
+def _http_span_fields(i: int) -> dict:
+    return {
+        "id": f"span-{i}",
+        "type": "http",
+        "started": 1000 + i,
+        "info": {
+            "httpInfo": {
+                "host": "lumigo.io",
+                "request": {"method": "GET", "body": ""},
+                "response": {"statusCode": 200},
+            },
+            "messageId": "message",
+        },
+    }
+
+
+def test_http_span_is_a_nested_mapping():
+    span = HttpSpan(**_http_span_fields(1))
+
+    assert span == _http_span_fields(1)
+    assert isinstance(span["info"]["httpInfo"], HttpInfo)
+    span["info"]["httpInfo"]["response"]["body"] = "ok"
+    span["info"]["resourceNames"] = ["a"]
+    assert span.to_dict() == {
+        **_http_span_fields(1),
+        "info": {
+            "httpInfo": {
+                "host": "lumigo.io",
+                "request": {"method": "GET", "body": ""},
+                "response": {"statusCode": 200, "body": "ok"},
+            },
+            "messageId": "message",
+            "resourceNames": ["a"],
+        },
+    }
+    assert type(span.to_dict()["info"]["httpInfo"]) is dict
+
+
+def test_http_span_is_reported_like_a_dict():
+    SpansContainer.create_span()
+    container = SpansContainer.get_span()
+    fields = _http_span_fields(1)
+    fields["info"]["httpInfo"]["response"]["statusCode"] = 500
+    span = container.add_span(HttpSpan(**fields))
+
+    full_span = container.get_full_span(span)
+
+    assert full_span == container.get_full_span(fields)
+    assert full_span["info"]["tracer"] == container.base_msg["info"]["tracer"]
+    assert json.loads(SerializedSpan(full_span).dumped) == full_span
+    assert container.has_error_spans()
+
+
+def test_function_span_is_reported_as_a_dict(reporter_mock):
+    SpansContainer.create_span()
+    container = SpansContainer.get_span()
+
+    assert isinstance(container.function_span, FunctionSpan)
+    container.function_span["error"] = "failed"
+    container.end()
+
+    function_span = reporter_mock.call_args.kwargs["msgs"][0]
+    assert type(function_span) is dict
+    assert function_span == container.function_span
+    assert SerializedSpan(function_span).has_error
+
+
+def _copy_span_dict(span: dict) -> dict:
+    # Copy the nested structure that a slotted span keeps in its own objects
+    span = {"type": span.get("type"), **span}
+    if "info" in span:
+        span["info"] = {**span["info"], "httpInfo": {**span["info"]["httpInfo"]}}
+    return span
+
+
+def _measure_span_memory(create_span, count: int) -> float:
+    """
+    :return: The memory of a single span (in bytes), as the average of count spans.
+    """
+    tracemalloc.start()
+    try:
+        spans = [create_span(i) for i in range(count)]
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(spans) == count
+    return size / count
+
+
+@pytest.mark.parametrize("count", [1_000, 10_000])
+@pytest.mark.parametrize(
+    "span_type, create_fields", [(RedisSpan, _redis_span_fields), (HttpSpan, _http_span_fields)]
+)
+def test_slotted_span_memory_benchmark(count, span_type, create_fields):
+    # The field values are shared, so we measure only the spans themselves
+    fields = create_fields(0)
+
+    dict_span_size = _measure_span_memory(lambda i: _copy_span_dict(fields), count)
+    slotted_span_size = _measure_span_memory(lambda i: span_type(**fields), count)
+
+    # A slotted span is about half the size of the dict, we allow a generous margin
+    assert slotted_span_size < dict_span_size - 100
@@ -0,0 +1,82 @@
+import json
+import os
+
+from lumigo_tracer.lambda_tracer.lambda_reporter import SerializedSpan
+from lumigo_tracer.lambda_tracer.span_store import (
+    SpilledSpans,
+    remove_spilled_spans_files,
+)
+
+
+def _serialized(span_id: str, **fields) -> SerializedSpan:
+    return SerializedSpan({"id": span_id, "type": "http", **fields})
+
+
+def test_spilled_spans_pop(tmpdir):
+    spilled_spans = SpilledSpans(str(tmpdir))
+    spilled_spans.spill([("1", _serialized("1")), ("2", _serialized("2", info={"a": "b"}))])
+
+    assert len(spilled_spans) == 2
+    restored = spilled_spans.pop("2")
+    assert restored.span == {"id": "2", "type": "http", "info": {"a": "b"}}
+    assert restored.dumped == _serialized("2", info={"a": "b"}).dumped
+    assert "2" not in spilled_spans
+    assert spilled_spans.pop("2") is None
+
+    # The log is still appendable after reading from it
+    spilled_spans.spill([("3", _serialized("3"))])
+    assert spilled_spans.pop("3").span["id"] == "3"
+
+
+def test_spilled_spans_read_back_by_priority(tmpdir):
+    spilled_spans = SpilledSpans(str(tmpdir))
+    spans = [_serialized(str(i)) for i in range(3)] + [_serialized("error", error="failed")]
+    spilled_spans.spill((span.span["id"], span) for span in spans)
+
+    budget = spans[0].size + spans[-1].size
+    read_back, drops = spilled_spans.read_back(["0", "1", "2", "error"], budget)
+
+    assert list(read_back) == ["error", "0"]
+    assert drops == {"http": 2}
+
+
+def test_spilled_spans_stream_by_priority(tmpdir):
+    spilled_spans = SpilledSpans(str(tmpdir))
+    spans = [_serialized(str(i)) for i in range(3)] + [_serialized("error", error="failed")]
+    spilled_spans.spill((span.span["id"], span) for span in spans)
+
+    streamed = spilled_spans.stream(["0", "2", "error", "unknown"])
+
+    assert [span.span["id"] for span in streamed] == ["error", "0", "2"]
+    # The spans are still spilled
+    assert spilled_spans.get("1").span["id"] == "1"
+    assert len(spilled_spans) == 4
+
+
+def test_remove_spilled_spans_files(tmpdir):
+    tmpdir.join("stale.log").write("[]")
+
+    remove_spilled_spans_files(str(tmpdir))
+    remove_spilled_spans_files(str(tmpdir.join("missing")))
+
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_spilled_spans_close(tmpdir):
+    spilled_spans = SpilledSpans(str(tmpdir))
+    spilled_spans.spill([("1", _serialized("1"))])
+    path = spilled_spans.path
+
+    spilled_spans.close()
+
+    assert not os.path.exists(path)
+    assert len(spilled_spans) == 0
+
+
+def test_serialized_span_from_dump():
+    span = _serialized("1", info={"a": "b"})
+
+    restored = SerializedSpan.from_dump(span.dumped)
+
+    assert restored.span == span.span == json.loads(restored.dumped)
+    assert restored.metadata.span == span.metadata.span
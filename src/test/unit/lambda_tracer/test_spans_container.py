@@ -3,6 +3,8 @@ import inspect
 import json
 import os
 import re
+import threading
+import time
 import uuid
 from datetime import datetime
 
@@ -12,8 +14,17 @@ from lumigo_core.configuration import CoreConfiguration
 from lumigo_core.scrubbing import EXECUTION_TAGS_KEY, MANUAL_TRACES_KEY
 
 from lumigo_tracer import add_execution_tag
-from lumigo_tracer.lambda_tracer import lambda_reporter
-from lumigo_tracer.lambda_tracer.lambda_reporter import get_extension_dir
+from lumigo_tracer.event.event_dumper import EventDumper
+from lumigo_tracer.lambda_tracer import (
+    edge_health,
+    lambda_reporter,
+    report_stats,
+    span_store,
+)
+from lumigo_tracer.lambda_tracer.lambda_reporter import (
+    DROPPED_SPANS_REASONS_KEY,
+    get_extension_dir,
+)
 from lumigo_tracer.lambda_tracer.spans_container import (
     ENRICHMENT_TYPE,
     FUNCTION_TYPE,
@@ -60,6 +71,276 @@ def test_start(monkeypatch):
     lumigo_utils_mock.assert_called_once_with([{"a": "a"}], "span")
 
 
+def test_spans_container_async_start_span_does_not_block(monkeypatch, reporter_mock):
+    monkeypatch.setattr(Configuration, "async_start_span", True)
+    can_finish_sending = threading.Event()
+    reporter_mock.side_effect = lambda *args, **kwargs: can_finish_sending.wait(1) and 50
+
+    SpansContainer.create_span()
+    SpansContainer.get_span().start()
+
+    assert SpansContainer.get_span().start_span_reporter.is_alive()
+    assert _is_start_span_sent() is False
+    can_finish_sending.set()
+    SpansContainer.get_span().end(None)
+
+    function_span = SpansContainer.get_span().function_span
+    assert function_span["reporter_overlapped_rtt"] == 50
+    assert function_span["reporter_rtt"] < 1000
+    start_call, end_call = reporter_mock.call_args_list
+    assert start_call.kwargs["is_start_span"] is True
+    assert start_call.kwargs["msgs"][0]["id"].endswith("_started")
+    assert end_call.kwargs["msgs"][0]["reporter_overlapped_rtt"] == 50
+
+
+def test_spans_container_end_time_excludes_async_start_span(monkeypatch, reporter_mock):
+    monkeypatch.setattr(Configuration, "async_start_span", True)
+    reporter_mock.side_effect = lambda *args, **kwargs: time.sleep(0.3) or 0
+
+    SpansContainer.create_span()
+    SpansContainer.get_span().start()
+    before_end = get_current_ms_time()
+    SpansContainer.get_span().end(None)
+
+    assert SpansContainer.get_span().function_span["ended"] - before_end < 200
+
+
+def test_spans_container_timeout_doesnt_wait_for_async_start_span(monkeypatch, reporter_mock):
+    monkeypatch.setattr(Configuration, "async_start_span", True)
+    start_span_sending, start_span_sent = threading.Event(), threading.Event()
+    calls = []
+
+    def _report_json(*args, **kwargs):
+        calls.append(kwargs)
+        if kwargs.get("is_start_span"):
+            start_span_sending.set()
+            start_span_sent.wait(5)
+        return 0
+
+    reporter_mock.side_effect = _report_json
+
+    SpansContainer.create_span()
+    SpansContainer.get_span().start()
+    start_span_sending.wait(5)
+    SpansContainer.get_span().handle_timeout()
+
+    assert SpansContainer.get_span().start_span_reporter.is_alive()
+    assert [c.get("is_start_span", False) for c in calls] == [True, False]
+
+    start_span_sent.set()
+    SpansContainer.get_span().end(None)
+    assert SpansContainer.get_span().start_span_reporter is None
+
+
+def test_spans_container_end_waits_for_async_start_span_until_the_deadline(
+    monkeypatch, reporter_mock
+):
+    monkeypatch.setattr(Configuration, "async_start_span", True)
+    start_span_sent = threading.Event()
+    reporter_mock.side_effect = lambda *args, **kwargs: (
+        kwargs.get("is_start_span") and start_span_sent.wait(5) and 0
+    )
+
+    SpansContainer.create_span()
+    SpansContainer.get_span().start()
+    SpansContainer.get_span().max_finish_time = get_current_ms_time() + 200
+    before_end = time.time()
+    SpansContainer.get_span().end(None)
+    start_span_sent.set()
+
+    assert time.time() - before_end < 2
+    assert SpansContainer.get_span().function_span["reporter_overlapped_rtt"] is None
+    assert reporter_mock.call_count == 2
+
+
+def test_spans_container_reports_with_the_invocation_deadline(monkeypatch, reporter_mock, context):
+    SpansContainer.create_span(context=context)
+    SpansContainer.get_span().start()
+    SpansContainer.get_span().handle_timeout()
+    SpansContainer.get_span().end(None)
+
+    max_finish_time = SpansContainer.get_span().max_finish_time
+    assert [c.kwargs["deadline"] for c in reporter_mock.call_args_list] == [max_finish_time] * 3
+
+
+def test_spans_container_serialize_span(reporter_mock, dummy_span):
+    SpansContainer.create_span()
+    span_id = SpansContainer.get_span().add_span(dummy_span)["id"]
+    SpansContainer.get_span().serialize_span(span_id)
+
+    serialized = SpansContainer.get_span().serialized_spans[span_id]
+    span = SpansContainer.get_span().spans[span_id]
+    assert json.loads(serialized.dumped) == SpansContainer.get_span().get_full_span(span)
+
+    SpansContainer.get_span().end(None)
+    assert reporter_mock.call_args.kwargs["cached_spans"] == {span_id: serialized}
+
+
+def test_spans_container_stores_spans_without_base_fields(reporter_mock, dummy_span):
+    SpansContainer.create_span()
+    SpansContainer.get_span().add_span(dummy_span)
+
+    assert SpansContainer.get_span().spans["span1"] == dummy_span
+
+    SpansContainer.get_span().end(None)
+    reported_span = reporter_mock.call_args.kwargs["msgs"][-1]
+    base_msg = SpansContainer.get_span().base_msg
+    assert reported_span == {
+        **base_msg,
+        **dummy_span,
+        "info": {**base_msg["info"], **dummy_span["info"]},
+    }
+
+
+def test_spans_container_spills_completed_spans(monkeypatch, reporter_mock, tmpdir):
+    monkeypatch.setattr(span_store, "SPILLED_SPANS_DIR", str(tmpdir))
+    SpansContainer.create_span()
+    container = SpansContainer.get_span()
+    span_size = lambda_reporter.SerializedSpan(
+        container.get_full_span({"id": "0", "type": "http"})
+    ).size
+    monkeypatch.setenv("LUMIGO_SPANS_MEMORY_LIMIT", str(span_size * 3))
+    # Only what fits into the request is read back
+    monkeypatch.setattr(lambda_reporter, "MAX_SIZE_FOR_REQUEST", span_size * 5)
+    for i in range(10):
+        container.add_span({"id": str(i), "type": "http"})
+        container.serialize_span(str(i))
+
+    assert len(container.serialized_spans) < 4
+    assert len(container.spans) < 4
+    assert len(container.spilled_spans) > 6
+
+    # A spilled span that is updated is read from the disk, and spilled again with the update
+    container.get_span_by_id("0")["ended"] = 1
+    container.update_event_end_time("1")
+    assert "0" not in container.spans
+    assert len(container.spans) < 4
+
+    container.end(None)
+    function_span, enrichment_span, *spans = reporter_mock.call_args.kwargs["msgs"]
+    assert {span["id"] for span in spans} <= {str(i) for i in range(10)}
+    assert {span["id"] for span in spans} >= {"0", "9"}
+    assert next(span for span in spans if span["id"] == "0")["ended"] == 1
+    drops = enrichment_span[DROPPED_SPANS_REASONS_KEY]["SPANS_STORE_SIZE_LIMIT"]
+    assert drops["drops"] == 10 - len(spans)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_spans_container_streams_spilled_spans(monkeypatch, reporter_mock, tmpdir):
+    monkeypatch.setattr(span_store, "SPILLED_SPANS_DIR", str(tmpdir))
+    monkeypatch.setenv("LUMIGO_SUPPORT_LARGE_INVOCATIONS", "true")
+    SpansContainer.create_span()
+    container = SpansContainer.get_span()
+    span_size = lambda_reporter.SerializedSpan(
+        container.get_full_span({"id": "0", "type": "http"})
+    ).size
+    monkeypatch.setenv("LUMIGO_SPANS_MEMORY_LIMIT", str(span_size * 3))
+    monkeypatch.setattr(lambda_reporter, "MAX_SIZE_FOR_REQUEST", span_size * 5)
+    streamed_span_ids = []
+
+    def _report_json(*args, streamed_spans=None, **kwargs):
+        streamed_span_ids.extend(span.span["id"] for span in streamed_spans)
+        return 0
+
+    reporter_mock.side_effect = _report_json
+    for i in range(10):
+        container.add_span({"id": str(i), "type": "http"})
+        container.serialize_span(str(i))
+    spilled_span_ids = set(container.spilled_spans.index)
+
+    container.end(None)
+
+    # All the spilled spans are streamed to the reporter, none is dropped
+    function_span, enrichment_span, *spans = reporter_mock.call_args.kwargs["msgs"]
+    assert sorted(streamed_span_ids) == sorted(spilled_span_ids)
+    assert sorted(streamed_span_ids + [span["id"] for span in spans]) == sorted(
+        str(i) for i in range(10)
+    )
+    assert DROPPED_SPANS_REASONS_KEY not in enrichment_span
+
+
+def test_spans_container_removes_stale_spilled_spans(monkeypatch, tmpdir):
+    monkeypatch.setattr(span_store, "SPILLED_SPANS_DIR", str(tmpdir))
+    SpansContainer.create_span()
+    SpansContainer.get_span().spilled_spans.spill([("1", lambda_reporter.SerializedSpan({}))])
+    # A previous invocation that crashed before closing its spilled spans
+    tmpdir.join("stale.log").write("[]")
+
+    SpansContainer.create_span(is_new_invocation=True)
+
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_spans_container_spills_unserialized_spans(monkeypatch, reporter_mock, tmpdir):
+    monkeypatch.setattr(span_store, "SPILLED_SPANS_DIR", str(tmpdir))
+    SpansContainer.create_span()
+    container = SpansContainer.get_span()
+    span_size = lambda_reporter.SerializedSpan(
+        container.get_full_span({"id": "0", "type": "aiohttp"})
+    ).size
+    monkeypatch.setenv("LUMIGO_SPANS_MEMORY_LIMIT", str(span_size * 3))
+    for i in range(10):
+        container.add_span({"id": str(i), "type": "aiohttp"})
+
+    # The spans are counted without serializing them, the last added span stays in memory
+    assert len(container.spans) < 4
+    assert len(container.spilled_spans) > 6
+    assert "9" in container.spans
+
+    container.end(None)
+    function_span, enrichment_span, *spans = reporter_mock.call_args.kwargs["msgs"]
+    assert sorted(span["id"] for span in spans) == [str(i) for i in range(10)]
+
+
+def test_spans_container_error_index(dummy_span):
+    SpansContainer.create_span()
+    container = SpansContainer.get_span()
+    container.add_span({**dummy_span, "id": "error", "error": "failed"})
+    container.add_span(dummy_span)
+
+    assert container.has_error_spans()
+    assert container.error_span_ids == {"error"}
+
+    container.pop_span("error")
+    assert not container.has_error_spans()
+
+    # A span that is fetched may be changed, so it is checked again
+    container.get_span_by_id("span1")["error"] = "failed"
+    assert container.has_error_spans()
+    assert container.error_span_ids == {"span1"}
+
+
+def test_spans_container_error_index_after_adding_an_exception(dummy_span):
+    SpansContainer.create_span()
+    container = SpansContainer.get_span()
+    span = container.add_span(dummy_span)
+    assert not container.has_error_spans()
+
+    SpansContainer.add_exception_to_span(span, ZeroDivisionError("failed"), [])
+
+    assert container.has_error_spans()
+    assert container.error_span_ids == {span["id"]}
+
+
+def test_spans_container_reports_its_error_index(reporter_mock, dummy_span):
+    SpansContainer.create_span()
+    SpansContainer.get_span().add_span({**dummy_span, "error": "failed"})
+
+    SpansContainer.get_span().end(None)
+
+    assert reporter_mock.call_args.kwargs["has_error"] is True
+
+
+def test_spans_container_serialized_span_is_dirty_after_get(dummy_span):
+    SpansContainer.create_span()
+    span_id = SpansContainer.get_span().add_span(dummy_span)["id"]
+    SpansContainer.get_span().serialize_span(span_id)
+
+    SpansContainer.get_span().get_span_by_id(span_id)["ended"] = 1
+
+    assert span_id not in SpansContainer.get_span().serialized_spans
+
+
 def test_spans_container_end_function_got_none_return_value(monkeypatch):
     SpansContainer.create_span()
     SpansContainer.get_span().start()
@@ -129,6 +410,29 @@ def test_spans_container_end_function_send_only_on_errors_mode_false_not_effecti
     assert reported_ttl is not None
 
 
+def test_enrichment_span_edge_health():
+    SpansContainer.create_span()
+    assert edge_health.EDGE_HEALTH_KEY not in SpansContainer.get_span().generate_enrichment_span()
+
+    edge_health.record_edge_success(0.1)
+
+    enrichment_span = SpansContainer.get_span().generate_enrichment_span()
+    assert enrichment_span[edge_health.EDGE_HEALTH_KEY]["circuitState"] == "closed"
+    assert enrichment_span[edge_health.EDGE_HEALTH_KEY]["rttP95Ms"] == 100
+
+
+def test_enrichment_span_reporter_stats():
+    SpansContainer.create_span()
+    assert report_stats.REPORT_STATS_KEY not in SpansContainer.get_span().generate_enrichment_span()
+
+    stats = report_stats.ReportStats()
+    stats.requests = 1
+    report_stats.record_report(stats)
+
+    enrichment_span = SpansContainer.get_span().generate_enrichment_span()
+    assert enrichment_span[report_stats.REPORT_STATS_KEY]["requests"] == 1
+
+
 def test_spans_container_add_span_span_count_updated(monkeypatch, dummy_span):
     assert SpansContainer.get_span().generate_enrichment_span().get(TOTAL_SPANS_KEY) == 2
 
@@ -161,6 +465,32 @@ def test_spans_container_end_function_with_error_double_size_limit(monkeypatch,
     assert end_span["event"] == json.dumps(event)
 
 
+def test_spans_container_end_function_with_error_reuses_the_event_dump(monkeypatch, dummy_span):
+    event = {"k": "v", "nested": {"a": 1}}
+    SpansContainer.create_span(event)
+    SpansContainer.get_span().start()
+    start_event = SpansContainer.get_span().function_span["event"]
+    event["nested"]["a"] = 2  # The handler changes its event
+    SpansContainer.get_span().add_exception_event(Exception("Some Error"), inspect.trace())
+    dump_event_mock = mock.Mock()
+    monkeypatch.setattr(EventDumper, "dump_event", dump_event_mock)
+
+    SpansContainer.get_span().end(event=event)
+
+    assert SpansContainer.get_span().function_span["event"] == start_event
+    assert json.loads(start_event) == {"k": "v", "nested": {"a": 1}}
+    dump_event_mock.assert_not_called()
+
+
+def test_spans_container_create_span_does_not_copy_the_event(monkeypatch):
+    monkeypatch.setattr(copy, "deepcopy", mock.Mock(side_effect=AssertionError("deepcopy")))
+    event = {"k": "v"}
+
+    SpansContainer.create_span(event, is_new_invocation=True)
+
+    assert SpansContainer.get_span().function_span["event"] == json.dumps(event)
+
+
 def test_spans_container_timeout_mechanism_send_only_on_errors_mode(
     monkeypatch, context, reporter_mock, dummy_span
 ):
@@ -242,6 +572,62 @@ def test_timeout_mechanism_timeout_occurred_but_finish_check_enrichment(
     ]
 
 
+@pytest.fixture
+def timeout_timer(monkeypatch):
+    monkeypatch.setattr(Configuration, "timeout_timer", True)
+    monkeypatch.setattr(TimeoutMechanism, "is_activated", lambda: True)
+    report_mock = mock.Mock(return_value=10)
+    monkeypatch.setattr(lambda_reporter, "report_prepared_request", report_mock)
+    return report_mock
+
+
+def test_timeout_sends_the_prepared_payload(timeout_timer, reporter_mock, dummy_span):
+    container = SpansContainer.create_span()
+    container.add_span(dummy_span)
+    container.serialize_span("span1")
+    prepared_dump = container.timeout_payload.dumps["span1"]
+    container.add_span({**dummy_span, "id": "span2"})
+
+    container.handle_timeout()
+
+    request_body = timeout_timer.call_args.args[1]
+    assert prepared_dump in request_body
+    sent_spans = json.loads(request_body)
+    assert [span["type"] for span in sent_spans] == [ENRICHMENT_TYPE, "http", "http"]
+    assert {span["id"] for span in sent_spans[1:]} == {"span1", "span2"}
+    assert sent_spans[1:] == [
+        container.get_full_span(container.spans[s["id"]]) for s in sent_spans[1:]
+    ]
+    assert not reporter_mock.called
+    assert not container.span_ids_to_send
+    assert len(container.timeout_payload) == 0
+
+
+def test_timeout_payload_discards_changed_span(timeout_timer, dummy_span):
+    container = SpansContainer.create_span()
+    container.add_span(dummy_span)
+    container.serialize_span("span1")
+
+    container.get_span_by_id("span1")["info"]["hello"] = "changed"
+    container.handle_timeout()
+
+    sent_spans = json.loads(timeout_timer.call_args.args[1])
+    assert sent_spans[1]["info"]["hello"] == "changed"
+
+
+def test_timeout_payload_falls_back_to_report_json(timeout_timer, reporter_mock, dummy_span):
+    timeout_timer.return_value = None
+    container = SpansContainer.create_span()
+    container.add_span(dummy_span)
+    container.serialize_span("span1")
+
+    container.handle_timeout()
+
+    messages = reporter_mock.call_args.kwargs["msgs"]
+    assert [m["type"] for m in messages] == [ENRICHMENT_TYPE, "http"]
+    assert not container.span_ids_to_send
+
+
 def test_add_tag():
     key = "my_key"
     value = "my_value"
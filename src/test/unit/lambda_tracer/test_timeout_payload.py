@@ -0,0 +1,48 @@
+import json
+
+from lumigo_tracer.lambda_tracer.lambda_reporter import SerializedSpan, get_base64_size
+from lumigo_tracer.lambda_tracer.timeout_payload import TimeoutPayload
+
+
+def _span(span_id: str, size: int = 10) -> SerializedSpan:
+    return SerializedSpan({"id": span_id, "data": "d" * size})
+
+
+def test_timeout_payload_dump():
+    payload = TimeoutPayload()
+    payload.add("1", _span("1"))
+    payload.add("2", _span("2"))
+
+    dumped = payload.dump(["1", "2"], [_span("last")])
+
+    assert json.loads(dumped) == [
+        {"id": "last", "data": "d" * 10},
+        {"id": "1", "data": "d" * 10},
+        {"id": "2", "data": "d" * 10},
+    ]
+
+
+def test_timeout_payload_add_again_and_discard():
+    payload = TimeoutPayload()
+    payload.add("1", _span("1"))
+    payload.add("1", _span("1", size=20))
+    assert payload.size == _span("1", size=20).size
+
+    payload.discard("1")
+    payload.discard("1")
+
+    assert "1" not in payload
+    assert payload.size == 0
+    assert payload.dump([], [_span("last")]) == _span("last").dumped.join("[]")
+
+
+def test_timeout_payload_max_size():
+    span = _span("1", size=100)
+    payload = TimeoutPayload(max_size=get_base64_size(span.size + 2))
+    payload.add("1", span)
+
+    payload.add("2", _span("2"))
+
+    assert len(payload) == 1
+    assert payload.dump(["1"], []) == f"[{span.dumped}]"
+    assert payload.dump(["1"], [_span("last")]) is None
@@ -128,7 +128,9 @@ def test_lambda_wrapper_exception(exc, context):
     assert "reporter_rtt" in function_span
     assert "maxFinishTime" not in function_span
     # Test that we can create an output message out of this span
-    assert _create_request_body(None, [function_span], prune_size_flag=False, should_try_zip=False)
+    assert _create_request_body(
+        None, [function_span.to_dict()], prune_size_flag=False, should_try_zip=False
+    )
 
 
 def test_lambda_wrapper_return_decimal(context):
@@ -204,6 +204,13 @@ def test_config_propagate_w3c_default_value(monkeypatch):
     assert Configuration.propagate_w3c is True
 
 
+@pytest.mark.parametrize("value, expected", (("TRUE", True), ("FALSE", False), ("", False)))
+def test_config_async_start_span_by_env(monkeypatch, value, expected):
+    monkeypatch.setenv("LUMIGO_ASYNC_START_SPAN", value)
+    config()
+    assert Configuration.async_start_span == expected
+
+
 def test_config_lumigo_auto_tag(monkeypatch):
     monkeypatch.setenv("LUMIGO_AUTO_TAG", "key1,key2")
     config()
@@ -7,6 +7,7 @@ import urllib
 from io import BytesIO
 from types import SimpleNamespace
 from typing import Dict
+from unittest.mock import MagicMock
 
 import boto3
 import pytest
@@ -19,12 +20,15 @@ import lumigo_tracer
 from lumigo_tracer.auto_tag import auto_tag_event
 from lumigo_tracer.lambda_tracer.spans_container import SpansContainer
 from lumigo_tracer.lumigo_utils import TRUNCATE_SUFFIX, Configuration
-from lumigo_tracer.wrappers.http.http_data_classes import HttpRequest
+from lumigo_tracer.wrappers.http.http_data_classes import HttpRequest, HttpState
 from lumigo_tracer.wrappers.http.http_parser import Parser
 from lumigo_tracer.wrappers.http.sync_http_wrappers import (
     _putheader_wrapper,
+    _read_wrapper,
     add_request_event,
+    get_lumigo_connection_id,
     is_lumigo_edge,
+    set_lumigo_connection_id,
     update_event_response,
 )
 
@@ -346,6 +350,31 @@ def test_requests_failure_with_kwargs(monkeypatch, context, token):
     assert span["info"]["httpInfo"]["request"]["method"] == "POST"
 
 
+def test_requests_failure_is_reported_when_sending_only_if_error(
+    monkeypatch, context, token, reporter_mock
+):
+    monkeypatch.setenv("LUMIGO_SYNC_TRACING", "true")
+    monkeypatch.setenv("SEND_ONLY_IF_ERROR", "true")
+
+    @lumigo_tracer.lumigo_tracer()
+    def lambda_test_function(event, context):
+        try:
+            requests.post("https://www.google.com", data=b"123")
+        except ZeroDivisionError:
+            return True
+        return False
+
+    monkeypatch.setattr(socket, "getaddrinfo", lambda *args, **kwargs: 1 / 0)
+
+    assert lambda_test_function({}, context) is True
+
+    assert SpansContainer.get_span().has_error_spans()
+    reporter_mock.assert_called_once()
+    assert reporter_mock.call_args.kwargs["has_error"] is True
+    http_span = reporter_mock.call_args.kwargs["msgs"][-1]
+    assert http_span["error"]["message"] == "division by zero"
+
+
 def test_wrapping_with_tags_for_api_gw_headers(monkeypatch, context, token, lambda_traced):
     monkeypatch.setattr(auto_tag_event, "AUTO_TAG_API_GW_HEADERS", ["Accept"])
 
@@ -532,6 +561,31 @@ def test_aggregating_response_body():
     assert body[: -len(TRUNCATE_SUFFIX)] in json.dumps(big_response_chunk.decode())
 
 
+def test_read_wrapper_serializes_span_when_response_is_read():
+    SpansContainer.create_span()
+    span = add_request_event(
+        None,
+        HttpRequest(
+            host="dummy", method="dummy", uri="dummy", headers={"dummy": "dummy"}, body="dummy"
+        ),
+    )
+    response = MagicMock(code=200, headers={})
+    set_lumigo_connection_id(response)
+    HttpState.response_id_to_span_id[get_lumigo_connection_id(response)] = span["id"]
+
+    response.isclosed.return_value = False
+    _read_wrapper(lambda: b"chunk1", response, (), {})
+    # More chunks may be read, so the span is not serialized yet
+    assert span["id"] not in SpansContainer.get_span().serialized_spans
+
+    response.isclosed.return_value = True
+    _read_wrapper(lambda: b"chunk2", response, (), {})
+    body = SpansContainer.get_span().spans[span["id"]]["info"]["httpInfo"]["response"]["body"]
+    assert "chunk1chunk2" in body
+    serialized = SpansContainer.get_span().serialized_spans[span["id"]]
+    assert json.loads(serialized.dumped)["info"]["httpInfo"]["response"]["body"] == body
+
+
 def test_double_response_size_limit_on_error_status_code(context, monkeypatch, token):
     d = {"a": "v" * int(CoreConfiguration.get_max_entry_size() * 1.5)}
     original_begin = http.client.HTTPResponse.begin
@@ -35,6 +35,7 @@ def test_execute_command_wrapper_happy_flow(instance: SimpleNamespace):
     assert spans[0]["response"] == '"Result"'
     assert "error" not in spans[0]
     assert result == FUNCTION_RESULT
+    assert spans[0]["id"] in SpansContainer.get_span().serialized_spans
 
 
 def test_execute_command_wrapper_non_json(instance: SimpleNamespace):
@@ -63,6 +64,7 @@ def test_execute_command_wrapper_failing_command(instance: SimpleNamespace):
     assert spans[0]["ended"] >= spans[0]["started"]
     assert spans[0]["error"] == "division by zero"
     assert "response" not in spans[0]
+    assert SpansContainer.get_span().error_span_ids == {spans[0]["id"]}
 
 
 def test_execute_command_wrapper_unexpected_params(instance: SimpleNamespace):